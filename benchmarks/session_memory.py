@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Memory used per connected device
+
+Parses credentials for lots of fake devices spread over a few projects and
+reports the bytes allocated per device (measured with tracemalloc) for:
+
+- the old layout, where the api and auth objects each split the username
+  and password into their own attributes (reproduced here for comparison)
+- the parsed Credentials shared by the api and auth objects
+- an entry in the session table
+
+Usage:
+
+    python benchmarks/session_memory.py [--devices 100000] [--projects 100]
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from overlockmqttauth.api import parse_connection
+from overlockmqttauth.auth.base import MQTTAuth
+from overlockmqttauth.sessions import SessionTable
+
+
+class OldV1API:
+
+    def __init__(self, user, password):
+        self.user = user
+        self._password = password
+        (self._secret_type, self._secret) = password.split(":")
+        (_, self._project_id, self._product_name, self._device_id) = user.split(":")
+
+
+class OldAuth:
+
+    def __init__(self, username, password, client_id):
+        self._username = username
+        (_, self._project_id, self._product_name, self._device_id) = username.split(":")
+        self._secret_type, self._secret = password.split(":")
+        self._password = password
+        self._client_id = client_id
+
+
+class NewAuth(MQTTAuth):
+
+    __slots__ = ()
+
+    blacklisted = False
+    authenticated = True
+
+
+def fake_devices(num_devices, num_projects):
+    for i in range(num_devices):
+        project_id = "{:024x}".format(i % num_projects)
+        username = "v1:{}:aircon:0x{:08x}".format(project_id, i)
+        password = "p:{:032x}".format(i % num_projects)
+        client_id = "g:{}:aircon:0x{:08x}".format(project_id, i)
+        yield (username, password, client_id)
+
+
+def measure(name, devices, make):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    kept = [make(*device) for device in devices]
+
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Don't count the list holding them
+    per_device = (after - before - kept.__sizeof__()) / len(kept)
+    print("{:<40} {:>8.0f} bytes/device".format(name, per_device))
+
+    return kept
+
+
+def old_connection(username, password, client_id):
+    return (OldV1API(username, password), OldAuth(username, password, client_id))
+
+
+def new_connection(username, password, client_id):
+    api = parse_connection(username, password)
+    return (api, NewAuth(api.credentials, client_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--projects", type=int, default=100)
+    args = parser.parse_args()
+
+    # Strings come in from the request, so they're already allocated
+    devices = list(fake_devices(args.devices, args.projects))
+
+    print("{} devices in {} projects".format(args.devices, args.projects))
+
+    measure("old api + auth objects", devices, old_connection)
+    measure("shared credentials + api + auth", devices, new_connection)
+
+    table = SessionTable(maxsize=len(devices))
+
+    def add_session(username, password, client_id):
+        api = parse_connection(username, password)
+        table.add(username, client_id, "", project_id=api.project_id,
+            device=(api.project_id, api.credentials.product_name, api.device_id))
+
+    measure("session table entry", devices, add_session)
+
+
+if __name__ == "__main__":
+    main()
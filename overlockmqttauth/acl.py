@@ -0,0 +1,437 @@
+"""Topic ACLs compiled into a trie
+
+Every ACL pattern is an MQTT topic filter, so all of the patterns for a user
+(or project, or the built in defaults) are compiled into one trie keyed on
+topic levels. Checking a topic walks its levels once, however many patterns
+there are, instead of trying a regex per pattern.
+
+Patterns can use the MQTT wildcards ``+`` (exactly one level) and ``#`` (any
+number of levels, must be last) and these substitutions, as in vernemq, which
+must take up a whole level:
+
+- ``%u``: username
+- ``%c``: client id
+- ``%m``: mountpoint
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+from overlockmqttauth.auth.cache import TTLCache, MISSING
+
+
+logger = logging.getLogger(__name__)
+
+
+PUBLISH = "publish"
+SUBSCRIBE = "subscribe"
+
+SUBSTITUTIONS = {
+    "%u": "username",
+    "%c": "client_id",
+    "%m": "mountpoint",
+}
+
+
+Identity = namedtuple("Identity", ["username", "client_id", "mountpoint"])
+
+
+class _Node:
+
+    __slots__ = ("children", "plus", "subs", "multi", "terminal")
+
+    def __init__(self):
+        # level -> _Node
+        self.children = {}
+        # child for '+'
+        self.plus = None
+        # identity field -> _Node for substitutions
+        self.subs = {}
+        # a '#' ends here
+        self.multi = False
+        # a pattern ends here
+        self.terminal = False
+
+
+class TopicTrie:
+    """A set of topic filters compiled for matching
+
+    Args:
+        patterns (list(str)): topic filters to add
+    """
+
+    def __init__(self, patterns=()):
+        self._root = _Node()
+        self.patterns = []
+
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def add(self, pattern):
+        """Add a topic filter
+
+        Raises:
+            ValueError: invalid filter
+        """
+
+        levels = pattern.split("/")
+        node = self._root
+
+        for (i, level) in enumerate(levels):
+            if level == "#":
+                if i != len(levels) - 1:
+                    raise ValueError("'#' must be the last level in '{}'".format(pattern))
+                node.multi = True
+                break
+
+            if ("#" in level or "+" in level) and level != "+":
+                raise ValueError("Wildcards must take up a whole level in '{}'".format(pattern))
+
+            if level == "+":
+                if node.plus is None:
+                    node.plus = _Node()
+                node = node.plus
+            elif level in SUBSTITUTIONS:
+                node = node.subs.setdefault(SUBSTITUTIONS[level], _Node())
+            else:
+                node = node.children.setdefault(level, _Node())
+        else:
+            node.terminal = True
+
+        self.patterns.append(pattern)
+
+    def matches(self, topic, identity=None):
+        """Whether any filter matches the topic
+
+        Args:
+            topic (str): topic being published/subscribed to
+            identity (Identity): for substitutions. If not given, patterns
+                with substitutions never match
+
+        Returns:
+            bool: if it matches
+        """
+
+        active = [self._root]
+
+        for (i, level) in enumerate(topic.split("/")):
+            # Wildcards at the start don't match $SYS etc.
+            wildcards = i > 0 or not level.startswith("$")
+
+            # Subscribing with a wildcard is only allowed where the pattern
+            # has one at least as broad
+            if level == "#":
+                return wildcards and any(node.multi for node in active)
+            literal = level != "+"
+
+            matched = []
+
+            for node in active:
+                if node.multi and wildcards:
+                    return True
+
+                if literal:
+                    child = node.children.get(level)
+                    if child is not None:
+                        matched.append(child)
+
+                if node.plus is not None and wildcards:
+                    matched.append(node.plus)
+
+                if node.subs and literal and identity is not None:
+                    for (field, sub) in node.subs.items():
+                        if getattr(identity, field) == level:
+                            matched.append(sub)
+
+            if not matched:
+                return False
+
+            active = matched
+
+        # 'a/#' also matches 'a'
+        return any(node.terminal or node.multi for node in active)
+
+
+def _has_wildcards(topic):
+    return any(level in ("+", "#") for level in topic.split("/"))
+
+
+class ACLEngine:
+    """Checks topics against default patterns and ones from the database
+
+    The defaults are checked first. Only if they don't match are the (cached,
+    compiled) patterns for the connection's project and then user looked up.
+
+    The defaults are for anyone, so they only ever allow literal topics -
+    otherwise eg. ``iot-2/type/+/id/+/cmd/+/fmt/+`` in the defaults would let
+    any device subscribe to every device's commands. Wildcard subscriptions
+    have to be allowed by project or user rules.
+
+    Args:
+        publish (list(str)): patterns anyone can publish to
+        subscribe (list(str)): patterns anyone can subscribe to
+        loader (callable): takes ('project', project id) or ('user',
+            username) and returns a dict of {'publish': [patterns],
+            'subscribe': [patterns]}, or None if there is nothing for it
+        cache_size (int): number of compiled rule sets to cache
+        ttl (float): seconds to cache compiled rule sets for
+    """
+
+    def __init__(self, publish, subscribe, loader=None, cache_size=10000, ttl=60):
+        self.defaults = {
+            PUBLISH: TopicTrie(publish),
+            SUBSCRIBE: TopicTrie(subscribe),
+        }
+        self.loader = loader
+
+        # (kind, key) -> {action: TopicTrie}, or None
+        self._compiled = TTLCache(cache_size, ttl)
+
+    def _rules(self, kind, key):
+        rules = self._compiled.get((kind, key))
+
+        if rules is not MISSING:
+            return rules
+
+        try:
+            loaded = self.loader(kind, key)
+        except Exception: # pylint: disable=broad-except
+            # Not cached, so it's retried next time
+            logger.exception("Error loading ACLs for %s '%s'", kind, key)
+            return None
+
+        if loaded is None:
+            rules = None
+        else:
+            rules = {}
+            for action in (PUBLISH, SUBSCRIBE):
+                trie = TopicTrie()
+                for pattern in loaded.get(action) or ():
+                    try:
+                        trie.add(pattern)
+                    except ValueError:
+                        logger.warning("Ignoring invalid ACL for %s '%s': %s", kind, key, pattern)
+                rules[action] = trie
+
+        self._compiled.set((kind, key), rules)
+
+        return rules
+
+    def _extra_rules(self, action, identity, project_id):
+        """Compiled project and user rules for an action, loaded lazily"""
+
+        if self.loader is None:
+            return
+
+        for (kind, key) in (("project", project_id), ("user", identity.username)):
+            if key is None:
+                continue
+
+            rules = self._rules(kind, key)
+
+            if rules is not None:
+                yield rules[action]
+
+    def allowed(self, action, topic, identity, project_id=None):
+        """Whether this identity can publish/subscribe to a topic
+
+        Args:
+            action (str): PUBLISH or SUBSCRIBE
+            topic (str): topic, or topic filter for subscriptions
+            identity (Identity): who is connected
+            project_id (str): project the connection belongs to, if known
+
+        Returns:
+            bool: if it is allowed
+        """
+
+        if not _has_wildcards(topic) and self.defaults[action].matches(topic, identity):
+            return True
+
+        for trie in self._extra_rules(action, identity, project_id):
+            if trie.matches(topic, identity):
+                return True
+
+        return False
+
+    def allowed_many(self, action, topics, identity, project_id=None):
+        """Check several topics at once, eg. for one subscribe request
+
+        The project/user rules are looked up at most once for all of the
+        topics, and only if the defaults don't allow all of them.
+
+        Returns:
+            list(bool): whether each topic is allowed, in order
+        """
+
+        defaults = self.defaults[action]
+        results = [not _has_wildcards(topic) and defaults.matches(topic, identity)
+            for topic in topics]
+
+        if all(results):
+            return results
+
+        for trie in self._extra_rules(action, identity, project_id):
+            for (i, topic) in enumerate(topics):
+                if not results[i]:
+                    results[i] = trie.matches(topic, identity)
+
+        return results
+
+    def invalidate(self, kind, key):
+        """Forget compiled rules, eg. because they changed in the database"""
+        self._compiled.invalidate((kind, key))
+
+    def clear(self):
+        self._compiled.clear()
+
+    def stats(self):
+        return self._compiled.stats()
+
+
+class _ClientDecisions:
+
+    __slots__ = ("username", "mountpoint", "project_id", "expires", "decisions")
+
+    def __init__(self, username, mountpoint, project_id, expires):
+        self.username = username
+        self.mountpoint = mountpoint
+        self.project_id = project_id
+        self.expires = expires
+        # action -> {topic: allowed}
+        self.decisions = {PUBLISH: {}, SUBSCRIBE: {}}
+
+
+class DecisionCache:
+    """Remembers ACL decisions per connected client
+
+    Devices publish to the same few topics over and over, so once a topic has
+    been checked for a client the answer is kept until the client disconnects
+    (evict()), its project's or user's ACLs change (invalidate()) or ttl
+    passes. Entries are per client id so a disconnect drops all of them at
+    once, and checked against the username/mountpoint they were made for so a
+    different user reusing the client id doesn't get them.
+
+    Args:
+        maxsize (int): number of clients to remember decisions for before the
+            least recently used are evicted. 0 disables caching
+        ttl (float): seconds to keep a client's decisions for
+        max_topics (int): topics per client per action. Past this the client's
+            decisions for that action are dropped, so a client using lots of
+            unique topics can't use up all the memory
+        timer (callable): returns the current time in seconds
+    """
+
+    def __init__(self, maxsize, ttl, max_topics=100, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_topics = max_topics
+        self._timer = timer
+
+        # client id -> _ClientDecisions
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, action, topic, username, client_id, mountpoint):
+        """Get a cached decision
+
+        Returns:
+            bool: whether it was allowed, or None if it isn't cached
+        """
+
+        with self._lock:
+            entry = self._clients.get(client_id)
+
+            if entry is not None \
+            and entry.username == username \
+            and entry.mountpoint == mountpoint \
+            and entry.expires > self._timer():
+                allowed = entry.decisions[action].get(topic)
+
+                if allowed is not None:
+                    self._clients.move_to_end(client_id)
+                    self.hits += 1
+                    return allowed
+
+            self.misses += 1
+            return None
+
+    def set(self, action, topic, identity, project_id, allowed):
+        """Remember a decision
+
+        Args:
+            action (str): PUBLISH or SUBSCRIBE
+            topic (str): topic that was checked
+            identity (Identity): who it was checked for
+            project_id (str): project whose ACLs were used, if any
+            allowed (bool): decision
+        """
+
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            entry = self._clients.get(identity.client_id)
+
+            if entry is None \
+            or entry.username != identity.username \
+            or entry.mountpoint != identity.mountpoint \
+            or entry.expires <= self._timer():
+                entry = _ClientDecisions(identity.username, identity.mountpoint,
+                    project_id, self._timer() + self.ttl)
+                self._clients[identity.client_id] = entry
+
+            decisions = entry.decisions[action]
+            if len(decisions) >= self.max_topics:
+                decisions.clear()
+            decisions[topic] = allowed
+
+            self._clients.move_to_end(identity.client_id)
+
+            while len(self._clients) > self.maxsize:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+
+    def evict(self, client_id):
+        """Forget decisions for a client, eg. because it disconnected"""
+        with self._lock:
+            self._clients.pop(client_id, None)
+
+    def invalidate(self, kind, key):
+        """Forget decisions made with a project's or user's ACLs"""
+
+        attr = "project_id" if kind == "project" else "username"
+
+        with self._lock:
+            stale = [client_id for (client_id, entry) in self._clients.items()
+                if getattr(entry, attr) == key]
+
+            for client_id in stale:
+                del self._clients[client_id]
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "clients": len(self._clients),
+        }
@@ -1,17 +1,50 @@
 import logging
-from .v1 import V1API
+from .credentials import Credentials
+from .v1 import V1API, API_V1
+from .v2 import V2API, API_V2
 
 
 logger = logging.getLogger(__name__)
 
 
-def parse_connection(username, password):
-    if username.startswith("v1"):
-        return V1API(username, password)
+API_PARSERS = {
+    "v1": V1API,
+    "v2": V2API,
+}
+
+
+def parse_connection(username, password, api_type=None):
+    """Parse a connection's username and password
+
+    This is the only place they're parsed - the returned api's credentials
+    are passed on to the auth backend
+
+    Args:
+        username (str): username
+        password (str): password
+        api_type (str): only accept this api ('v1', 'v2'). Defaults to the
+            one the username starts with
+
+    Returns:
+        MQTTAPIVer: api for the connection, with .credentials
+    """
+
+    if api_type is None:
+        api_type = username.split(":", 1)[0]
+
+    try:
+        api = API_PARSERS[api_type]
+    except KeyError:
+        logger.error("Can't handle username '%s'", username)
+        raise ValueError("Invalid username")
+
+    return api.parse(username, password)
 
-    logger.error("Can't handle username '%s'", username)
-    raise Exception("Invalid username")
 
 __all__ = [
+    "API_V1",
+    "API_V2",
+    "API_PARSERS",
+    "Credentials",
     "parse_connection",
 ]
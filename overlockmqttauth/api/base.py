@@ -2,6 +2,9 @@ from abc import ABCMeta, abstractproperty
 
 
 class MQTTAPIVer(metaclass=ABCMeta):
+    """Connection api, wrapping the parsed Credentials of a connection"""
+
+    __slots__ = ()
 
     @abstractproperty
     def api_version(self):
@@ -0,0 +1,48 @@
+import sys
+
+
+class Credentials:
+    """Username and password of a connection, parsed once
+
+    Shared by the api (V1API etc.) and auth (MQTTAuth) objects for a
+    connection, and kept for as long as the client is connected, so it is
+    slotted and the project id and product name - which are the same for
+    lots of devices - are interned so that every connection from a project
+    points at one copy.
+
+    Attributes:
+        api_version (int): which api the username is for
+        username (str): whole username
+        password (str): whole password, including the secret type prefix
+        project_id (str): project id (interned)
+        product_name (str): product name (interned)
+        device_id (str): device id
+        secret_type (str): 'p' for a project secret, 'd' for a device secret
+        secret (str): password without the prefix
+    """
+
+    __slots__ = (
+        "api_version",
+        "username",
+        "password",
+        "project_id",
+        "product_name",
+        "device_id",
+        "secret_type",
+        "secret",
+    )
+
+    def __init__(self, api_version, username, password, project_id,
+            product_name, device_id, secret_type, secret):
+        self.api_version = api_version
+        self.username = username
+        self.password = password
+        self.project_id = sys.intern(project_id)
+        self.product_name = sys.intern(product_name)
+        self.device_id = device_id
+        self.secret_type = sys.intern(secret_type)
+        self.secret = secret
+
+    def __repr__(self):
+        # Not the password
+        return "Credentials(v{}, {!r})".format(self.api_version, self.username)
@@ -1,4 +1,5 @@
 from .base import MQTTAPIVer
+from .credentials import Credentials
 
 
 API_V1 = 1
@@ -6,15 +7,34 @@ API_V1 = 1
 
 class V1API(MQTTAPIVer):
 
-    def __init__(self, user, password): #, client_id):
-        self.user = user
-        # self.client_id = client_id
+    __slots__ = ("credentials",)
 
-        self._password = password
-        (self._secret_type, self._secret) = password.split(":")
-        (api_ver, self._project_id, self._product_name, self._device_id) = user.split(":")
+    def __init__(self, credentials):
+        self.credentials = credentials
 
-        assert api_ver == "v1"
+    @classmethod
+    def parse(cls, user, password):
+        """Parse a v1 username and password
+
+        Args:
+            user (str): 'v1:<project id>:<product name>:<device id>'
+            password (str): '<secret type>:<secret>'
+
+        Returns:
+            V1API: api for the connection
+
+        Raises:
+            ValueError: not a valid v1 username/password
+        """
+
+        (secret_type, secret) = password.split(":")
+        (api_ver, project_id, product_name, device_id) = user.split(":")
+
+        if api_ver != "v1":
+            raise ValueError("Not a v1 username")
+
+        return cls(Credentials(API_V1, user, password, project_id,
+            product_name, device_id, secret_type, secret))
 
     @property
     def api_version(self):
@@ -69,12 +89,12 @@ class V1API(MQTTAPIVer):
 
     @property
     def project_id(self):
-        return self._project_id
+        return self.credentials.project_id
 
     @property
     def device_id(self):
-        return self._device_id
+        return self.credentials.device_id
 
     @property
     def secret_type(self):
-        return self._secret_type
+        return self.credentials.secret_type
@@ -0,0 +1,57 @@
+from .base import MQTTAPIVer
+from .credentials import Credentials
+
+
+API_V2 = 2
+
+
+class V2API(MQTTAPIVer):
+    """Same username as v1, but the password is a signed token
+
+    See overlockmqttauth/auth/tokens.py
+    """
+
+    __slots__ = ("credentials",)
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    @classmethod
+    def parse(cls, user, password):
+        """Parse a v2 username and password
+
+        Args:
+            user (str): 'v2:<project id>:<product name>:<device id>'
+            password (str): 't:<key id>.<expiry>.<signature>'
+
+        Returns:
+            V2API: api for the connection
+
+        Raises:
+            ValueError: not a valid v2 username/password
+        """
+
+        (secret_type, secret) = password.split(":")
+        (api_ver, project_id, product_name, device_id) = user.split(":")
+
+        if api_ver != "v2":
+            raise ValueError("Not a v2 username")
+
+        return cls(Credentials(API_V2, user, password, project_id,
+            product_name, device_id, secret_type, secret))
+
+    @property
+    def api_version(self):
+        return API_V2
+
+    @property
+    def project_id(self):
+        return self.credentials.project_id
+
+    @property
+    def device_id(self):
+        return self.credentials.device_id
+
+    @property
+    def secret_type(self):
+        return self.credentials.secret_type
@@ -1,17 +1,29 @@
+import asyncio
 from abc import ABCMeta, abstractproperty
 
 
 class MQTTAuth(metaclass=ABCMeta):
+    """Authenticates a connection
 
-    def __init__(self, username, password, client_id):
-        self._username = username
-        (_, self._project_id, self._product_name, self._device_id) = username.split(":")
+    Args:
+        credentials (Credentials): parsed username/password, see
+            overlockmqttauth.api.parse_connection
+        client_id (str): client id
+    """
 
-        self._secret_type, self._secret = password.split(":")
-        self._password = password
+    __slots__ = ("_credentials", "_client_id")
 
+    # Whether mongodb has to be connected to before this is used
+    requires_mongodb = False
+
+    def __init__(self, credentials, client_id):
+        self._credentials = credentials
         self._client_id = client_id
 
+    @classmethod
+    def start(cls):
+        """Set up anything the backend needs, in each worker process"""
+
     @abstractproperty
     def blacklisted(self):
         """Whether this connection has been blacklisted
@@ -39,3 +51,20 @@ class MQTTAuth(metaclass=ABCMeta):
         Returns:
             bool: if this connection 'method' is valid
         """
+
+    async def authenticate(self):
+        """authenticated, for coroutines
+
+        Backends that do I/O should override this with a native version.
+        Otherwise backends using mongodb are run in the default executor so
+        the event loop isn't blocked, and others are just called.
+        """
+        if self.requires_mongodb:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, lambda: self.authenticated)
+
+        return self.authenticated
+
+    async def check_blacklisted(self):
+        """blacklisted, for coroutines"""
+        return self.blacklisted
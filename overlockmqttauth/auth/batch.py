@@ -0,0 +1,117 @@
+"""Batch lookups from concurrent callers into one query
+
+The first caller to ask for something opens a batch and waits for up to
+`window` seconds (or until `max_batch` keys have been asked for) while other
+threads add their keys to it. It then resolves the whole batch with one call
+to `load_many` and hands each waiting caller its own result. This trades a
+small, bounded amount of latency for far fewer database round trips when lots
+of different clients connect at once.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Batch:
+
+    def __init__(self):
+        # Used as an ordered set
+        self.keys = OrderedDict()
+        self.closed = False
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class BatchLoader:
+    """Collects lookups from concurrent threads and resolves them together
+
+    Args:
+        load_many (callable): takes a list of keys, returns a dict of key ->
+            result. Keys missing from the dict resolve to None
+        window (float): seconds to wait for more keys before loading
+        max_batch (int): load as soon as this many keys have been collected
+    """
+
+    def __init__(self, load_many, window=0.002, max_batch=100):
+        self.load_many = load_many
+        self.window = window
+        self.max_batch = max_batch
+
+        self._cond = threading.Condition()
+        self._pending = None
+
+        self.batches = 0
+        self.keys_loaded = 0
+        self.largest_batch = 0
+        self.wait_seconds = 0.0
+
+    def load(self, key):
+        """Load one key as part of a batch
+
+        Args:
+            key (object): key to load
+
+        Returns:
+            object: result for key from load_many
+
+        Raises:
+            Exception: whatever load_many raised for the batch
+        """
+
+        with self._cond:
+            batch = self._pending
+            leader = batch is None
+
+            if leader:
+                batch = self._pending = _Batch()
+
+            batch.keys[key] = None
+
+            if len(batch.keys) >= self.max_batch:
+                batch.closed = True
+                self._pending = None
+                self._cond.notify_all()
+
+            if leader:
+                start = time.monotonic()
+                self._cond.wait_for(lambda: batch.closed, timeout=self.window)
+
+                if self._pending is batch:
+                    self._pending = None
+                batch.closed = True
+
+                self.wait_seconds += time.monotonic() - start
+
+        if not leader:
+            batch.done.wait()
+
+            if batch.error is not None:
+                raise batch.error
+
+            return batch.results.get(key)
+
+        keys = list(batch.keys)
+
+        try:
+            batch.results = self.load_many(keys)
+        except Exception as e:
+            batch.error = e
+            raise
+        finally:
+            self.batches += 1
+            self.keys_loaded += len(keys)
+            self.largest_batch = max(self.largest_batch, len(keys))
+            batch.done.set()
+
+        return batch.results.get(key)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "keys": self.keys_loaded,
+            "largest_batch": self.largest_batch,
+            "mean_batch": (self.keys_loaded / self.batches) if self.batches else 0,
+            "mean_wait_seconds": (self.wait_seconds / self.batches) if self.batches else 0,
+        }
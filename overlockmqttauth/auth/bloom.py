@@ -0,0 +1,47 @@
+import math
+
+
+class BloomFilter:
+    """Fixed size Bloom filter for strings
+
+    Answers "definitely not in the set" or "possibly in the set", never a
+    false negative. Uses python's own (per process, randomised) string hash,
+    which is cached on the string object, so checking the same string again is
+    very cheap. That also means a filter can't be shared between processes.
+
+    Args:
+        capacity (int): number of items expected
+        error_rate (float): acceptable false positive rate at capacity
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _indexes(self, item):
+        # Double hashing - Kirsch & Mitzenmacher. Both come from the one
+        # (cached) string hash, so a check doesn't hash anything else
+        h1 = hash(item)
+        h2 = (h1 >> 17) | 1
+
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item):
+        for index in self._indexes(item):
+            self._bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        for index in self._indexes(item):
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Returned by TTLCache.get when there's nothing cached, because None is a
+# valid (negative) cached value
+MISSING = object()
+
+
+class TTLCache:
+    """Thread safe LRU cache where entries also expire after a while
+
+    None can be cached to remember that something does not exist (negative
+    caching). Negative entries usually want a shorter lifetime than positive
+    ones so that something created after a failed lookup shows up quickly, so
+    they use negative_ttl instead.
+
+    Args:
+        maxsize (int): maximum number of entries before the least recently
+            used are evicted. 0 disables caching entirely
+        ttl (float): seconds until a cached value expires
+        negative_ttl (float): seconds until a cached None expires. Defaults to
+            ttl
+        timer (callable): returns the current time in seconds
+    """
+
+    def __init__(self, maxsize, ttl, negative_ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._timer = timer
+
+        # key -> (value, expires at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=MISSING):
+        """Get a cached value
+
+        Args:
+            key (object): key to look up
+            default (object): returned if nothing is cached or it has expired
+
+        Returns:
+            object: cached value (possibly None), or default
+        """
+
+        with self._lock:
+            try:
+                (value, expires) = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires <= self._timer():
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+
+            return value
+
+    def set(self, key, value):
+        """Cache a value, evicting the least recently used entry if full
+
+        Args:
+            key (object): key to store under
+            value (object): value to cache. None caches a negative result
+        """
+
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.negative_ttl if value is None else self.ttl
+
+        with self._lock:
+            self._entries[key] = (value, self._timer() + ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Remove a key if it is cached"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for monitoring
+
+        Returns:
+            dict: hits, negative hits, misses, evictions and current size
+        """
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
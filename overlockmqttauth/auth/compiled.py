@@ -0,0 +1,424 @@
+"""Auth from a compiled snapshot file, without a database
+
+For deployments without mongodb, the projects, secrets and devices (shaped
+like auth_data.py) are compiled into one file which is memory mapped and
+searched in place, so nothing is deserialised at startup and a lookup only
+touches a few pages.
+
+File layout (little endian):
+
+- header: magic (8 bytes), number of entries (u32), reserved (u32)
+- hashes: the key hash (u64) of every entry, sorted
+- locations: (record offset u32, record length u32) of every entry, in the
+  same order
+- records: key bytes followed by a flags byte
+
+Keys are NUL separated strings:
+
+- ``p <project id>``: a project
+- ``s <project id> <secret>``: a project secret
+- ``v <project id> <device id>``: a device
+- ``d <project id> <device id> <secret>``: a device secret
+
+Looking something up hashes its key, binary searches the hashes (with
+bisect, directly on the mapped memory) and compares the record's key to rule
+out hash collisions.
+
+Compile with compile_snapshot(), or from JSON:
+
+    python -m overlockmqttauth.auth.compiled auth.json auth.snapshot
+
+.. code-block:: python
+
+    {
+        "projects": [
+            {
+                "id": "abc123",
+                "blacklisted": false,
+                "secrets": [{"val": "sdkg40wkgk3pok32", "blacklisted": false}]
+            }
+        ],
+        "devices": [
+            {
+                "project": "abc123",
+                "device_id": "blapt",
+                "secret": {"val": "2123122413423", "blacklisted": false}
+            }
+        ]
+    }
+
+Secrets don't include the 'p:'/'d:' prefix.
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from overlockmqttauth import stats
+from overlockmqttauth.auth.base import MQTTAuth
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"OLAUTH1\0"
+
+_HEADER = struct.Struct("<8sII")
+_HASH = struct.Struct("<Q")
+_LOCATION = struct.Struct("<II")
+
+BLACKLISTED = 0x01
+
+PROJECT = b"p"
+PROJECT_SECRET = b"s"
+DEVICE = b"v"
+DEVICE_SECRET = b"d"
+
+
+class InvalidSnapshot(Exception):
+    pass
+
+
+def _key(kind, *parts):
+    return b"\0".join((kind,) + tuple(p.encode("utf8") for p in parts))
+
+
+def _hash(key):
+    # Has to be the same in every process, unlike hash()
+    return _HASH.unpack_from(hashlib.sha1(key).digest())[0]
+
+
+def _get(obj, name):
+    """Attribute or dict item, so both auth_data.py objects and JSON work"""
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def compile_snapshot(path, projects, devices):
+    """Write a snapshot file
+
+    The file is written next to path and moved into place, so processes
+    using the old one never see a half written file.
+
+    Args:
+        path (str): file to write
+        projects (list): projects with 'id' (or 'name'), 'blacklisted' and
+            'secrets', each secret with 'val' and 'blacklisted'
+        devices (list): devices with 'project', 'device_id' and 'secret'
+
+    Returns:
+        int: number of entries written
+    """
+
+    records = {}
+
+    def _add(key, blacklisted):
+        records[key] = bytes([BLACKLISTED if blacklisted else 0])
+
+    for project in projects:
+        project_id = _get(project, "id") or _get(project, "name")
+
+        _add(_key(PROJECT, project_id), _get(project, "blacklisted"))
+
+        for secret in _get(project, "secrets") or ():
+            _add(_key(PROJECT_SECRET, project_id, _get(secret, "val")), _get(secret, "blacklisted"))
+
+    for device in devices:
+        project_id = _get(device, "project")
+        device_id = _get(device, "device_id")
+        secret = _get(device, "secret")
+
+        _add(_key(DEVICE, project_id, device_id), False)
+        if secret is not None:
+            _add(_key(DEVICE_SECRET, project_id, device_id, _get(secret, "val")), _get(secret, "blacklisted"))
+
+    entries = sorted((_hash(key), key) for key in records)
+
+    hashes = bytearray()
+    locations = bytearray()
+    blob = bytearray()
+
+    for (key_hash, key) in entries:
+        record = key + records[key]
+        hashes += _HASH.pack(key_hash)
+        locations += _LOCATION.pack(len(blob), len(record))
+        blob += record
+
+    tmp_path = "{}.tmp.{}".format(path, os.getpid())
+
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(entries), 0))
+        f.write(hashes)
+        f.write(locations)
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+    return len(entries)
+
+
+class _Hashes:
+    """Sequence of the hashes in a mapped file, for bisect, on big endian
+    machines where the memory can't be used directly"""
+
+    __slots__ = ("map", "offset", "count")
+
+    def __init__(self, mapped, offset, count):
+        self.map = mapped
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return _HASH.unpack_from(self.map, self.offset + i * _HASH.size)[0]
+
+
+class _MappedFile:
+
+    __slots__ = ("map", "count", "hashes", "locations_offset", "records_offset", "stat")
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            if self.stat.st_size < _HEADER.size:
+                raise InvalidSnapshot("{} is too short".format(path))
+
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self.count, _) = _HEADER.unpack_from(self.map, 0)
+
+        if magic != MAGIC:
+            raise InvalidSnapshot("{} isn't an auth snapshot".format(path))
+
+        self.locations_offset = _HEADER.size + self.count * _HASH.size
+        self.records_offset = self.locations_offset + self.count * _LOCATION.size
+
+        if self.records_offset > self.stat.st_size:
+            raise InvalidSnapshot("{} is truncated".format(path))
+
+        if sys.byteorder == "little":
+            self.hashes = memoryview(self.map)[_HEADER.size:self.locations_offset].cast("Q")
+        else:
+            self.hashes = _Hashes(self.map, _HEADER.size, self.count)
+
+    def flags(self, key):
+        """Flags for a key, or None if it isn't in the file"""
+
+        key_hash = _hash(key)
+        hashes = self.hashes
+        mapped = self.map
+
+        i = bisect.bisect_left(hashes, key_hash)
+
+        # Entries with the same hash are next to each other
+        while i < self.count and hashes[i] == key_hash:
+            (offset, length) = _LOCATION.unpack_from(mapped, self.locations_offset + i * _LOCATION.size)
+
+            start = self.records_offset + offset
+            if mapped[start:start + length - 1] == key:
+                return mapped[start + length - 1]
+
+            i += 1
+
+        return None
+
+
+class CompiledSnapshot:
+    """Memory mapped snapshot file
+
+    The file is checked for being replaced at most every check_interval
+    seconds, and remapped if it has been. It has to be replaced (eg. with
+    compile_snapshot or a rename), never rewritten in place, because
+    changing a mapped file under a reader can crash it.
+
+    Args:
+        path (str): snapshot file
+        check_interval (float): seconds between checking for a new file
+    """
+
+    def __init__(self, path, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+
+        self._file = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.reloads = 0
+
+    def load(self):
+        """Map the file, replacing the current one"""
+
+        mapped = _MappedFile(self.path)
+
+        # Anything still using the old map keeps a reference to it, so it's
+        # only unmapped once they're done
+        self._file = mapped
+        self._next_check = time.monotonic() + self.check_interval
+        self.reloads += 1
+
+        logger.info("Mapped %d auth entries from %s", mapped.count, self.path)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+
+        if now < self._next_check:
+            return
+
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+
+            try:
+                stat = os.stat(self.path)
+                current = self._file
+
+                if current is None \
+                or (stat.st_ino, stat.st_mtime, stat.st_size) != \
+                    (current.stat.st_ino, current.stat.st_mtime, current.stat.st_size):
+                    self.load()
+            except (OSError, ValueError, InvalidSnapshot):
+                if self._file is None:
+                    raise
+                logger.exception("Error reloading %s, keeping the old one", self.path)
+
+    def flags(self, kind, *parts):
+        """Flags for an entry
+
+        Returns:
+            int: flags, or None if there is no such entry
+        """
+
+        self._maybe_reload()
+        self.lookups += 1
+
+        for part in parts:
+            # Would let one key pass as another
+            if "\0" in part:
+                return None
+
+        return self._file.flags(_key(kind, *parts))
+
+    def stats(self):
+        mapped = self._file
+
+        return {
+            "entries": mapped.count if mapped else None,
+            "lookups": self.lookups,
+            "reloads": self.reloads,
+        }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """The snapshot at AUTH_SNAPSHOT_FILE"""
+
+    global _snapshot # pylint: disable=global-statement
+
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                path = os.getenv("AUTH_SNAPSHOT_FILE")
+
+                if not path:
+                    raise InvalidSnapshot("AUTH_SNAPSHOT_FILE isn't set")
+
+                snapshot = CompiledSnapshot(path,
+                    check_interval=float(os.getenv("AUTH_SNAPSHOT_CHECK_INTERVAL", 5)))
+                stats.register("auth_snapshot_file", snapshot.stats)
+                _snapshot = snapshot
+
+    return _snapshot
+
+
+class FileAuth(MQTTAuth):
+    """Authenticates against the compiled snapshot in AUTH_SNAPSHOT_FILE
+
+    'p:' passwords are checked against the project's secrets, 'd:' ones
+    against the device's secret.
+    """
+
+    __slots__ = ()
+
+    snapshot = None
+
+    @classmethod
+    def start(cls):
+        # Fail at startup rather than on the first connection
+        cls._get_snapshot().load()
+
+    @classmethod
+    def _get_snapshot(cls):
+        return cls.snapshot or get_snapshot()
+
+    def _secret_flags(self):
+        credentials = self._credentials
+        snapshot = self._get_snapshot()
+
+        if credentials.secret_type == "p":
+            return snapshot.flags(PROJECT_SECRET, credentials.project_id, credentials.secret)
+        elif credentials.secret_type == "d":
+            return snapshot.flags(DEVICE_SECRET, credentials.project_id,
+                credentials.device_id, credentials.secret)
+
+        return None
+
+    @property
+    def authenticated(self):
+        if self._secret_flags() is None:
+            logger.error("Unknown secret for %s", self._credentials.username)
+            return False
+
+        return True
+
+    @property
+    def blacklisted(self):
+        credentials = self._credentials
+        snapshot = self._get_snapshot()
+
+        for flags in (
+            snapshot.flags(PROJECT, credentials.project_id),
+            snapshot.flags(DEVICE, credentials.project_id, credentials.device_id),
+            self._secret_flags(),
+        ):
+            if flags is not None and flags & BLACKLISTED:
+                return True
+
+        return False
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if len(argv) != 2:
+        sys.stderr.write("usage: python -m overlockmqttauth.auth.compiled <input.json> <output>\n")
+        return 2
+
+    with open(argv[0]) as f:
+        data = json.load(f)
+
+    count = compile_snapshot(argv[1], data.get("projects", []), data.get("devices", []))
+    print("Wrote {} entries to {}".format(count, argv[1]))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
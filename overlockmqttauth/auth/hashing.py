@@ -0,0 +1,157 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from overlockmqttauth.auth.cache import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+
+def keyed_hash(key, value):
+    """HMAC-SHA256 of a secret, for storing it without storing the secret
+
+    Unlike bcrypt this is fast enough to check on every connect. That's only
+    safe for long random secrets like project keys, and only because the key
+    (pepper) is kept out of the database.
+
+    Args:
+        key (bytes): server side key
+        value (str): secret to hash
+
+    Returns:
+        str: hex digest
+    """
+    return hmac.new(key, value.encode("utf8"), hashlib.sha256).hexdigest()
+
+
+class BcryptVerifier:
+    """Checks passwords against bcrypt hashes in a thread pool
+
+    bcrypt is deliberately slow (~100ms of cpu), but it releases the GIL so
+    several checks can run at once on different cores. Successful checks are
+    also remembered for a short while so a client reconnecting repeatedly
+    doesn't pay for bcrypt every time.
+
+    Only a keyed hash of the password is kept, never the password itself. By
+    default the key is random per process. To share successful checks between
+    replicas through `shared`, they all need to be given the same key.
+
+    Args:
+        workers (int): threads to run bcrypt in. Defaults to one per cpu
+        cache_size (int): maximum number of users to remember
+        cache_ttl (float): seconds to remember a successful check for
+        key (bytes): key for hashing passwords
+        shared (RedisCache): second level cache shared between replicas
+    """
+
+    def __init__(self, workers=None, cache_size=10000, cache_ttl=60, key=None, shared=None):
+        self.workers = workers or os.cpu_count() or 1
+
+        # username -> keyed hash of the last password that matched
+        self._verified = TTLCache(cache_size, cache_ttl)
+        self._key = key or os.urandom(32)
+        self._shared = shared
+
+        # Created lazily so it isn't shared across forks
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.checks = 0
+
+    def _digest(self, password):
+        return hmac.new(self._key, password.encode("utf8"), hashlib.sha256).digest()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _checkpw(self, password, passhash):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+
+        try:
+            return bcrypt.checkpw(password.encode("utf8"), passhash.encode("utf8"))
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.checks += 1
+
+    def is_verified(self, username, password):
+        """Whether this password has recently been checked for this user
+
+        Args:
+            username (str): username
+            password (str): plaintext password
+
+        Returns:
+            bool: True if it was checked and matched recently. False just
+                means it needs checking properly
+        """
+
+        digest = self._verified.get(username, None)
+
+        if digest is None and self._shared is not None:
+            digest = self._shared.get_many([username]).get(username)
+            if digest is not None:
+                self._verified.set(username, digest)
+
+        return digest is not None and hmac.compare_digest(digest, self._digest(password))
+
+    def verify(self, username, password, passhash):
+        """Check a password against a bcrypt hash
+
+        Args:
+            username (str): username, for remembering successful checks
+            password (str): plaintext password
+            passhash (str): bcrypt hash to check against
+
+        Returns:
+            bool: whether the password matches
+        """
+
+        if self.is_verified(username, password):
+            return True
+
+        with self._lock:
+            self.queued += 1
+
+        future = self._get_executor().submit(self._checkpw, password, passhash)
+        match = future.result()
+
+        if match:
+            self._remember(username, password)
+
+        return match
+
+    def _remember(self, username, password):
+        digest = self._digest(password)
+        self._verified.set(username, digest)
+        if self._shared is not None:
+            self._shared.set_many({username: digest})
+
+    def forget(self, username):
+        """Forget any successful checks for a user, eg. on password change"""
+        self._verified.invalidate(username)
+        if self._shared is not None:
+            self._shared.invalidate(username)
+
+    def stats(self):
+        stats = self._verified.stats()
+        stats.update(
+            workers=self.workers,
+            queued=self.queued,
+            running=self.running,
+            checks=self.checks,
+        )
+        return stats
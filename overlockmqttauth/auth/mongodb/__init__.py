@@ -1,7 +1,18 @@
 from .vmq import VMQAuth
+from .blacklist import blacklist
+from .snapshot import SnapshotAuth, project_snapshot
+from .tokens import TokenAuth
+from .hashed import HashedKeyAuth
+from .aio import AsyncVMQAuth
 from .util import mongo_connect
 
 __all__ = [
     "VMQAuth",
+    "SnapshotAuth",
+    "TokenAuth",
+    "HashedKeyAuth",
+    "AsyncVMQAuth",
+    "project_snapshot",
+    "blacklist",
     "mongo_connect",
 ]
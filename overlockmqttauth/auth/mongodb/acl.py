@@ -0,0 +1,49 @@
+import logging
+
+import mongoengine
+from bson import ObjectId
+
+from .overlock import Project
+from .vmq import MQTTUser
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_acls(kind, key):
+    """Load extra ACL patterns for a project or user
+
+    Used as the loader for overlockmqttauth.acl.ACLEngine
+
+    Args:
+        kind (str): 'project' or 'user'
+        key (str): project id or username
+
+    Returns:
+        dict: {'publish': [patterns], 'subscribe': [patterns]}, or None if
+            there is no such project/user
+    """
+
+    if kind == "project":
+        if not ObjectId.is_valid(key):
+            return None
+
+        queryset = Project.objects(id=key)
+    elif kind == "user":
+        queryset = MQTTUser.objects(username=key)
+    else:
+        raise ValueError("Unknown ACL kind '{}'".format(kind))
+
+    try:
+        doc = queryset.only("publish_acl", "subscribe_acl").as_pymongo().get()
+    except mongoengine.DoesNotExist:
+        return None
+
+    def _patterns(acls):
+        # Project ACLs are just strings, vernemq ones are {"pattern": ...}
+        return [a["pattern"] if isinstance(a, dict) else a for a in acls or ()]
+
+    return {
+        "publish": _patterns(doc.get("publish_acl")),
+        "subscribe": _patterns(doc.get("subscribe_acl")),
+    }
@@ -0,0 +1,241 @@
+"""Async mongodb auth, for the native async routes of the asyncio hook server
+
+Same lookups (and the same caches, including the redis ones) as vmq.py and
+devices.py, but awaited so one event loop can have thousands in flight
+instead of blocking a thread on each.
+
+Uses motor if it's installed. Otherwise each query is run on pymongo (through
+mongoengine's connection) in a thread pool, which doesn't block the event loop
+but does still use a thread per query in flight. The redis client isn't async,
+so its round trips are run in the event loop's default executor.
+
+Project key lookups aren't batched (PROJECT_BATCH_WINDOW_MS) - concurrent
+lookups for the same project still share one query.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import mongoengine
+from bson import ObjectId
+
+from overlockmqttauth import stats
+from overlockmqttauth.auth.cache import MISSING
+from overlockmqttauth.auth.singleflight import AsyncSingleFlight
+
+from . import devices, vmq
+from .devices import DEVICE_SECRET, DeviceSecret, device_secrets_cache, secrets_match
+from .overlock import Project
+from .vmq import VMQAuth, project_keys_cache
+
+try:
+    import motor.motor_asyncio
+except ImportError:
+    motor = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class _ThreadedCollection:
+    """Just enough of a motor collection, on top of pymongo"""
+
+    def __init__(self, collection, executor):
+        self._collection = collection
+        self._executor = executor
+
+    def find_one(self, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor,
+            lambda: self._collection.find_one(*args, **kwargs))
+
+
+class _ThreadedDatabase:
+
+    def __init__(self, database, threads):
+        self._database = database
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+
+    def __getitem__(self, name):
+        return _ThreadedCollection(self._database[name], self._executor)
+
+
+_database = None
+
+
+def _connect_motor():
+    settings = {
+        "host": os.environ["MONGO_HOST"],
+    }
+
+    if "MONGO_PORT" in os.environ:
+        settings["port"] = int(os.environ["MONGO_PORT"])
+
+    for (setting, envvar) in (
+        ("ssl", "MONGO_SSL"),
+        ("username", "MONGO_USERNAME"),
+        ("password", "MONGO_PASSWORD"),
+        ("appname", "MONGO_APPNAME"),
+    ):
+        if envvar in os.environ:
+            settings[setting] = os.environ[envvar]
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(**settings)
+
+    return client[os.environ["MONGO_DATABASE"]]
+
+
+def get_database():
+    """motor database, or a thread pool backed stand in if motor isn't
+    installed (or MONGO_ASYNC_DRIVER=threads)
+
+    Has to be called in each worker process, after forking
+    """
+
+    global _database # pylint: disable=global-statement
+
+    if _database is None:
+        if motor is not None and os.getenv("MONGO_ASYNC_DRIVER", "motor") == "motor":
+            _database = _connect_motor()
+        else:
+            _database = _ThreadedDatabase(mongoengine.connection.get_db(),
+                threads=int(os.getenv("MONGO_ASYNC_THREADS", 32)))
+
+    return _database
+
+
+def reset_database():
+    """Forget the connection, eg. after forking or in tests"""
+    global _database # pylint: disable=global-statement
+    _database = None
+
+
+project_keys_flight = AsyncSingleFlight()
+stats.register("project_keys_async_flight", project_keys_flight.stats)
+
+device_secrets_flight = AsyncSingleFlight()
+stats.register("device_secrets_async_flight", device_secrets_flight.stats)
+
+
+async def _through_l2(l2, key, load):
+    """Get key from a redis cache (if configured), otherwise await load() and
+    store what it returns"""
+
+    if l2 is None:
+        return await load()
+
+    loop = asyncio.get_event_loop()
+
+    found = await loop.run_in_executor(None, l2.get_many, [key])
+    if key in found:
+        return found[key]
+
+    value = await load()
+    await loop.run_in_executor(None, l2.set_many, {key: value})
+
+    return value
+
+
+async def load_project_keys(project_id):
+    """Async vmq.load_project_keys
+
+    Like it, raises an error if project_id isn't a valid ObjectId
+    """
+
+    doc = await get_database()[Project._get_collection_name()].find_one( # pylint: disable=protected-access
+        {"_id": ObjectId(project_id)}, {"project_keys": 1})
+
+    if doc is None:
+        logger.info("No project with name '%s'", project_id)
+        return None
+
+    return frozenset(doc.get("project_keys") or ())
+
+
+async def _load_and_cache_project_keys(project_id):
+    project_keys = await _through_l2(vmq.project_keys_l2, project_id,
+        lambda: load_project_keys(project_id))
+    project_keys_cache.set(project_id, project_keys)
+    return project_keys
+
+
+async def get_project_keys(project_id):
+    """Async vmq.get_project_keys, sharing its cache"""
+
+    project_keys = project_keys_cache.get(project_id)
+
+    if project_keys is MISSING:
+        project_keys = await project_keys_flight.do(project_id, _load_and_cache_project_keys, project_id)
+
+    return project_keys
+
+
+async def load_device_secrets(project_id, device_id):
+    """Async devices.load_device_secrets"""
+
+    doc = await get_database()[DeviceSecret._get_collection_name()].find_one( # pylint: disable=protected-access
+        {"project_id": project_id, "device_id": device_id}, {"secrets": 1})
+
+    if doc is None:
+        logger.info("No secrets for device '%s' in project '%s'", device_id, project_id)
+        return None
+
+    return frozenset(doc.get("secrets") or ())
+
+
+async def _load_and_cache_device_secrets(project_id, device_id):
+    secrets = await _through_l2(devices.device_secrets_l2,
+        devices._l2_key(project_id, device_id), # pylint: disable=protected-access
+        lambda: load_device_secrets(project_id, device_id))
+    device_secrets_cache.set((project_id, device_id), secrets)
+    return secrets
+
+
+async def get_device_secrets(project_id, device_id):
+    """Async devices.get_device_secrets, sharing its cache"""
+
+    key = (project_id, device_id)
+    secrets = device_secrets_cache.get(key)
+
+    if secrets is MISSING:
+        secrets = await device_secrets_flight.do(key, _load_and_cache_device_secrets, project_id, device_id)
+
+    return secrets
+
+
+class AsyncVMQAuth(VMQAuth):
+    """VMQAuth with native coroutine lookups
+
+    authenticate() has the same semantics as VMQAuth.authenticated, which
+    still works (synchronously) for the flask server.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def start(cls):
+        reset_database()
+
+    async def authenticate(self):
+        credentials = self._credentials
+
+        if credentials.secret_type == DEVICE_SECRET:
+            secrets = await get_device_secrets(credentials.project_id, credentials.device_id)
+            matches = secrets_match(credentials, secrets)
+
+            if matches is not None:
+                return matches
+
+        project_keys = await get_project_keys(credentials.project_id)
+
+        if project_keys is None:
+            logger.error("No project with name '%s'", credentials.project_id)
+            return False
+
+        if credentials.password not in project_keys:
+            logger.error("Given password not in project keys for '%s'", credentials.project_id)
+            return False
+
+        return True
@@ -0,0 +1,199 @@
+"""Blacklisting of project secrets, projects and devices
+
+The whole blacklist is kept in memory and refreshed in the background, so
+checking a connection never touches the database. Each kind of entry goes in
+a Bloom filter in front of an exact set - nearly every connection isn't
+blacklisted, and the filter answers that without touching the sets.
+"""
+
+import logging
+import os
+import threading
+
+import mongoengine
+from mongoengine import Document, StringField
+
+from overlockmqttauth import invalidation, stats
+from overlockmqttauth.auth.bloom import BloomFilter
+
+from .refresh import RefreshingIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+SECRET = "secret"
+PROJECT = "project"
+DEVICE = "device"
+
+KINDS = (SECRET, PROJECT, DEVICE)
+
+
+class BlacklistEntry(Document):
+    """Something that has been blacklisted
+
+    Attributes:
+
+        kind (str): 'secret', 'project' or 'device'
+        project_id (str): project the secret/device belongs to, or the
+            blacklisted project
+        value (str): the whole secret including prefix (eg. 'p:abc'), or the
+            device id. Unused for projects
+    """
+
+    kind = StringField(required=True, choices=KINDS)
+    project_id = StringField(required=True)
+    value = StringField()
+
+    meta = {
+        "collection": "blacklist",
+        "indexes": [
+            ("kind", "project_id", "value"),
+        ],
+    }
+
+
+class _Generation:
+    """One immutable copy of the blacklist
+
+    Bloom filters are keyed on a single string that the caller already has
+    (so its hash is cached), the exact sets on everything that identifies the
+    entry.
+    """
+
+    def __init__(self, entries):
+        self.sets = {kind: set() for kind in KINDS}
+
+        for (kind, project_id, value) in entries:
+            if kind == PROJECT:
+                self.sets[kind].add(project_id)
+            else:
+                self.sets[kind].add((project_id, value))
+
+        self.blooms = {}
+        for (kind, exact) in self.sets.items():
+            bloom = BloomFilter(max(1024, 2 * len(exact)))
+            for item in exact:
+                bloom.add(item if kind == PROJECT else item[1])
+            self.blooms[kind] = bloom
+
+    def entries(self):
+        for (kind, exact) in self.sets.items():
+            for item in exact:
+                if kind == PROJECT:
+                    yield (kind, item, None)
+                else:
+                    yield (kind, item[0], item[1])
+
+
+class Blacklist(RefreshingIndex):
+    """In memory blacklist
+
+    New entries are picked up every refresh_interval seconds (or straight
+    away on a 'blacklist' invalidation), removed entries on the next full
+    reload.
+    """
+
+    name = "blacklist"
+
+    def __init__(self, refresh_interval=5, full_interval=300):
+        super().__init__(refresh_interval, full_interval)
+
+        self._generation = _Generation(())
+        self._lock = threading.Lock()
+
+        self.checks = 0
+        self.filter_passes = 0
+        self.hits = 0
+
+    def _query(self, **kwargs):
+        queryset = BlacklistEntry.objects(**kwargs).only("kind", "project_id", "value").as_pymongo()
+
+        watermark = self._watermark
+        entries = []
+
+        for doc in queryset:
+            entries.append((doc["kind"], doc["project_id"], doc.get("value")))
+            if doc["_id"] > watermark:
+                watermark = doc["_id"]
+
+        return (entries, watermark)
+
+    def load(self):
+        with self._lock:
+            (entries, watermark) = self._query()
+            self._generation = _Generation(entries)
+            self._watermark = watermark
+
+        logger.info("Loaded %d blacklist entries", len(entries))
+
+    def load_new(self):
+        with self._lock:
+            (entries, watermark) = self._query(id__gt=self._watermark)
+
+            if entries:
+                logger.info("Loaded %d new blacklist entries", len(entries))
+                self._generation = _Generation(list(self._generation.entries()) + entries)
+                self._watermark = watermark
+
+    def is_blacklisted(self, password, project_id, device_id):
+        """Whether a connection has been blacklisted by secret, project or
+        device
+
+        Args:
+            password (str): whole secret including prefix
+            project_id (str): project id
+            device_id (str): device id
+
+        Returns:
+            bool: if any of them have been blacklisted
+        """
+
+        generation = self._generation
+        blooms = generation.blooms
+        self.checks += 1
+
+        if password not in blooms[SECRET] \
+        and project_id not in blooms[PROJECT] \
+        and device_id not in blooms[DEVICE]:
+            return False
+
+        self.filter_passes += 1
+
+        blacklisted = (project_id, password) in generation.sets[SECRET] \
+            or project_id in generation.sets[PROJECT] \
+            or (project_id, device_id) in generation.sets[DEVICE]
+
+        if blacklisted:
+            self.hits += 1
+
+        return blacklisted
+
+    def stats(self):
+        return {
+            "entries": {kind: len(exact) for (kind, exact) in self._generation.sets.items()},
+            "checks": self.checks,
+            "filter_passes": self.filter_passes,
+            "hits": self.hits,
+        }
+
+
+def blacklist_entry(kind, project_id, value=None):
+    """Add an entry to the blacklist in the database
+
+    Replicas pick it up within BLACKLIST_REFRESH_INTERVAL, or immediately if a
+    'blacklist' invalidation is broadcast afterwards
+    """
+    try:
+        return BlacklistEntry.objects(kind=kind, project_id=project_id, value=value).get()
+    except mongoengine.DoesNotExist:
+        return BlacklistEntry(kind=kind, project_id=project_id, value=value).save()
+
+
+blacklist = Blacklist(
+    refresh_interval=float(os.getenv("BLACKLIST_REFRESH_INTERVAL", 5)),
+    full_interval=float(os.getenv("BLACKLIST_FULL_INTERVAL", 300)),
+)
+stats.register("blacklist", blacklist.stats)
+# Entries were added (or removed, if the key is 'full')
+invalidation.register("blacklist", lambda key: blacklist.request_refresh(full=key == "full"))
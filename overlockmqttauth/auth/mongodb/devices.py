@@ -0,0 +1,172 @@
+"""Per device secrets ('d:' passwords)
+
+Each device with its own secrets has a document in the device_secret
+collection, found with a point lookup on a compound (project_id, device_id)
+index that only returns the secrets. Large projects don't need every device's
+secret in one project_keys list.
+
+Devices without a document are checked against the project keys as before,
+so existing 'd:' keys in project_keys keep working until they're moved.
+"""
+
+import logging
+import os
+
+from mongoengine import Document, StringField, ListField
+
+from overlockmqttauth import invalidation, stats
+from overlockmqttauth.auth.cache import TTLCache, MISSING
+from overlockmqttauth.auth.rediscache import make_redis_cache
+from overlockmqttauth.auth.singleflight import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+
+DEVICE_SECRET = "d"
+
+
+class DeviceSecret(Document):
+    """Secrets a single device can connect with
+
+    Attributes:
+
+        project_id (str): project the device is in
+        device_id (str): device id, as in the username
+        secrets (list(str)): whole secrets, including the 'd:' prefix
+    """
+
+    project_id = StringField(required=True)
+    device_id = StringField(required=True)
+    secrets = ListField(StringField())
+
+    meta = {
+        "collection": "device_secret",
+        "indexes": [
+            {
+                "fields": ("project_id", "device_id"),
+                "unique": True,
+            },
+        ],
+    }
+
+
+# (project id, device id) -> frozenset of secrets, or None if there's no
+# such device
+device_secrets_cache = TTLCache(
+    maxsize=int(os.getenv("DEVICE_CACHE_SIZE", 100000)),
+    ttl=float(os.getenv("DEVICE_CACHE_TTL", 60)),
+    negative_ttl=float(os.getenv("DEVICE_CACHE_NEGATIVE_TTL", 10)),
+)
+stats.register("device_secrets_cache", device_secrets_cache.stats)
+
+# Shared between all replicas if REDIS_URL is set
+device_secrets_l2 = make_redis_cache(
+    "overlock:device_secrets",
+    ttl=int(os.getenv("DEVICE_L2_TTL", 300)),
+    negative_ttl=max(1, int(device_secrets_cache.negative_ttl)),
+    encode=sorted,
+    decode=frozenset,
+)
+if device_secrets_l2 is not None:
+    stats.register("device_secrets_l2", device_secrets_l2.stats)
+
+device_secrets_flight = SingleFlight()
+stats.register("device_secrets_flight", device_secrets_flight.stats)
+
+
+def load_device_secrets(project_id, device_id):
+    """Load the secrets for a device from the database
+
+    Returns:
+        frozenset: secrets, or None if the device has none stored
+    """
+
+    doc = DeviceSecret.objects(project_id=project_id, device_id=device_id) \
+        .only("secrets").as_pymongo().first()
+
+    if doc is None:
+        logger.info("No secrets for device '%s' in project '%s'", device_id, project_id)
+        return None
+
+    return frozenset(doc.get("secrets") or ())
+
+
+def _l2_key(project_id, device_id):
+    return "{}:{}".format(project_id, device_id)
+
+
+def _load_and_cache(project_id, device_id):
+    if device_secrets_l2 is None:
+        secrets = load_device_secrets(project_id, device_id)
+    else:
+        key = _l2_key(project_id, device_id)
+        secrets = device_secrets_l2.get_or_load([key],
+            lambda keys: {key: load_device_secrets(project_id, device_id)})[key]
+
+    device_secrets_cache.set((project_id, device_id), secrets)
+    return secrets
+
+
+def get_device_secrets(project_id, device_id):
+    """Get the secrets for a device, from the cache if possible
+
+    Returns:
+        frozenset: secrets, or None if the device has none stored
+    """
+
+    key = (project_id, device_id)
+    secrets = device_secrets_cache.get(key)
+
+    if secrets is MISSING:
+        secrets = device_secrets_flight.do(key, _load_and_cache, project_id, device_id)
+
+    return secrets
+
+
+def invalidate_device(key):
+    """Forget cached secrets for a device
+
+    Args:
+        key (str): '<project id>:<device id>'
+    """
+
+    (project_id, device_id) = key.split(":", 1)
+
+    device_secrets_cache.invalidate((project_id, device_id))
+    if device_secrets_l2 is not None:
+        device_secrets_l2.invalidate(key)
+
+
+invalidation.register("device", invalidate_device)
+
+
+def device_secret_matches(credentials):
+    """Whether a 'd:' password is one of the device's secrets
+
+    Args:
+        credentials (Credentials): parsed username/password
+
+    Returns:
+        bool: if it matches, or None if the device has no document in
+            device_secret - its 'd:' passwords are still project keys
+    """
+
+    secrets = get_device_secrets(credentials.project_id, credentials.device_id)
+
+    return secrets_match(credentials, secrets)
+
+
+def secrets_match(credentials, secrets):
+    """device_secret_matches, given the device's secrets"""
+
+    if secrets is None:
+        logger.debug("No secrets for device '%s' in project '%s' - checking project keys",
+            credentials.device_id, credentials.project_id)
+        return None
+
+    if credentials.password not in secrets:
+        logger.error("Given password not in secrets for device '%s'", credentials.device_id)
+        return False
+
+    return True
@@ -0,0 +1,180 @@
+"""Project keys stored as keyed hashes
+
+Instead of a list of plaintext keys on the project, each key is stored as
+its own document holding an HMAC of the key (see hashing.keyed_hash) with a
+server side pepper from PROJECT_KEY_PEPPER. Checking a key is then one
+indexed lookup on (project id, hash) which returns at most a single id,
+rather than loading every key for the project.
+"""
+
+import logging
+import os
+
+from mongoengine import Document, StringField
+
+from overlockmqttauth import invalidation, stats
+from overlockmqttauth.auth.cache import TTLCache, MISSING
+from overlockmqttauth.auth.hashing import keyed_hash
+from overlockmqttauth.auth.singleflight import SingleFlight
+
+from .overlock import Project
+from .vmq import VMQAuth
+
+
+logger = logging.getLogger(__name__)
+
+
+class HashedProjectKey(Document):
+    """A project key, stored as a keyed hash
+
+    Attributes:
+
+        project_id (str): project the key is for
+        key_hash (str): keyed_hash(pepper, key), where key includes the 'p:'
+            prefix
+    """
+
+    project_id = StringField(required=True)
+    key_hash = StringField(required=True)
+
+    meta = {
+        "collection": "project_key",
+        "indexes": [
+            {
+                "fields": ("project_id", "key_hash"),
+                "unique": True,
+            },
+        ],
+    }
+
+
+def _get_pepper(pepper=None):
+    if pepper is not None:
+        return pepper
+
+    pepper = os.getenv("PROJECT_KEY_PEPPER")
+    return pepper.encode("utf8") if pepper else None
+
+
+def _require_pepper(pepper):
+    pepper = _get_pepper(pepper)
+
+    if pepper is None:
+        raise ValueError("PROJECT_KEY_PEPPER isn't set")
+
+    return pepper
+
+
+# (project id, key hash) -> True, or None if it isn't a key for the project
+hashed_keys_cache = TTLCache(
+    maxsize=int(os.getenv("PROJECT_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("PROJECT_CACHE_TTL", 60)),
+    negative_ttl=float(os.getenv("PROJECT_CACHE_NEGATIVE_TTL", 10)),
+)
+stats.register("hashed_keys_cache", hashed_keys_cache.stats)
+# The cache isn't keyed on project alone, and removing keys is rare
+invalidation.register("project", lambda project_id: hashed_keys_cache.clear())
+
+hashed_keys_flight = SingleFlight()
+
+
+def add_project_key(project_id, key, pepper=None):
+    """Store a key for a project
+
+    Args:
+        project_id (str): project id
+        key (str): whole key, including the 'p:' prefix
+        pepper (bytes): defaults to PROJECT_KEY_PEPPER
+    """
+
+    key_hash = keyed_hash(_require_pepper(pepper), key)
+
+    HashedProjectKey.objects(project_id=project_id, key_hash=key_hash) \
+        .update_one(set__key_hash=key_hash, upsert=True)
+
+
+def remove_project_key(project_id, key, pepper=None):
+    """Remove a key from a project
+
+    Replicas keep accepting it until their cache expires unless a 'project'
+    invalidation is broadcast afterwards
+    """
+
+    key_hash = keyed_hash(_require_pepper(pepper), key)
+
+    HashedProjectKey.objects(project_id=project_id, key_hash=key_hash).delete()
+
+
+def hash_existing_project_keys(pepper=None):
+    """Copy the plaintext project_keys of every project into the hashed
+    collection, for moving to AUTH_BACKEND=hashed
+
+    Returns:
+        int: number of keys copied
+    """
+
+    pepper = _require_pepper(pepper)
+    copied = 0
+
+    for doc in Project.objects().only("project_keys").as_pymongo():
+        for key in doc.get("project_keys") or ():
+            add_project_key(str(doc["_id"]), key, pepper)
+            copied += 1
+
+    return copied
+
+
+def _load_and_cache(project_id, key_hash):
+    found = HashedProjectKey.objects(project_id=project_id, key_hash=key_hash) \
+        .only("id").as_pymongo().first()
+
+    matches = True if found is not None else None
+    hashed_keys_cache.set((project_id, key_hash), matches)
+
+    return matches
+
+
+def project_key_matches(project_id, key, pepper):
+    """Whether a key is one of the project's keys
+
+    Args:
+        project_id (str): project id
+        key (str): whole key, including the 'p:' prefix
+        pepper (bytes): PROJECT_KEY_PEPPER
+
+    Returns:
+        bool: if it matches
+    """
+
+    cache_key = (project_id, keyed_hash(pepper, key))
+    matches = hashed_keys_cache.get(cache_key)
+
+    if matches is MISSING:
+        matches = hashed_keys_flight.do(cache_key, _load_and_cache, *cache_key)
+
+    return matches is True
+
+
+class HashedKeyAuth(VMQAuth):
+    """Authenticates against keys in the project_key collection
+
+    Needs PROJECT_KEY_PEPPER to be set, and to be the same everywhere the keys
+    are hashed.
+    """
+
+    __slots__ = ()
+
+    pepper = _get_pepper()
+
+    def _project_key_matches(self):
+        if self.pepper is None:
+            logger.error("PROJECT_KEY_PEPPER isn't set - can't check hashed keys")
+            return False
+
+        credentials = self._credentials
+
+        if not project_key_matches(credentials.project_id, credentials.password, self.pepper):
+            logger.error("Given password not in project keys for '%s'", credentials.project_id)
+            return False
+
+        return True
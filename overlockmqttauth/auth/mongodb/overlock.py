@@ -1,6 +1,39 @@
 import mongoengine
 
 
+class SigningKey(mongoengine.EmbeddedDocument):
+    """Key used to sign v2 device tokens, see overlockmqttauth/auth/tokens.py
+
+    Attributes:
+
+        key_id (str): id included in tokens signed with this key
+        key (str): HMAC key
+    """
+
+    key_id = mongoengine.StringField(required=True)
+    key = mongoengine.StringField(required=True)
+
+
 class Project(mongoengine.Document):
+    """Overlock project
+
+    Attributes:
+
+        name (str): project name
+        project_keys (list(str)): keys devices can connect with, including the
+            'p:' prefix
+        publish_acl (list(str)): extra topic patterns devices in this project
+            can publish to, see overlockmqttauth/acl.py
+        subscribe_acl (list(str)): extra topic patterns devices in this
+            project can subscribe to
+        signing_keys (list(SigningKey)): keys v2 device tokens can be signed
+            with
+    """
+
     name = mongoengine.StringField(required=True)
     project_keys = mongoengine.ListField(mongoengine.StringField())
+
+    publish_acl = mongoengine.ListField(mongoengine.StringField())
+    subscribe_acl = mongoengine.ListField(mongoengine.StringField())
+
+    signing_keys = mongoengine.ListField(mongoengine.EmbeddedDocumentField(SigningKey))
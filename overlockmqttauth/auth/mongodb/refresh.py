@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+
+from bson import ObjectId
+
+
+logger = logging.getLogger(__name__)
+
+
+# Below any real ObjectId, so the first load_new() loads everything
+MIN_WATERMARK = ObjectId("0" * 24)
+
+
+class RefreshingIndex(metaclass=ABCMeta):
+    """Base for in memory copies of a collection kept up to date in the
+    background
+
+    Subclasses implement load() (reload everything and swap it in) and
+    load_new() (load documents created since the last load). load_new() is
+    called every refresh_interval seconds and load() every full_interval
+    seconds, or straight away if request_refresh() is called.
+
+    Subclasses track the highest ObjectId loaded so far in _watermark, so
+    load_new() only has to ask for ids above it.
+
+    Args:
+        refresh_interval (float): seconds between calls to load_new()
+        full_interval (float): seconds between calls to load()
+    """
+
+    name = "index"
+
+    def __init__(self, refresh_interval=5, full_interval=300):
+        self.refresh_interval = refresh_interval
+        self.full_interval = full_interval
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._full_requested = False
+        self._watermark = MIN_WATERMARK
+
+        self.loaded = threading.Event()
+
+    @abstractmethod
+    def load(self):
+        """Reload everything and swap it in"""
+
+    @abstractmethod
+    def load_new(self):
+        """Load anything added since the last load"""
+
+    def request_refresh(self, full=False):
+        """Refresh in the background as soon as possible
+
+        Safe to call from anywhere, eg. the MQTT network thread
+        """
+        if full:
+            self._full_requested = True
+        self._wake.set()
+
+    def _run(self):
+        next_full = time.monotonic() + self.full_interval
+
+        while not self._stop.is_set():
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+
+            if self._stop.is_set():
+                break
+
+            try:
+                if self._full_requested or time.monotonic() >= next_full:
+                    self._full_requested = False
+                    next_full = time.monotonic() + self.full_interval
+                    self.load()
+                else:
+                    self.load_new()
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Error refreshing %s", self.name)
+
+    def start(self):
+        """Do the initial load and start refreshing in the background"""
+
+        self.load()
+        self.loaded.set()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+import time
+
+from overlockmqttauth import invalidation, stats
+
+from .overlock import Project
+from .refresh import RefreshingIndex
+from .vmq import VMQAuth, get_project_keys
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectKeysSnapshot(RefreshingIndex):
+    """In memory copy of the keys for every project
+
+    The whole collection is streamed in batches into a new index which is then
+    swapped in, so lookups never see a half loaded index and never block.
+    New projects are picked up frequently by loading anything with an
+    ObjectId above the highest one seen so far. Changed or deleted keys are
+    only picked up by the (less frequent) full reload.
+
+    Args:
+        batch_size (int): number of projects to fetch per round trip
+        refresh_interval (float): seconds between loading new projects
+        full_interval (float): seconds between full reloads
+    """
+
+    name = "project-snapshot"
+
+    def __init__(self, batch_size=1000, refresh_interval=5, full_interval=300):
+        super().__init__(refresh_interval, full_interval)
+
+        self.batch_size = batch_size
+
+        # project id -> frozenset of keys
+        self._index = {}
+        self._lock = threading.Lock()
+
+        self.last_full_load = None
+        self.last_load_seconds = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, project_id):
+        """Get the keys for a project
+
+        Args:
+            project_id (str): project id
+
+        Returns:
+            frozenset: keys, or None if the project isn't in the snapshot
+        """
+        return self._index.get(project_id)
+
+    def _stream(self, queryset):
+        """Yield (id, project id, keys) without building Documents"""
+        queryset = queryset.only("project_keys").as_pymongo().batch_size(self.batch_size)
+
+        for doc in queryset:
+            yield (doc["_id"], str(doc["_id"]), frozenset(doc.get("project_keys") or ()))
+
+    def _load(self, index, queryset):
+        start = time.monotonic()
+        watermark = self._watermark
+
+        for (object_id, project_id, keys) in self._stream(queryset):
+            index[project_id] = keys
+            if object_id > watermark:
+                watermark = object_id
+
+        self.last_load_seconds = time.monotonic() - start
+
+        return watermark
+
+    def load(self):
+        """Reload every project and swap in the new index"""
+
+        with self._lock:
+            index = {}
+            watermark = self._load(index, Project.objects())
+
+            self._index = index
+            self._watermark = watermark
+            self.last_full_load = time.time()
+
+        logger.info("Loaded keys for %d projects in %.3fs", len(index), self.last_load_seconds)
+
+    def load_new(self):
+        """Load projects created since the last load"""
+
+        with self._lock:
+            index = dict(self._index)
+            watermark = self._load(index, Project.objects(id__gt=self._watermark))
+
+            if watermark != self._watermark:
+                logger.info("Loaded %d new projects", len(index) - len(self._index))
+                self._index = index
+                self._watermark = watermark
+
+    def reload_project(self, project_id):
+        """Reload a single project, eg. when its keys have changed"""
+
+        with self._lock:
+            index = dict(self._index)
+            index.pop(project_id, None)
+            self._load(index, Project.objects(id=project_id))
+            self._index = index
+
+    def evict(self, project_id):
+        """Drop a project, so it is looked up in the database until the next
+        full reload"""
+
+        with self._lock:
+            if project_id in self._index:
+                index = dict(self._index)
+                del index[project_id]
+                self._index = index
+
+    def stats(self):
+        return {
+            "projects": len(self._index),
+            "last_full_load": self.last_full_load,
+            "last_load_seconds": self.last_load_seconds,
+        }
+
+
+project_snapshot = ProjectKeysSnapshot(
+    batch_size=int(os.getenv("SNAPSHOT_BATCH_SIZE", 1000)),
+    refresh_interval=float(os.getenv("SNAPSHOT_REFRESH_INTERVAL", 5)),
+    full_interval=float(os.getenv("SNAPSHOT_FULL_INTERVAL", 300)),
+)
+stats.register("project_snapshot", project_snapshot.stats)
+invalidation.register("project", project_snapshot.evict)
+
+
+class SnapshotAuth(VMQAuth):
+    """Authenticates against project_snapshot instead of querying per connect
+
+    start() (which starts project_snapshot) has to be called after forking,
+    before this is used. Projects that aren't in the snapshot yet fall back to the cached
+    database lookup in VMQAuth.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def start(cls):
+        project_snapshot.start()
+
+    def _get_project_keys(self):
+        project_id = self._credentials.project_id
+        project_keys = project_snapshot.get(project_id)
+
+        if project_keys is None:
+            return get_project_keys(project_id)
+
+        return project_keys
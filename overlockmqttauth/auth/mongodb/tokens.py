@@ -0,0 +1,90 @@
+import logging
+import os
+
+import mongoengine
+from bson import ObjectId
+
+from overlockmqttauth import invalidation, stats
+from overlockmqttauth.auth.cache import TTLCache, MISSING
+from overlockmqttauth.auth.singleflight import SingleFlight
+from overlockmqttauth.auth.tokens import verify_token
+
+from .overlock import Project
+from .vmq import VMQAuth
+
+
+logger = logging.getLogger(__name__)
+
+
+# project id -> {key id: key}, or None if there's no such project
+signing_keys_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_KEYS_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("TOKEN_KEYS_CACHE_TTL", 300)),
+    negative_ttl=float(os.getenv("PROJECT_CACHE_NEGATIVE_TTL", 10)),
+)
+stats.register("signing_keys_cache", signing_keys_cache.stats)
+# Rotating keys should broadcast a 'project' invalidation
+invalidation.register("project", signing_keys_cache.invalidate)
+
+signing_keys_flight = SingleFlight()
+
+
+def load_signing_keys(project_id):
+    """Load the token signing keys for a project from the database
+
+    Args:
+        project_id (str): project id
+
+    Returns:
+        dict: key id -> key (bytes), or None if the project doesn't exist
+    """
+
+    if not ObjectId.is_valid(project_id):
+        return None
+
+    try:
+        doc = Project.objects(id=project_id).only("signing_keys").as_pymongo().get()
+    except mongoengine.DoesNotExist:
+        logger.info("No project with name '%s'", project_id)
+        return None
+
+    return {k["key_id"]: k["key"].encode("utf8") for k in doc.get("signing_keys") or ()}
+
+
+def _load_and_cache(project_id):
+    keys = load_signing_keys(project_id)
+    signing_keys_cache.set(project_id, keys)
+    return keys
+
+
+def get_signing_keys(project_id):
+    """Get the signing keys for a project, from the cache if possible"""
+
+    keys = signing_keys_cache.get(project_id)
+
+    if keys is MISSING:
+        keys = signing_keys_flight.do(project_id, _load_and_cache, project_id)
+
+    return keys
+
+
+class TokenAuth(VMQAuth):
+    """Authenticates v2 connections, whose password is a signed token
+
+    Only the project's signing keys are needed, and they're cached (see
+    TOKEN_KEYS_CACHE_TTL), so most connects don't touch the database.
+    Blacklisting is the same as for v1 connections.
+    """
+
+    __slots__ = ()
+
+    @property
+    def authenticated(self):
+        credentials = self._credentials
+        keys = get_signing_keys(credentials.project_id)
+
+        if keys is None:
+            logger.error("No project with name '%s'", credentials.project_id)
+            return False
+
+        return verify_token(credentials, keys)
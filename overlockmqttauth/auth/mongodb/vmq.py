@@ -1,24 +1,197 @@
 import logging
+import os
 
-import bcrypt
-from mongoengine import Document, EmbeddedDocument, StringField, EmbeddedDocumentField
+from bson import ObjectId
+from mongoengine import Document, EmbeddedDocument, StringField, EmbeddedDocumentField, ListField
 import mongoengine
 
+from overlockmqttauth import invalidation, stats
 from overlockmqttauth.auth.base import MQTTAuth
+from overlockmqttauth.auth.batch import BatchLoader
+from overlockmqttauth.auth.cache import TTLCache, MISSING
+from overlockmqttauth.auth.hashing import BcryptVerifier
+from overlockmqttauth.auth.rediscache import make_redis_cache
+from overlockmqttauth.auth.singleflight import SingleFlight
 
 # FIXME fix imports
 from .overlock import Project
+from .blacklist import blacklist
+from .devices import DEVICE_SECRET, device_secret_matches
 
 
 logger = logging.getLogger(__name__)
 
 
+# project id -> frozenset of keys, or None if there's no such project
+project_keys_cache = TTLCache(
+    maxsize=int(os.getenv("PROJECT_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("PROJECT_CACHE_TTL", 60)),
+    negative_ttl=float(os.getenv("PROJECT_CACHE_NEGATIVE_TTL", 10)),
+)
+stats.register("project_keys_cache", project_keys_cache.stats)
+
+# Shared between all replicas if REDIS_URL is set
+project_keys_l2 = make_redis_cache(
+    "overlock:project_keys",
+    ttl=int(os.getenv("PROJECT_L2_TTL", 300)),
+    negative_ttl=max(1, int(project_keys_cache.negative_ttl)),
+    encode=sorted,
+    decode=frozenset,
+)
+if project_keys_l2 is not None:
+    stats.register("project_keys_l2", project_keys_l2.stats)
+
+# Concurrent connects for the same project share one query
+project_keys_flight = SingleFlight()
+stats.register("project_keys_flight", project_keys_flight.stats)
+
+
+def load_project_keys(project_id):
+    """Load the keys for a project from the database
+
+    Args:
+        project_id (str): project id
+
+    Returns:
+        frozenset: project keys, or None if the project doesn't exist
+    """
+
+    try:
+        project_keys = Project.objects(id=project_id).scalar("project_keys").get()
+    except mongoengine.DoesNotExist:
+        logger.info("No project with name '%s'", project_id)
+        return None
+
+    return frozenset(project_keys or ())
+
+
+def load_many_project_keys(project_ids):
+    """Load the keys for several projects in one query
+
+    Args:
+        project_ids (list(str)): project ids
+
+    Returns:
+        dict: project id -> frozenset of keys, or None if the project doesn't
+            exist
+    """
+
+    # One bad id would make the whole query fail
+    valid = [i for i in project_ids if ObjectId.is_valid(i)]
+
+    found = {}
+    if valid:
+        docs = Project.objects(id__in=valid).only("project_keys").as_pymongo()
+        for doc in docs:
+            found[str(doc["_id"])] = frozenset(doc.get("project_keys") or ())
+
+    return {i: found.get(i) for i in project_ids}
+
+
+def _load_many(project_ids):
+    if project_keys_l2 is None:
+        return load_many_project_keys(project_ids)
+
+    return project_keys_l2.get_or_load(project_ids, load_many_project_keys)
+
+
+# Misses for different projects arriving within PROJECT_BATCH_WINDOW_MS of
+# each other are loaded with one query. 0 disables batching
+project_keys_batcher = BatchLoader(
+    _load_many,
+    window=float(os.getenv("PROJECT_BATCH_WINDOW_MS", 0)) / 1000,
+    max_batch=int(os.getenv("PROJECT_BATCH_SIZE", 100)),
+)
+stats.register("project_keys_batcher", project_keys_batcher.stats)
+
+
+def get_project_keys(project_id):
+    """Get the keys for a project, from the cache if possible
+
+    Args:
+        project_id (str): project id
+
+    Returns:
+        frozenset: project keys, or None if the project doesn't exist
+    """
+
+    project_keys = project_keys_cache.get(project_id)
+
+    if project_keys is MISSING:
+        project_keys = project_keys_flight.do(project_id, _load_and_cache, project_id)
+
+    return project_keys
+
+
+def _load_one(project_id):
+    if project_keys_l2 is None:
+        return load_project_keys(project_id)
+
+    loaded = project_keys_l2.get_or_load([project_id],
+        lambda project_ids: {project_id: load_project_keys(project_id)})
+
+    return loaded[project_id]
+
+
+def _load_and_cache(project_id):
+    """Load from redis (if configured) then mongodb, and cache locally"""
+
+    if project_keys_batcher.window > 0:
+        project_keys = project_keys_batcher.load(project_id)
+    else:
+        project_keys = _load_one(project_id)
+
+    project_keys_cache.set(project_id, project_keys)
+    return project_keys
+
+
+def invalidate_project(project_id):
+    """Forget cached keys for a project"""
+    project_keys_cache.invalidate(project_id)
+    if project_keys_l2 is not None:
+        project_keys_l2.invalidate(project_id)
+
+
+invalidation.register("project", invalidate_project)
+
+
+def _make_bcrypt_verifier():
+    cache_ttl = float(os.getenv("BCRYPT_CACHE_TTL", 60))
+
+    # Successful checks can only be shared between replicas if they all hash
+    # passwords with the same key
+    key = os.getenv("AUTH_CACHE_KEY")
+    shared = None
+
+    if key:
+        shared = make_redis_cache(
+            "overlock:verified",
+            ttl=max(1, int(cache_ttl)),
+            encode=lambda digest: digest.hex(),
+            decode=bytes.fromhex,
+        )
+
+    return BcryptVerifier(
+        workers=int(os.getenv("BCRYPT_WORKERS", 0)),
+        cache_size=int(os.getenv("BCRYPT_CACHE_SIZE", 10000)),
+        cache_ttl=cache_ttl,
+        key=key.encode("utf8") if key else None,
+        shared=shared,
+    )
+
+
+bcrypt_verifier = _make_bcrypt_verifier()
+stats.register("bcrypt", bcrypt_verifier.stats)
+invalidation.register("user", bcrypt_verifier.forget)
+
+
 class ACL(EmbeddedDocument):
     """Vernemq 'pattern' match
 
     Attributes:
 
-        pattern (str): regex to match subscrube/publish ACLs
+        pattern (str): topic filter to match subscribe/publish ACLs, see
+            overlockmqttauth/acl.py
     """
 
     pattern = StringField()
@@ -52,8 +225,8 @@ class MQTTUser(Document):
     username = StringField()
     passhash = StringField()
 
-    publish_acl = EmbeddedDocumentField(ACL)
-    subscribe_acl = EmbeddedDocumentField(ACL)
+    publish_acl = ListField(EmbeddedDocumentField(ACL))
+    subscribe_acl = ListField(EmbeddedDocumentField(ACL))
 
     # Just specify it here so we know what it is for seeding etc.
     meta = {
@@ -87,6 +260,9 @@ class MQTTUser(Document):
         """Try to get a user with the specified username from the database, then
         make sure the password is correct
 
+        If the password was recently checked for this user, the database isn't
+        queried at all
+
         Todo:
             Blacklisting - overlock stuff
 
@@ -95,6 +271,9 @@ class MQTTUser(Document):
             password (str): plaintext password
         """
 
+        if bcrypt_verifier.is_verified(username, password):
+            return True
+
         user = cls.get_by_user(username)
 
         if user is None:
@@ -103,7 +282,7 @@ class MQTTUser(Document):
         return user.password_matches(password)
 
     def password_matches(self, password):
-        match = bcrypt.checkpw(password.encode("utf8"), self.passhash.encode("utf8"))
+        match = bcrypt_verifier.verify(self.username, password, self.passhash)
         logger.debug("Password matches: %s", match)
         return match
 
@@ -111,18 +290,41 @@ class MQTTUser(Document):
 class VMQAuth(MQTTAuth):
     """Interface to vernemq mongodb auth
 
-    Todo:
-        cache blacklists/authenticated status
+    Project keys are cached in project_keys_cache, see PROJECT_CACHE_SIZE,
+    PROJECT_CACHE_TTL and PROJECT_CACHE_NEGATIVE_TTL. 'd:' passwords are
+    checked against the device's own secrets instead if it has any, see
+    devices.py.
+    Blacklisting is checked against the in memory copy in blacklist.py
     """
 
+    __slots__ = ()
+
+    requires_mongodb = True
+
+    def _get_project_keys(self):
+        """Get the keys for this connection's project
+
+        Returns:
+            frozenset: project keys, or None if the project doesn't exist
+        """
+        return get_project_keys(self._credentials.project_id)
+
     @property
     def blacklisted(self):
-        # TODO
-        # overlock stuff
-        return False
+        credentials = self._credentials
+        return blacklist.is_blacklisted(credentials.password, credentials.project_id, credentials.device_id)
 
     @property
     def authenticated(self):
+        if self._credentials.secret_type == DEVICE_SECRET:
+            matches = device_secret_matches(self._credentials)
+
+            if matches is not None:
+                return matches
+
+        return self._project_key_matches()
+
+    def _project_key_matches(self):
         # FIXME
         # This should be moved to pub/sub checkers + create Product/Project afterwards
         # user = MQTTUser.get_by_user(self._username)
@@ -131,19 +333,20 @@ class VMQAuth(MQTTAuth):
         # else:
         #     logger.error("No user with name - checking project")
 
-        try:
-            project_keys = Project.objects(id=self._project_id).scalar("project_keys").get()
-        except mongoengine.DoesNotExist:
-            logger.exception("No project with name '%s'", self._project_id)
+        project_keys = self._get_project_keys()
+        password = self._credentials.password
+
+        if project_keys is None:
+            logger.error("No project with name '%s'", self._credentials.project_id)
 
             return False
 
         logger.debug("Got project - checking key")
 
         # Whole password is stored in database, including 'p:' prefix
-        if not self._password in project_keys:
+        if not password in project_keys:
             logger.error("Given password (%s) not in project keys (%s)",
-                self._password, project_keys)
+                password, project_keys)
 
             return False
 
@@ -0,0 +1,186 @@
+"""Redis cache shared between hook replicas
+
+This sits behind the in process caches, so a replica that has just started
+(or a new worker) gets its results from redis instead of mongodb. Everything
+is read with MGET and written with a pipeline, so a batch of lookups costs one
+round trip.
+
+Redis being unavailable is never fatal - errors are logged and treated as
+cache misses.
+"""
+
+import json
+import logging
+import os
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class RedisCache:
+    """Cache with a key prefix and TTL, storing values as JSON
+
+    None can be stored as a negative result, like TTLCache.
+
+    Args:
+        client (redis.StrictRedis): redis connection
+        prefix (str): prepended to every key
+        ttl (int): seconds until a value expires
+        negative_ttl (int): seconds until a stored None expires
+        encode (callable): converts a value to something json serialisable
+        decode (callable): converts the loaded json back
+    """
+
+    def __init__(self, client, prefix, ttl, negative_ttl=None, encode=None, decode=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.encode = encode or (lambda v: v)
+        self.decode = decode or (lambda v: v)
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key):
+        return "{}:{}".format(self.prefix, key)
+
+    def get_many(self, keys):
+        """Get several values in one round trip
+
+        Args:
+            keys (list): keys to get
+
+        Returns:
+            dict: key -> value for keys that were cached (values may be None)
+        """
+
+        if not keys:
+            return {}
+
+        try:
+            raw = self.client.mget([self._key(k) for k in keys])
+        except Exception: # pylint: disable=broad-except
+            self.errors += 1
+            logger.exception("Error reading from redis")
+            return {}
+
+        found = {}
+        for (key, value) in zip(keys, raw):
+            if value is None:
+                continue
+
+            loaded = json.loads(value.decode("utf8") if isinstance(value, bytes) else value)
+            found[key] = None if loaded is None else self.decode(loaded)
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+
+        return found
+
+    def set_many(self, items):
+        """Store several values in one round trip
+
+        Args:
+            items (dict): key -> value
+        """
+
+        if not items:
+            return
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for (key, value) in items.items():
+                if value is None:
+                    pipe.setex(self._key(key), self.negative_ttl, "null")
+                else:
+                    pipe.setex(self._key(key), self.ttl, json.dumps(self.encode(value)))
+            pipe.execute()
+        except Exception: # pylint: disable=broad-except
+            self.errors += 1
+            logger.exception("Error writing to redis")
+
+    def invalidate(self, key):
+        try:
+            self.client.delete(self._key(key))
+        except Exception: # pylint: disable=broad-except
+            self.errors += 1
+            logger.exception("Error deleting from redis")
+
+    def get_or_load(self, keys, load_many):
+        """Get keys from redis, loading and storing any that are missing
+
+        Args:
+            keys (list): keys to get
+            load_many (callable): takes a list of keys and returns a dict of
+                key -> value
+
+        Returns:
+            dict: key -> value
+        """
+
+        found = self.get_many(keys)
+        missing = [k for k in keys if k not in found]
+
+        if missing:
+            loaded = load_many(missing)
+            self.set_many(loaded)
+            found.update(loaded)
+
+        return found
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+
+_client = None
+
+
+def get_redis():
+    """Get a redis client for REDIS_URL
+
+    Returns:
+        redis.StrictRedis: client, or None if REDIS_URL isn't set
+    """
+
+    global _client
+
+    url = os.getenv("REDIS_URL")
+
+    if not url:
+        return None
+
+    if redis is None:
+        logger.error("REDIS_URL is set but redis is not installed - install overlockmqttauth[vernemq]")
+        return None
+
+    if _client is None:
+        # redis-py reconnects if its connection pool is used after a fork
+        _client = redis.StrictRedis.from_url(url, socket_timeout=0.5)
+
+    return _client
+
+
+def make_redis_cache(prefix, ttl, negative_ttl=None, encode=None, decode=None):
+    """Create a RedisCache if REDIS_URL is configured
+
+    Returns:
+        RedisCache: cache, or None if there's no redis configured
+    """
+
+    client = get_redis()
+
+    if client is None:
+        return None
+
+    return RedisCache(client, prefix, ttl, negative_ttl, encode, decode)
@@ -0,0 +1,85 @@
+"""Auth backends, by name
+
+Backends are MQTTAuth subclasses. The built in ones are registered in
+connection.py. Others can be registered with register_backend() before the
+hooks start, or AUTH_BACKEND can be set to 'some.module:SomeAuth' to import
+one.
+"""
+
+import importlib
+import os
+
+
+_backends = {}
+
+_default = None
+
+
+def register_backend(name, backend):
+    """Make a backend available by name
+
+    Args:
+        name (str): name for AUTH_BACKEND/get_connection(auth_type=...)
+        backend (type): MQTTAuth subclass
+    """
+    _backends[name] = backend
+
+
+def get_backend(name):
+    """Look up a backend
+
+    Args:
+        name (str): registered name, or 'module:attribute' to import
+
+    Returns:
+        type: MQTTAuth subclass
+
+    Raises:
+        ValueError: no such backend
+    """
+
+    try:
+        return _backends[name]
+    except KeyError:
+        pass
+
+    if ":" in name:
+        (module_name, attr) = name.split(":", 1)
+
+        try:
+            backend = getattr(importlib.import_module(module_name), attr)
+        except (ImportError, AttributeError) as e:
+            raise ValueError("Can't import auth backend '{}': {}".format(name, e))
+
+        register_backend(name, backend)
+        return backend
+
+    raise ValueError("Unknown auth backend '{}' (registered: {})".format(
+        name, ", ".join(sorted(_backends))))
+
+
+def set_default_backend(name):
+    """Set the backend used when get_connection isn't given one
+
+    Args:
+        name (str): backend name, or None to go back to AUTH_BACKEND
+    """
+    global _default # pylint: disable=global-statement
+
+    if name is not None:
+        get_backend(name)
+
+    _default = name
+
+
+def default_backend():
+    """Name of the default backend - AUTH_BACKEND unless changed with
+    set_default_backend()"""
+    if _default is not None:
+        return _default
+
+    return os.getenv("AUTH_BACKEND", "mongodb")
+
+
+def backend_names():
+    return sorted(_backends)
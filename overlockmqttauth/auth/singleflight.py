@@ -0,0 +1,139 @@
+"""Collapse concurrent identical lookups into one
+
+When lots of clients connect at once (eg. a gateway restarting), they all ask
+for the same thing at the same time. Rather than each of them querying the
+database, the first caller for a key does the lookup and everyone else asking
+for that key while it is in flight waits for and shares its result.
+
+SingleFlight is for code running in threads (the flask server, or the hook
+handlers run by brokers/server.py), AsyncSingleFlight for coroutines on one
+event loop.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread safe single flight group
+
+    Attributes:
+        calls (int): number of times the wrapped function was actually called
+        shared (int): number of callers that got a result from someone else's
+            call instead
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> _Call
+        self._calls = {}
+
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args):
+        """Call fn(*args), unless a call for key is already in flight
+
+        Args:
+            key (object): what is being looked up
+            fn (callable): does the lookup
+            args: passed to fn
+
+        Returns:
+            object: whatever fn returned, for this or the in flight call
+
+        Raises:
+            Exception: whatever fn raised, for this or the in flight call
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = fn(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": len(self._calls),
+        }
+
+
+class AsyncSingleFlight:
+    """Single flight group for coroutines
+
+    Must only be used from one event loop.
+    """
+
+    def __init__(self):
+        # key -> Future
+        self._calls = {}
+
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args):
+        """Await fn(*args), unless a call for key is already in flight
+
+        The in flight call is shielded, so one waiter being cancelled doesn't
+        cancel the lookup for everyone else.
+        """
+
+        future = self._calls.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(fn(*args))
+            self._calls[key] = future
+            self.calls += 1
+
+            def _done(_):
+                if self._calls.get(key) is future:
+                    del self._calls[key]
+
+            future.add_done_callback(_done)
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": len(self._calls),
+        }
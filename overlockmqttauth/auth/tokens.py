@@ -0,0 +1,111 @@
+"""Signed device tokens
+
+v2 connections use a token as the password instead of a stored secret:
+
+    username: v2:<project id>:<product name>:<device id>
+    password: t:<key id>.<expiry>.<signature>
+
+where expiry is a unix timestamp and signature is the unpadded urlsafe
+base64 HMAC-SHA256, with the project's signing key <key id>, of
+'<username>:<key id>:<expiry>'. Checking one only needs the project's
+signing keys, which are small and cached, so there's no per connection
+database lookup.
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_PREFIX = "t"
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _signature(key, username, key_id, expiry):
+    message = "{}:{}:{}".format(username, key_id, expiry).encode("utf8")
+    digest = hmac.new(key, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def sign_token(key, key_id, username, expiry):
+    """Make the password for a v2 connection
+
+    Args:
+        key (bytes): project signing key
+        key_id (str): id of the key, so keys can be rotated
+        username (str): v2 username the token is for
+        expiry (int): unix time the token stops working at
+
+    Returns:
+        str: password, including the 't:' prefix
+    """
+
+    if "." in key_id or ":" in key_id:
+        raise ValueError("Key ids can't contain '.' or ':'")
+
+    expiry = int(expiry)
+
+    return "{}:{}.{}.{}".format(TOKEN_PREFIX, key_id, expiry,
+        _signature(key, username, key_id, expiry))
+
+
+def parse_token(secret):
+    """Split a token (without the 't:' prefix) into its parts
+
+    Returns:
+        tuple: (key id, expiry, signature)
+
+    Raises:
+        InvalidToken: not a token
+    """
+
+    try:
+        (key_id, expiry, signature) = secret.split(".")
+        return (key_id, int(expiry), signature)
+    except ValueError:
+        raise InvalidToken("Malformed token")
+
+
+def verify_token(credentials, keys, now=None):
+    """Check a token against a project's signing keys
+
+    Args:
+        credentials (Credentials): parsed v2 username/password
+        keys (dict): key id -> key (bytes) for the credentials' project
+        now (float): current unix time
+
+    Returns:
+        bool: if the token is valid for this username and hasn't expired
+    """
+
+    if credentials.secret_type != TOKEN_PREFIX:
+        logger.info("Not a token")
+        return False
+
+    try:
+        (key_id, expiry, signature) = parse_token(credentials.secret)
+    except InvalidToken:
+        logger.info("Malformed token for %s", credentials.username)
+        return False
+
+    if expiry <= (time.time() if now is None else now):
+        logger.info("Expired token for %s", credentials.username)
+        return False
+
+    key = keys.get(key_id)
+
+    if key is None:
+        logger.info("Unknown signing key '%s' for %s", key_id, credentials.username)
+        return False
+
+    expected = _signature(key, credentials.username, key_id, expiry)
+
+    return hmac.compare_digest(expected, signature)
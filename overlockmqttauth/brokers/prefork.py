@@ -0,0 +1,434 @@
+"""Pre-forking supervisor for the hook server
+
+The supervisor binds the listening socket and forks a number of workers which
+all accept connections on it, either by inheriting the socket or (with
+reuse_port) by each binding their own socket with SO_REUSEPORT so the kernel
+balances connections between them. Anything that can't be shared between
+processes (mongodb connections, the paho client and its network thread) must
+be set up in post_fork, not in the supervisor.
+
+Signals handled by the supervisor:
+
+- SIGTERM/SIGINT: gracefully stop all workers and exit
+- SIGHUP: recycle workers one at a time, starting the replacement before
+  stopping the old worker so capacity never drops
+"""
+
+import errno
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+
+
+def bind_socket(host, port, reuse_port=False, backlog=1024):
+    """Create a listening TCP socket
+
+    Args:
+        host (str): address to bind to
+        port (int): port to bind to
+        reuse_port (bool): set SO_REUSEPORT so other processes can bind the
+            same address
+        backlog (int): listen backlog
+
+    Returns:
+        socket.socket: bound and listening socket
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+
+    return sock
+
+
+class _TrackedResponse:
+    """Response iterable which tells the tracker when the server is done
+    with it"""
+
+    def __init__(self, result, on_close):
+        self._result = result
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._result)
+
+    def close(self):
+        try:
+            if hasattr(self._result, "close"):
+                self._result.close()
+        finally:
+            self._on_close()
+
+
+class RequestTracker:
+    """WSGI middleware which keeps track of the requests a worker serves
+
+    Requests in flight are counted so a stopping worker can wait for them -
+    werkzeug's threaded server runs them in daemon threads, which would
+    otherwise be killed as soon as serve_forever returns. on_limit is called
+    once max_requests have been served, to recycle workers after a number of
+    requests so slow leaks in a worker don't build up forever.
+
+    Args:
+        app (callable): WSGI app
+        max_requests (int): call on_limit after this many requests. 0 for no
+            limit
+        on_limit (callable): called (in a new thread) when the limit is hit
+    """
+
+    def __init__(self, app, max_requests=0, on_limit=None):
+        self.app = app
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+
+        self._count = 0
+        self._active = 0
+        self._cond = threading.Condition()
+
+    @property
+    def active(self):
+        return self._active
+
+    def _started(self):
+        with self._cond:
+            self._count += 1
+            self._active += 1
+            hit_limit = self._count == self.max_requests
+
+        if hit_limit:
+            logger.info("Served %d requests - recycling worker", self.max_requests)
+            # on_limit might block until the server has stopped, which it
+            # won't do while this request is being handled
+            threading.Thread(target=self.on_limit, daemon=True).start()
+
+    def _finished(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def __call__(self, environ, start_response):
+        self._started()
+
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            self._finished()
+            raise
+
+        return _TrackedResponse(result, self._finished)
+
+    def wrap_async(self, handler):
+        """Track requests to a HookServer async route, which are handled
+        without going through the WSGI app"""
+
+        async def _tracked(payload):
+            self._started()
+            try:
+                return await handler(payload)
+            finally:
+                self._finished()
+
+        return _tracked
+
+    def wait_idle(self, timeout=None):
+        """Wait until no requests are in flight
+
+        Returns:
+            bool: False if it timed out
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._active, timeout)
+
+
+class PreforkSupervisor:
+    """Fork and supervise a set of hook server workers
+
+    Args:
+        make_server (callable): called in the worker with (app, sock), should
+            return an object with serve_forever() and shutdown() methods.
+            Requests to a HookServer's async_routes count towards
+            max_requests as well
+        app (callable): WSGI app to serve
+        workers (int): number of worker processes. 0 means one per cpu
+        host (str): address to listen on
+        port (int): port to listen on
+        reuse_port (bool): each worker binds its own SO_REUSEPORT socket
+            instead of all of them accepting on one inherited socket
+        post_fork (callable): called in each worker before serving, to set up
+            per-process connections
+        max_requests (int): recycle a worker after this many requests (with
+            up to 10% jitter so they don't all restart at once). 0 to disable
+        graceful_timeout (float): seconds to wait for a worker to finish its
+            in flight requests before killing it, and for a replacement worker
+            to start when recycling
+    """
+
+    def __init__(self, make_server, app, workers, host, port, reuse_port=False,
+                 post_fork=None, max_requests=0, graceful_timeout=30):
+        self.make_server = make_server
+        self.app = app
+        self.workers = workers or os.cpu_count() or 1
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.post_fork = post_fork
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+
+        self.sock = None
+        # pid -> time it was asked to stop, or None if running
+        self._children = {}
+        self._stopping = False
+        self._recycle = False
+
+    def _worker_main(self, ready):
+        for signum in _SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+
+        if self.reuse_port:
+            sock = bind_socket(self.host, self.port, reuse_port=True)
+        else:
+            sock = self.sock
+
+        if self.post_fork is not None:
+            self.post_fork()
+
+        server = None
+
+        def _shutdown():
+            server.shutdown()
+
+        limit = 0
+        if self.max_requests:
+            limit = self.max_requests + random.randint(0, self.max_requests // 10)
+
+        tracker = RequestTracker(self.app, limit, _shutdown)
+        server = self.make_server(tracker, sock)
+
+        async_routes = getattr(server, "async_routes", None)
+        if async_routes:
+            server.async_routes = {path: tracker.wrap_async(handler)
+                for (path, handler) in async_routes.items()}
+
+        def _on_term(signum, frame): # pylint: disable=unused-argument
+            logger.info("Worker %d stopping", os.getpid())
+            threading.Thread(target=_shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, _on_term)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        # The listening socket is already accepting connections, they just
+        # wait in the backlog until serve_forever picks them up
+        try:
+            os.write(ready, b"\0")
+        except BrokenPipeError:
+            # Nothing was waiting for this worker
+            pass
+        os.close(ready)
+
+        logger.info("Worker %d started", os.getpid())
+        server.serve_forever()
+
+        # The server has stopped accepting requests, but might not have
+        # waited for the ones it was handling
+        if not tracker.wait_idle(self.graceful_timeout):
+            logger.warning("Worker %d stopping with %d requests still in flight",
+                os.getpid(), tracker.active)
+
+    def _wait_ready(self, ready):
+        deadline = time.monotonic() + self.graceful_timeout
+
+        while not self._stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            (readable, _, _) = select.select([ready], [], [], min(remaining, 0.2))
+            if readable:
+                # EOF if the worker exited before it was ready
+                return os.read(ready, 1) == b"\0"
+
+        return False
+
+    def _spawn(self, wait=False):
+        """Fork a worker
+
+        Args:
+            wait (bool): wait until the worker is ready to serve requests
+
+        Returns:
+            int: pid of the worker, or None if it was waited for but didn't
+                become ready. It has been told to stop in that case
+        """
+
+        (ready_r, ready_w) = os.pipe()
+
+        # Until the worker has reset them, signals would run the supervisor's
+        # handlers in the worker and be lost
+        signal.pthread_sigmask(signal.SIG_BLOCK, _SIGNALS)
+        try:
+            pid = os.fork()
+        except OSError:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+            os.close(ready_r)
+            os.close(ready_w)
+            raise
+
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                self._worker_main(ready_w)
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code) # pylint: disable=protected-access
+
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+        os.close(ready_w)
+        self._children[pid] = None
+
+        try:
+            if wait and not self._wait_ready(ready_r):
+                logger.warning("Worker %d did not start", pid)
+                self._stop_child(pid)
+                return None
+        finally:
+            os.close(ready_r)
+
+        return pid
+
+    def _stop_child(self, pid):
+        if self._children.get(pid) is None:
+            self._children[pid] = time.monotonic()
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def _reap(self):
+        """Reap exited workers
+
+        Returns:
+            list(int): exit statuses of workers that exited without being
+                asked to
+        """
+
+        unexpected = []
+
+        while True:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid == 0:
+                break
+
+            if pid not in self._children:
+                continue
+
+            if self._children.pop(pid) is None:
+                unexpected.append(status)
+                if status == 0:
+                    logger.info("Worker %d exited", pid)
+                else:
+                    logger.warning("Worker %d exited with status %d", pid, status)
+
+        return unexpected
+
+    def _kill_stragglers(self):
+        now = time.monotonic()
+        for (pid, stopped_at) in list(self._children.items()):
+            if stopped_at is not None and now - stopped_at > self.graceful_timeout:
+                logger.warning("Worker %d did not stop in time - killing", pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def _recycle_all(self):
+        old = [pid for (pid, stopped) in self._children.items() if stopped is None]
+
+        for pid in old:
+            # Only stop the old worker once its replacement is serving
+            if self._spawn(wait=True) is None:
+                logger.warning("Stopped recycling workers")
+                break
+
+            self._stop_child(pid)
+
+    def _on_stop(self, signum, frame): # pylint: disable=unused-argument
+        self._stopping = True
+
+    def _on_hup(self, signum, frame): # pylint: disable=unused-argument
+        self._recycle = True
+
+    def run(self):
+        """Bind, start workers, and supervise until told to stop"""
+
+        # With SO_REUSEPORT the workers bind their own sockets. If the
+        # supervisor held one as well, the kernel would hand it connections
+        # that nothing ever accepts
+        if not self.reuse_port:
+            self.sock = bind_socket(self.host, self.port)
+
+        logger.info("Starting %d workers on %s:%d", self.workers, self.host, self.port)
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_hup)
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        try:
+            while not self._stopping:
+                time.sleep(0.2)
+
+                if self._recycle:
+                    self._recycle = False
+                    logger.info("Recycling workers")
+                    self._recycle_all()
+
+                # Workers recycled by max_requests exit by themselves
+                for status in self._reap():
+                    if status != 0:
+                        # Don't spin if workers are failing on startup
+                        time.sleep(1)
+                    self._spawn()
+
+                self._kill_stragglers()
+        finally:
+            logger.info("Stopping workers")
+
+            for pid in list(self._children):
+                self._stop_child(pid)
+
+            while self._children:
+                time.sleep(0.1)
+                self._reap()
+                self._kill_stragglers()
+
+            if self.sock is not None:
+                self.sock.close()
@@ -0,0 +1,438 @@
+"""asyncio HTTP/1.1 server for the vernemq webhooks
+
+The werkzeug development server that ``app.run`` starts handles a single
+request at a time and closes the connection after every response, so the
+pooled (hackney) connections vernemq keeps open to the hook endpoint are never
+reused. This serves the same WSGI app over persistent HTTP/1.1 connections:
+requests are parsed on the event loop and the hook handlers are run in a
+thread pool, because they still talk to mongodb synchronously.
+
+Hooks with a native coroutine version can be passed as async_routes, which are
+awaited on the event loop instead, without going through WSGI or the thread
+pool.
+
+Only what vernemq actually sends is supported - no TLS, no upgrades, no
+``Expect: 100-continue``.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_HEADER_SIZE = 64 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+
+REASONS = {
+    400: "Bad Request",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class BadRequest(Exception):
+
+    def __init__(self, msg, status=400):
+        super().__init__(msg)
+        self.status = status
+
+
+class HTTPRequest:
+    """One parsed request off the wire
+
+    Attributes:
+        method (str): GET, POST, etc.
+        target (str): raw request target, including query string
+        version (str): HTTP/1.0 or HTTP/1.1
+        headers (list(tuple(str, str))): lowercased header names and values
+        body (bytes): request body, already de-chunked
+    """
+
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def header(self, name, default=None):
+        for (key, value) in self.headers:
+            if key == name:
+                return value
+
+        return default
+
+    @property
+    def keep_alive(self):
+        """Whether the connection should be kept open after responding
+
+        HTTP/1.1 defaults to keep alive, HTTP/1.0 has to ask for it
+        """
+        connection = self.header("connection", "").lower()
+
+        if self.version == "HTTP/1.1":
+            return connection != "close"
+
+        return connection == "keep-alive"
+
+
+async def _read_chunked(reader):
+    body = bytearray()
+
+    while True:
+        size_line = await reader.readuntil(b"\r\n")
+
+        try:
+            size = int(size_line.split(b";", 1)[0], 16)
+        except ValueError:
+            raise BadRequest("Invalid chunk size")
+
+        if size == 0:
+            # Skip any trailers
+            while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                pass
+            return bytes(body)
+
+        if len(body) + size > MAX_BODY_SIZE:
+            raise BadRequest("Request body too large", 413)
+
+        body.extend(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+async def read_request(reader):
+    """Read one request from the stream
+
+    Args:
+        reader (asyncio.StreamReader): connection to read from
+
+    Returns:
+        HTTPRequest: parsed request, or None if the client closed the
+            connection cleanly between requests
+
+    Raises:
+        BadRequest: malformed or oversized request
+    """
+
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise BadRequest("Connection closed in the middle of request headers")
+    except asyncio.LimitOverrunError:
+        raise BadRequest("Request headers too large")
+
+    lines = head[:-4].decode("latin-1").split("\r\n")
+
+    try:
+        (method, target, version) = lines[0].split(" ")
+    except ValueError:
+        raise BadRequest("Invalid request line")
+
+    if version not in ("HTTP/1.0", "HTTP/1.1"):
+        raise BadRequest("Unsupported HTTP version '{}'".format(version))
+
+    headers = []
+    for line in lines[1:]:
+        (name, sep, value) = line.partition(":")
+        if not sep:
+            raise BadRequest("Invalid header line")
+        headers.append((name.strip().lower(), value.strip()))
+
+    request = HTTPRequest(method, target, version, headers, b"")
+
+    try:
+        if request.header("transfer-encoding", "").lower() == "chunked":
+            request.body = await _read_chunked(reader)
+        else:
+            try:
+                length = int(request.header("content-length", 0))
+            except ValueError:
+                raise BadRequest("Invalid Content-Length", 411)
+
+            if length > MAX_BODY_SIZE:
+                raise BadRequest("Request body too large", 413)
+
+            if length:
+                request.body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise BadRequest("Connection closed in the middle of request body")
+
+    return request
+
+
+def build_environ(request, server_name, server_port, peername):
+    """Build a WSGI environ for the request"""
+
+    (path, _, query) = request.target.partition("?")
+
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote(path, "latin-1"),
+        "QUERY_STRING": query,
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": request.version,
+        "REMOTE_ADDR": peername[0] if peername else "",
+        "REMOTE_PORT": str(peername[1]) if peername else "",
+        "CONTENT_LENGTH": str(len(request.body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(request.body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for (name, value) in request.headers:
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name in ("content-length", "transfer-encoding"):
+            continue
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            if key in environ:
+                environ[key] += "," + value
+            else:
+                environ[key] = value
+
+    return environ
+
+
+def call_wsgi(app, environ):
+    """Run the WSGI app to completion
+
+    Returns:
+        tuple(str, list, bytes): status line, headers, body
+    """
+
+    response = []
+    body = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response[:] = [status, headers]
+        return body.append
+
+    result = app(environ, start_response)
+    try:
+        for chunk in result:
+            body.append(chunk)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    return (response[0], response[1], b"".join(body))
+
+
+def _serialise_response(status, headers, body, keep_alive):
+    lines = ["HTTP/1.1 {}".format(status)]
+
+    for (name, value) in headers:
+        if name.lower() in ("connection", "content-length", "transfer-encoding"):
+            continue
+        lines.append("{}: {}".format(name, value))
+
+    lines.append("Content-Length: {:d}".format(len(body)))
+    lines.append("Connection: {}".format("keep-alive" if keep_alive else "close"))
+
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+class HookServer:
+    """Serve a WSGI app over keep-alive HTTP/1.1 using asyncio
+
+    Args:
+        app (callable): WSGI app - the flask app in brokers/vernemq.py
+        host (str): address to bind to. Ignored if sock is passed
+        port (int): port to bind to. Ignored if sock is passed
+        sock (socket.socket): already bound and listening socket to accept
+            connections on
+        threads (int): number of threads to run handlers in
+        keepalive_timeout (float): close idle connections after this many
+            seconds
+        async_routes (dict): path -> coroutine function taking the decoded
+            JSON body of a POST and returning the JSON response. These are
+            used instead of the WSGI app for those paths
+    """
+
+    def __init__(self, app, host="0.0.0.0", port=5000, sock=None, threads=None,
+                 keepalive_timeout=None, async_routes=None):
+        self.app = app
+        self.async_routes = async_routes or {}
+        self.host = host
+        self.port = port
+        self.sock = sock
+
+        if threads is None:
+            threads = int(os.getenv("HOOK_THREADS", 32))
+        if keepalive_timeout is None:
+            keepalive_timeout = float(os.getenv("HOOK_KEEPALIVE_TIMEOUT", 60))
+
+        self.threads = threads
+        self.keepalive_timeout = keepalive_timeout
+
+        self._executor = None
+        self._server = None
+        self._loop = None
+
+        # writer -> whether a request is currently being handled on it
+        self._connections = {}
+        self._closing = False
+
+    @property
+    def sockets(self):
+        return self._server.sockets if self._server else []
+
+    async def _call_async_route(self, handler, request):
+        try:
+            payload = json.loads(request.body.decode("utf8"))
+        except ValueError:
+            return ("400 Bad Request", [], b"")
+
+        result = await handler(payload)
+
+        return ("200 OK", [("Content-Type", "application/json")],
+            json.dumps(result).encode("utf8"))
+
+    async def _respond(self, request, writer):
+        handler = None
+        if request.method == "POST":
+            handler = self.async_routes.get(request.target.partition("?")[0])
+
+        try:
+            if handler is not None:
+                (status, headers, body) = await self._call_async_route(handler, request)
+            else:
+                sockname = writer.get_extra_info("sockname") or (self.host, self.port)
+                environ = build_environ(request, sockname[0], sockname[1],
+                    writer.get_extra_info("peername"))
+
+                (status, headers, body) = await self._loop.run_in_executor(
+                    self._executor, call_wsgi, self.app, environ)
+        except Exception: # pylint: disable=broad-except
+            logger.exception("Unhandled error in hook handler")
+            (status, headers, body) = ("500 Internal Server Error", [], b"")
+
+        keep_alive = request.keep_alive
+        writer.write(_serialise_response(status, headers, body, keep_alive))
+        await writer.drain()
+
+        return keep_alive
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one connection until it is closed
+
+        Requests are handled in order, so pipelined requests get responses in
+        the order they were sent.
+        """
+
+        self._connections[writer] = False
+
+        try:
+            while not self._closing:
+                try:
+                    request = await asyncio.wait_for(read_request(reader),
+                        self.keepalive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except BadRequest as e:
+                    logger.warning("Bad request from %s: %s",
+                        writer.get_extra_info("peername"), e)
+                    status = "{:d} {}".format(e.status, REASONS[e.status])
+                    writer.write(_serialise_response(status, [], b"", False))
+                    break
+
+                if request is None:
+                    break
+
+                self._connections[writer] = True
+                if not await self._respond(request, writer):
+                    break
+                self._connections[writer] = False
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self._connections[writer]
+            writer.close()
+
+    async def start(self):
+        """Start listening - must be called from inside the event loop"""
+
+        self._loop = asyncio.get_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+
+        if self.sock is not None:
+            self._server = await asyncio.start_server(self.handle_connection,
+                sock=self.sock, limit=MAX_HEADER_SIZE)
+        else:
+            self._server = await asyncio.start_server(self.handle_connection,
+                self.host, self.port, limit=MAX_HEADER_SIZE)
+
+        logger.info("Serving hooks on %s with %d threads",
+            [s.getsockname() for s in self._server.sockets], self.threads)
+
+    async def stop(self, timeout=30):
+        """Stop accepting connections and wait for in flight requests
+
+        Idle keep-alive connections are closed straight away, busy ones are
+        closed after the current response has been sent.
+        """
+
+        self._closing = True
+
+        if self._server is not None:
+            self._server.close()
+
+            for (writer, busy) in list(self._connections.items()):
+                if not busy:
+                    writer.close()
+
+            waited = 0
+            while self._connections and waited < timeout:
+                await asyncio.sleep(0.1)
+                waited += 0.1
+
+            await self._server.wait_closed()
+            self._server = None
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def shutdown(self):
+        """Gracefully stop serve_forever
+
+        Safe to call from other threads and from signal handlers
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def serve_forever(self):
+        """Create an event loop and serve until interrupted"""
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+
+        try:
+            loop.run_until_complete(self.start())
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.stop())
+            loop.close()
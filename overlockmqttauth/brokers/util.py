@@ -1,9 +1,15 @@
 import logging
-import re
 import os
-import json
-from datetime import datetime
-from overlockmqttauth.client import client as mqttc
+import sys
+from overlockmqttauth import invalidation, stats
+from overlockmqttauth.acl import ACLEngine, DecisionCache, Identity, PUBLISH, SUBSCRIBE
+from overlockmqttauth.auth.mongodb.acl import load_acls
+from overlockmqttauth.client import get_publishers
+from overlockmqttauth.encoding import get_encoder
+from overlockmqttauth.flap import FlapDebouncer
+from overlockmqttauth.sessions import SessionTable
+from overlockmqttauth.spool import Spool, SpoolingPublisher, claim_spool_dir
+from overlockmqttauth.status import StatusPublisher
 
 
 logger = logging.getLogger(__name__)
@@ -29,18 +35,17 @@ def build_connect_status_payload(_request):
             'Port': 1883
         }
 
-    For now, this is empty.
+    'Time' is added by status_publisher when it's published
     """
     rq = _request.json
-    return json.dumps({
+    return {
         'ClientAddr': rq['peer_addr'],
         'Protocol': 'mqtt-tcp',
         'ClientID': rq['client_id'],
         'User': rq['username'],
         'Port': rq['peer_port'],
         'Action': 'Connect',
-        'Time': datetime.utcnow().isoformat(),
-    })
+    }
 
 
 def build_disconnect_status_payload(_request, dropped):
@@ -58,16 +63,28 @@ def build_disconnect_status_payload(_request, dropped):
             'WriteBytes': 32,
         }
 
-    For now, this is empty.
+    'Time' is added by status_publisher when it's published
     """
     #  This is not a typo - disconnect status shares all the fields with connect
-    return json.dumps({
+    return {
         'Protocol': 'mqtt-tcp',
         'ClientID': _request.json['client_id'],
         'Action': 'Disconnect',
-        'Time': datetime.utcnow().isoformat(),
         'Reason': 'Peer disappeared' if dropped else 'Peer disconnected',
-    })
+    }
+
+
+def _device(session, client_id):
+    """(org, device type, device id) from the session, or parsed from the
+    client id if this process has no session for it
+
+    Raises:
+        InvalidClientId: not a device client id
+    """
+    if session is not None and session.device is not None:
+        return session.device
+
+    return client_id_to_org_type_id(client_id)
 
 
 def exit_handler(_request, dropped):
@@ -78,20 +95,23 @@ def exit_handler(_request, dropped):
     #  'g:abcdef:fridge:fridge-uuid1'}
     client_id = _request.json['client_id']
 
+    session = sessions.pop(_request.json.get('mountpoint', ''), client_id)
+    decision_cache.evict(client_id)
+
     if client_id.startswith('controller'):
         return
 
     try:
-        _, device_type, device_id = client_id_to_org_type_id(client_id)
+        _, device_type, device_id = _device(session, client_id)
     except InvalidClientId:
         logger.warning("Invalid Client Id: %s", client_id)
         return
 
-    topic = "iot-2/type/{}/id/{}/mon".format(device_type, device_id)
+    topic = "iot-2/type/{}/id/{}/mon{}".format(device_type, device_id, status_encoder.topic_suffix)
 
     payload = build_disconnect_status_payload(_request, dropped)
-    logger.debug("Publishing MQTT")
-    mqttc.publish(topic, payload)
+    logger.debug("Queueing status")
+    flap_debouncer.put(topic, payload)
 
 
 def enter_handler(_request):
@@ -105,17 +125,60 @@ def enter_handler(_request):
     if client_id.startswith('controller'):
         return
 
+    session = sessions.get(_request.json.get('mountpoint', ''), client_id)
+
     try:
-        _, device_type, device_id = client_id_to_org_type_id(client_id)
+        device = _device(session, client_id)
     except InvalidClientId:
         logger.warning("Invalid Client Id: %s", client_id)
         return
 
-    topic = "iot-2/type/{}/id/{}/mon".format(device_type, device_id)
+    logger.info("New client: %s", device)
+
+    _, device_type, device_id = device
+
+    topic = "iot-2/type/{}/id/{}/mon{}".format(device_type, device_id, status_encoder.topic_suffix)
 
     payload = build_connect_status_payload(_request)
-    logger.debug("Publishing MQTT")
-    mqttc.publish(topic, payload)
+    logger.debug("Queueing status")
+    flap_debouncer.put(topic, payload)
+
+
+def start_session(as_json, connection):
+    """Remember what was found out about a client in auth_on_register
+
+    Args:
+        as_json (dict): auth_on_register payload
+        connection (MQTTConnection): authenticated connection
+
+    Returns:
+        Session: new session
+    """
+
+    client_id = as_json["client_id"]
+
+    # Reconnecting, possibly as someone else
+    decision_cache.evict(client_id)
+
+    try:
+        (org, device_type, device_id) = client_id_to_org_type_id(client_id)
+    except InvalidClientId:
+        device = None
+    else:
+        # Shared by every device of the same type in the project
+        device = (sys.intern(org), sys.intern(device_type), device_id)
+
+    return sessions.add(
+        as_json["username"],
+        client_id,
+        as_json.get("mountpoint", ""),
+        project_id=connection.project_id,
+        device=device,
+    )
+
+
+def end_session(as_json):
+    sessions.pop(as_json.get("mountpoint", ""), as_json.get("client_id"))
 
 
 def client_id_to_org_type_id(client_id):
@@ -136,69 +199,219 @@ def client_id_to_org_type_id(client_id):
     return (org, device_type, device_id)
 
 
-# TODO
-# move this stuff into API or something
-# will have to query datbase at some point
+# Anyone can publish events and subscribe to commands for any device, eg.
+#
+#     /iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/evt/boom/fmt/json
+#
+# Anything else has to be allowed by ACLs on the project or user in the
+# database
+DEFAULT_PUBLISH_ACL = [
+    "iot-2/type/+/id/+/evt/+/fmt/+",
+    "/iot-2/type/+/id/+/evt/+/fmt/+",
+]
+DEFAULT_SUBSCRIBE_ACL = [
+    "iot-2/type/+/id/+/cmd/+/fmt/+",
+    "/iot-2/type/+/id/+/cmd/+/fmt/+",
+]
+
+acl_engine = ACLEngine(
+    DEFAULT_PUBLISH_ACL,
+    DEFAULT_SUBSCRIBE_ACL,
+    loader=load_acls,
+    cache_size=int(os.getenv("ACL_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("ACL_CACHE_TTL", 60)),
+)
+decision_cache = DecisionCache(
+    maxsize=int(os.getenv("ACL_DECISION_CACHE_SIZE", 100000)),
+    ttl=float(os.getenv("ACL_CACHE_TTL", 60)),
+    max_topics=int(os.getenv("ACL_DECISION_CACHE_TOPICS", 100)),
+)
+sessions = SessionTable(maxsize=int(os.getenv("SESSION_TABLE_SIZE", 100000)))
+stats.register("acl", acl_engine.stats)
+stats.register("sessions", sessions.stats)
+stats.register("acl_decisions", decision_cache.stats)
+
+
+def init_acls(backend):
+    """Only look up project/user ACLs if the auth backend uses mongodb
+
+    Without it there is nowhere to load them from, so only the default ACLs
+    apply
+
+    Args:
+        backend (type): auth backend in use
+    """
+
+    acl_engine.loader = load_acls if backend.requires_mongodb else None
+    acl_engine.clear()
+    decision_cache.clear()
+
+
+# Set up in each worker by init_status_spool, if STATUS_SPOOL_DIR is set
+status_spool = None
+
 
-def _get_regex(topic_type):
-    """get regex that matches a topic type
+def _publish_status(topic, payload):
+    if status_spool is not None:
+        status_spool(topic, payload)
+    else:
+        get_publishers().publish(topic, payload)
 
-    Example:
 
-        /iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/evt/boom/fmt/json
+def init_status_spool():
+    """Spool status events to STATUS_SPOOL_DIR while the broker is down
+
+    Has to be called after forking, as each worker claims its own directory
     """
-    return re.compile(r"""
-    ^
-        /?iot-2
-        /type/(?P<message_type>\w+)   # device type
-        /id/(?P<auto_id>                # full identifier for this device
-            (?P<api_ver>v[0-9])         # api version - v1, v2, etc
-            :(?P<project_id>[\w_-]+)        # project id
-            :(?P<product_name>[\w_-]+)      # name of product (same as device type?)
-            :(?P<client_node_id>[\w_-]+)    # 'device id'
-        )
-        /{0:s}/(?P<event>\w+)              # type of event?
-        /fmt/\w+
-    $
-    """.format(topic_type), re.VERBOSE)
-
-
-PUB_ACL_REGEX = _get_regex("evt")
-SUB_ACL_REGEX = _get_regex("cmd")
+
+    global status_spool # pylint: disable=global-statement
+
+    base = os.getenv("STATUS_SPOOL_DIR")
+
+    if not base:
+        return
+
+    spool = Spool(
+        claim_spool_dir(base),
+        segment_size=int(os.getenv("STATUS_SPOOL_SEGMENT_SIZE", 16 * 1024 * 1024)),
+        max_bytes=int(os.getenv("STATUS_SPOOL_MAX_BYTES", 1024 * 1024 * 1024)),
+        fsync_every=int(os.getenv("STATUS_SPOOL_FSYNC_EVERY", 100)),
+        fsync_interval=float(os.getenv("STATUS_SPOOL_FSYNC_INTERVAL", 1)),
+    )
+    logger.info("Spooling status events in %s", spool.directory)
+
+    status_spool = SpoolingPublisher(get_publishers, spool)
+    status_spool.start()
+    stats.register("status_spool", spool.stats)
+
+
+# Connect/disconnect events for the mon topics
+status_encoder = get_encoder(os.getenv("STATUS_ENCODING", "json"))
+status_publisher = StatusPublisher(
+    _publish_status,
+    maxsize=int(os.getenv("STATUS_QUEUE_SIZE", 10000)),
+    policy=os.getenv("STATUS_QUEUE_POLICY", "drop-oldest"),
+    block_timeout=float(os.getenv("STATUS_QUEUE_BLOCK_TIMEOUT", 1)),
+    encoder=status_encoder,
+)
+stats.register("status_queue", status_publisher.stats)
+
+flap_debouncer = FlapDebouncer(
+    status_publisher.put,
+    window=float(os.getenv("STATUS_FLAP_WINDOW", 0)),
+)
+stats.register("status_flaps", flap_debouncer.stats)
+
+
+def _invalidate_acls(kind, key):
+    acl_engine.invalidate(kind, key)
+    decision_cache.invalidate(kind, key)
+
+
+invalidation.register("project", lambda project_id: _invalidate_acls("project", project_id))
+invalidation.register("user", lambda username: _invalidate_acls("user", username))
+
+# qos in a suback for a topic which wasn't allowed
+SUBSCRIBE_REJECTED_QOS = 128
 
 WORKER_USERNAME = "overlock-worker"
 WORKER_PASSWORD = os.getenv("OVERLOCK_WORKER_PASSWORD", None)
 
 
-def _matches(regex, payload):
-    def _err(msg):
-        logger.error(msg)
+def _err(msg):
+    logger.error(msg)
 
-        return {
-            "result": {
-                "error": msg,
-            }
+    return {
+        "result": {
+            "error": msg,
         }
+    }
+
+
+def _project_id(username):
+    """Project id from a v1/v2 username, if it is one"""
+    split = username.split(":") if username else ()
+
+    if len(split) == 4 and split[0] in ("v1", "v2"):
+        return split[1]
+
+    return None
+
+
+def _identity(payload):
+    """Identity and project of the client, from its session if this process
+    has one"""
+
+    username = payload.get("username")
+    session = sessions.get(payload.get("mountpoint", ""), payload.get("client_id"))
+
+    if session is not None and session.username == username:
+        return (session.identity, session.project_id)
+
+    identity = Identity(
+        username,
+        payload.get("client_id"),
+        payload.get("mountpoint", ""),
+    )
+
+    return (identity, _project_id(username))
+
+
+def _own_project(topic, project_id):
+    """Whether a device topic is for a device in the given project
+
+    Topics which aren't iot-2 device topics aren't checked here
+
+    Args:
+        topic (str): topic, eg. iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/evt/boom/fmt/json
+        project_id (str): connection's project
+
+    Returns:
+        bool: if the device in the topic is in that project
+    """
+
+    levels = topic.split("/", 6)
+
+    if levels[0] == "":
+        del levels[0]
+
+    if len(levels) < 5 or levels[0] != "iot-2" or levels[1] != "type" or levels[3] != "id":
+        return True
+
+    split = levels[4].split(":")
 
+    return len(split) == 4 and split[1] == project_id
+
+
+def _check(action, topic, identity, project_id):
+    return acl_engine.allowed(action, topic, identity, project_id) \
+        and (project_id is None or _own_project(topic, project_id))
+
+
+# Shared, never modified
+_OK = {
+    "result": "ok",
+}
+
+
+def _matches(action, payload, topic_payload):
     try:
-        match = regex.match(payload["topic"])
+        topic = topic_payload["topic"]
     except KeyError:
-        return _err("no topic in payload ({})".format(payload))
+        return _err("no topic in payload ({})".format(topic_payload))
 
-    # needs to match, NOT search
-    if not match:
-        # TODO
-        # this will reject on anything that's wrong - should probably change the
-        # regex so it can type 'evt' or 'cmd' then manually check afterwards
-        return _err("Topic did not match regex")
+    allowed = decision_cache.get(action, topic,
+        payload.get("username"), payload.get("client_id"), payload.get("mountpoint", ""))
 
-    response = {
-        "result": "ok",
-    }
+    if allowed is None:
+        (identity, project_id) = _identity(payload)
+        allowed = _check(action, topic, identity, project_id)
+        decision_cache.set(action, topic, identity, project_id, allowed)
 
-    logger.info("Success")
+    if not allowed:
+        return _err("Topic not allowed by ACL")
 
-    return response
+    return _OK
 
 
 def can_publish(payload):
@@ -217,12 +430,16 @@ def can_publish(payload):
             "result": "ok",
         }
 
-    return _matches(PUB_ACL_REGEX, payload)
+    return _matches(PUBLISH, payload, payload)
 
 
 def can_subscribe(payload):
     """whether this subscribe event is allowed
 
+    All of the topics are checked. If only some of them are allowed, the
+    response tells vernemq to subscribe to those and reject the others (qos
+    128) rather than failing the whole subscription
+
     Args:
         payload (dict): json payload from vernemq
 
@@ -236,8 +453,42 @@ def can_subscribe(payload):
             "result": "ok",
         }
 
-    for sub in payload["topics"]:
-        # FIXME
-        # actually check all topics
-        # This doesn't matter for now?
-        return _matches(SUB_ACL_REGEX, sub)
+    try:
+        topics = [sub["topic"] for sub in payload["topics"]]
+    except (KeyError, TypeError):
+        return _err("no topic in payload ({})".format(payload.get("topics")))
+
+    (identity, project_id) = _identity(payload)
+
+    allowed = [decision_cache.get(SUBSCRIBE, topic, *identity) for topic in topics]
+    unknown = [i for (i, ok) in enumerate(allowed) if ok is None]
+
+    if unknown:
+        checked = acl_engine.allowed_many(SUBSCRIBE, [topics[i] for i in unknown], identity, project_id)
+
+        for (i, ok) in zip(unknown, checked):
+            ok = ok and (project_id is None or _own_project(topics[i], project_id))
+            allowed[i] = ok
+            decision_cache.set(SUBSCRIBE, topics[i], identity, project_id, ok)
+
+    if all(allowed):
+        logger.info("Success")
+        return {
+            "result": "ok",
+        }
+
+    if not any(allowed):
+        return _err("Topic not allowed by ACL")
+
+    # Only some of them - tell vernemq to reject the rest
+    logger.info("Rejecting %d of %d topics", allowed.count(False), len(allowed))
+
+    return {
+        "result": "ok",
+        "topics": [
+            {
+                "topic": sub["topic"],
+                "qos": sub.get("qos", 0) if ok else SUBSCRIBE_REJECTED_QOS,
+            } for (sub, ok) in zip(payload["topics"], allowed)
+        ],
+    }
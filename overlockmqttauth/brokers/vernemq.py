@@ -10,17 +10,25 @@ import logging
 import logging.config
 import os
 
+import werkzeug.serving
 import yaml
 from flask import Flask, request, jsonify
 
+from overlockmqttauth import invalidation, stats
 from overlockmqttauth.connection import get_connection
-from overlockmqttauth.auth.mongodb.util import mongo_connect
-from overlockmqttauth.client import client as mqttc
+from overlockmqttauth.auth.mongodb import mongo_connect, blacklist
+from overlockmqttauth.auth.registry import get_backend, default_backend
+from overlockmqttauth.client import init_publishers
 
-from .util import (InvalidClientId,
+from .prefork import PreforkSupervisor
+from .server import HookServer
+from .util import (
         exit_handler,
         enter_handler,
-        client_id_to_org_type_id,
+        start_session,
+        end_session,
+        init_acls,
+        init_status_spool,
         can_publish,
         can_subscribe,
         WORKER_PASSWORD,
@@ -31,7 +39,6 @@ logger = logging.getLogger(__name__)
 
 
 app = Flask(__name__)
-mongo_connect()
 
 
 @app.route("/auth_on_register", methods=["POST"])
@@ -59,20 +66,24 @@ def auth_on_register():
 
     """
 
-    as_json = request.json
+    return jsonify(_auth_on_register(request.json))
 
-    logger.info("auth_on_register: %s", as_json)
 
-    response = {
-        "result": "ok"
-    }
+def _worker_response(as_json):
+    """Response for the worker user, or None if it isn't the worker"""
 
     if as_json.get("username") == WORKER_USERNAME:
         if WORKER_PASSWORD is None:
             logger.warning("No OVERLOCK_WORKER_PASSWORD env set - ignoring worker auth")
         elif as_json["password"] == WORKER_PASSWORD:
             logger.info("Worker connected")
-            return jsonify(response)
+            return {"result": "ok"}
+
+    return None
+
+
+def _parse(as_json):
+    """Returns a tuple of (connection, None) or (None, error response)"""
 
     try:
         connection = get_connection(
@@ -83,31 +94,79 @@ def auth_on_register():
     except Exception: # pylint: disable=broad-except
         logger.exception("error parsing connection")
 
-        response = {
-            "result": {
-                "error": "Unable to parse connection details",
-            }
+        return (None, _error("Unable to parse connection details"))
+
+    return (connection, None)
+
+
+def _error(msg):
+    return {
+        "result": {
+            "error": msg,
         }
+    }
+
 
+def _registered(as_json, connection, authenticated, blacklisted):
+    """Start the session if the connection is allowed
+
+    blacklisted is only called if the connection is authenticated
+    """
+
+    if not authenticated:
+        logger.info("Could not find user with given username/pw")
+        response = _error("Couldn't authenticate connection details")
+    elif blacklisted():
+        logger.info("User has been blacklisted")
+        response = _error("User blacklisted")
     else:
-        if not connection.authenticated:
-            logger.info("Could not find user with given username/pw")
+        start_session(as_json, connection)
+        return {"result": "ok"}
 
-            response = {
-                "result": {
-                    "error": "Couldn't authenticate connection details",
-                }
-            }
-        elif connection.blacklisted:
-            logger.info("User has been blacklisted")
+    # Don't leave a previous session for this client id around
+    end_session(as_json)
 
-            response = {
-                "result": {
-                    "error": "User blacklisted",
-                }
-            }
+    return response
 
-    return jsonify(response)
+
+def _auth_on_register(as_json):
+    logger.info("auth_on_register: %s", as_json)
+
+    response = _worker_response(as_json)
+    if response is not None:
+        return response
+
+    (connection, response) = _parse(as_json)
+    if connection is None:
+        end_session(as_json)
+        return response
+
+    return _registered(as_json, connection, connection.authenticated,
+        lambda: connection.blacklisted)
+
+
+async def auth_on_register_async(as_json):
+    """auth_on_register for the asyncio server's async routes
+
+    Awaits the auth backend's lookups on the event loop instead of blocking a
+    thread for each, see HOOK_ASYNC_AUTH
+    """
+
+    logger.info("auth_on_register: %s", as_json)
+
+    response = _worker_response(as_json)
+    if response is not None:
+        return response
+
+    (connection, response) = _parse(as_json)
+    if connection is None:
+        end_session(as_json)
+        return response
+
+    authenticated = await connection.authenticate()
+    blacklisted = authenticated and await connection.check_blacklisted()
+
+    return _registered(as_json, connection, authenticated, lambda: blacklisted)
 
 
 @app.route('/auth_on_publish', methods=['POST'])
@@ -204,11 +263,6 @@ def on_register():
     if client_id.startswith('controller'):
         return jsonify(response)
 
-    try:
-        logger.info("New client: %s", client_id_to_org_type_id(client_id))
-    except InvalidClientId:
-        logger.warning("Invalid client id received: %s", client_id)
-
     enter_handler(request)
 
     return jsonify(response)
@@ -262,7 +316,20 @@ def on_client_offline():
     return jsonify(response)
 
 
-def start_broker():
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Counters from caches etc. in this process, for monitoring
+
+    With multiple workers, each request only sees the stats of the worker
+    that happened to handle it
+    """
+    return jsonify(stats.collect())
+
+
+stats.register("invalidations", invalidation.stats)
+
+
+def setup_logging():
 
     log_cfg = """
 version: 1
@@ -284,16 +351,92 @@ loggers:
     as_dict = yaml.load(log_cfg)
     logging.config.dictConfig(as_dict)
 
+
+def start_mqtt():
     mqtt_host = os.getenv('MQTT_HOST', "localhost")
     mqtt_port = int(os.getenv('MQTT_PORT', 1883))
     logger.info("Connecting to MQTT %s on port %s",
         mqtt_host, mqtt_port
     )
-    mqttc.loop_start()
-    mqttc.connect_async(mqtt_host, mqtt_port, 60)
+    pool = init_publishers()
+    pool.connect(mqtt_host, mqtt_port, 60)
 
-    app.run(
-        host=os.getenv('HOOK_HOST', '0.0.0.0'),
-        port=int(os.getenv('HOOK_PORT', 5000)),
-        debug=False,
-    )
+
+def init_process():
+    """Set up connections to mongodb (if the auth backend uses it) and the
+    broker, and start the auth backend
+
+    These can't be shared across a fork, so with multiple workers this is run
+    in each worker rather than in the supervisor
+    """
+    backend = get_backend(default_backend())
+
+    if backend.requires_mongodb:
+        mongo_connect()
+        blacklist.start()
+
+    init_acls(backend)
+    start_mqtt()
+    init_status_spool()
+    backend.start()
+
+
+def make_server(wsgi_app, sock=None, host=None, port=None):
+    """Create the server selected by HOOK_SERVER
+
+    Returns:
+        object: server with serve_forever() and shutdown() methods
+    """
+
+    server_type = os.getenv('HOOK_SERVER', 'flask')
+
+    if server_type == 'asyncio':
+        async_routes = None
+        if os.getenv('HOOK_ASYNC_AUTH', 'false').lower() == 'true':
+            async_routes = {"/auth_on_register": auth_on_register_async}
+
+        return HookServer(wsgi_app, host, port, sock=sock, async_routes=async_routes)
+    elif server_type == 'flask':
+        return werkzeug.serving.make_server(host, port, wsgi_app,
+            threaded=True, fd=sock.fileno() if sock else None)
+    else:
+        raise ValueError("Unknown HOOK_SERVER '{}'".format(server_type))
+
+
+def start_broker():
+    """Entry point for vmq_hook
+
+    HOOK_SERVER selects how the hooks are served:
+
+    - 'flask' (default): werkzeug's threaded server
+    - 'asyncio': keep-alive HTTP/1.1 server in brokers/server.py. With
+      HOOK_ASYNC_AUTH=true, auth_on_register is awaited on its event loop
+      rather than run in a thread
+
+    HOOK_WORKERS > 1 (or 0 for one per cpu) forks that many workers sharing
+    the listening socket, see brokers/prefork.py
+    """
+
+    setup_logging()
+
+    host = os.getenv('HOOK_HOST', '0.0.0.0')
+    port = int(os.getenv('HOOK_PORT', 5000))
+    workers = int(os.getenv('HOOK_WORKERS', 1))
+
+    if workers == 1:
+        init_process()
+        server = make_server(app, host=host, port=port)
+        server.serve_forever()
+    else:
+        supervisor = PreforkSupervisor(
+            lambda wsgi_app, sock: make_server(wsgi_app, sock=sock, host=host, port=port),
+            app,
+            workers,
+            host,
+            port,
+            reuse_port=os.getenv('HOOK_REUSEPORT', 'false').lower() == 'true',
+            post_fork=init_process,
+            max_requests=int(os.getenv('HOOK_MAX_REQUESTS', 0)),
+            graceful_timeout=float(os.getenv('HOOK_GRACEFUL_TIMEOUT', 30)),
+        )
+        supervisor.run()
@@ -4,9 +4,13 @@ import os
 import logging
 import string
 import random
+import threading
+import zlib
 
 import paho.mqtt.client as mqtt
 
+from overlockmqttauth import invalidation, stats
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,6 +23,11 @@ def mqtt_connect(client, userdata, flags, rc):
     if rc == 0:
         # To avoid disconnection, subscribe for something
         client.subscribe("$SYS/#")
+        invalidation.subscribe(client)
+
+
+def mqtt_publisher_connect(client, userdata, flags, rc):
+    logger.info("Publisher connected to broker with result: %d", rc)
 
 
 def mqtt_log(client, userdata, level, buf):
@@ -31,13 +40,24 @@ def mqtt_message(client, userdata, msg):
     logger.debug(msg.topic+" "+str(msg.payload))
 
 
-def get_client():
+def get_client(transport=None, subscribe=True):
     """Get basic mqtt client
 
     this doesn't make it connect or anything, just gets the client with all the
     callbacks and client_id set up.
+
+    Args:
+        transport (str): 'tcp' or 'websockets'. Defaults to MQTT_TRANSPORT,
+            or websockets if that isn't set
+        subscribe (bool): subscribe to invalidations etc. on connecting. Only
+            the shared client needs to
     """
-    mqttc = mqtt.Client(client_id="controller.{:s}".format(id_generator()), transport="websockets")
+    transport = transport or os.getenv("MQTT_TRANSPORT", "websockets")
+
+    if transport not in ("tcp", "websockets"):
+        raise ValueError("Unknown MQTT_TRANSPORT '{}'".format(transport))
+
+    mqttc = mqtt.Client(client_id="controller.{:s}".format(id_generator()), transport=transport)
 
     username = os.getenv("VMQ_USERNAME", "overlock-worker")
     password = os.getenv("VMQ_PASSWORD", None)
@@ -45,10 +65,171 @@ def get_client():
     # Not setting TLS or anything - this should only be internal
     mqttc.username_pw_set(username, password)
     mqttc.on_log = mqtt_log
-    mqttc.on_connect = mqtt_connect
+    mqttc.on_connect = mqtt_connect if subscribe else mqtt_publisher_connect
     mqttc.on_message = mqtt_message
 
     return mqttc
 
 
-client = get_client()
+client = None
+
+
+def init_client():
+    """(Re)create the shared client
+
+    This needs calling in each process after forking - paho clients can't be
+    shared between processes, and they each need their own client id or the
+    broker will keep disconnecting the others.
+    """
+    global client
+    client = get_client()
+    return client
+
+
+def get_shared_client():
+    """Get the client used for management publishes, creating it if needed"""
+    if client is None:
+        return init_client()
+
+    return client
+
+
+class _Publisher:
+
+    __slots__ = ("client", "in_flight", "published", "errors", "disconnects")
+
+    def __init__(self, client):
+        self.client = client
+        # Handed to paho but not written to the socket yet
+        self.in_flight = 0
+        self.published = 0
+        self.errors = 0
+        self.disconnects = 0
+
+
+class PublisherPool:
+    """Several connections to publish management events over
+
+    Each message goes out on the connection picked by the crc32 of its key, so
+    everything for one device uses the same connection and stays in order.
+
+    Args:
+        clients (list(mqtt.Client)): clients to publish with
+    """
+
+    def __init__(self, clients):
+        self._publishers = [_Publisher(c) for c in clients]
+        self._lock = threading.Lock()
+
+        for publisher in self._publishers:
+            self._add_callbacks(publisher)
+
+    def __len__(self):
+        return len(self._publishers)
+
+    def _add_callbacks(self, publisher):
+        def on_publish(client, userdata, mid):
+            with self._lock:
+                publisher.in_flight = max(0, publisher.in_flight - 1)
+
+        def on_disconnect(client, userdata, rc):
+            logger.info("Publisher disconnected with result: %d", rc)
+            with self._lock:
+                # paho drops qos 0 messages it hadn't sent yet
+                publisher.in_flight = 0
+                publisher.disconnects += 1
+
+        publisher.client.on_publish = on_publish
+        publisher.client.on_disconnect = on_disconnect
+
+    def connect(self, host, port, keepalive=60):
+        for publisher in self._publishers:
+            publisher.client.loop_start()
+            publisher.client.connect_async(host, port, keepalive)
+
+    def _for(self, key):
+        return self._publishers[zlib.crc32(key.encode("utf8")) % len(self._publishers)]
+
+    def is_connected(self):
+        """Whether every connection is up"""
+        return all(p.client.is_connected() for p in self._publishers)
+
+    def publish(self, topic, payload, key=None, qos=0):
+        """Publish on the connection for key
+
+        Args:
+            topic (str): topic
+            payload (str or bytes): message
+            key (str): what to shard on. Defaults to the topic, which for
+                status events is per device
+            qos (int): qos
+
+        Returns:
+            mqtt.MQTTMessageInfo: from paho
+        """
+
+        publisher = self._for(topic if key is None else key)
+
+        with self._lock:
+            publisher.in_flight += 1
+
+        info = publisher.client.publish(topic, payload, qos)
+
+        with self._lock:
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                publisher.published += 1
+            else:
+                publisher.in_flight = max(0, publisher.in_flight - 1)
+                publisher.errors += 1
+
+        return info
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connections": [
+                    {
+                        "connected": p.client.is_connected(),
+                        "in_flight": p.in_flight,
+                        "published": p.published,
+                        "errors": p.errors,
+                        "disconnects": p.disconnects,
+                    }
+                    for p in self._publishers
+                ],
+                "in_flight": sum(p.in_flight for p in self._publishers),
+            }
+
+
+publishers = None
+
+
+def init_publishers(size=None):
+    """(Re)create the shared client and the publisher pool
+
+    The shared client is the first connection in the pool, and the rest only
+    publish. Like init_client, this needs calling in each process after
+    forking.
+
+    Args:
+        size (int): number of connections. Defaults to MQTT_PUBLISHERS, or 1
+    """
+    global publishers
+
+    if size is None:
+        size = int(os.getenv("MQTT_PUBLISHERS", 1))
+
+    clients = [init_client()] + [get_client(subscribe=False) for _ in range(size - 1)]
+
+    publishers = PublisherPool(clients)
+    stats.register("mqtt_publishers", publishers.stats)
+
+    return publishers
+
+
+def get_publishers():
+    """Get the pool used for management publishes, creating it if needed"""
+    if publishers is None:
+        return init_publishers()
+
+    return publishers
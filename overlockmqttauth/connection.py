@@ -1,13 +1,25 @@
 import logging
-from .api import parse_connection
-from .auth.mongodb import VMQAuth
+from .api import parse_connection, API_V2
+from .auth.compiled import FileAuth
+from .auth.mongodb import VMQAuth, SnapshotAuth, TokenAuth, HashedKeyAuth, AsyncVMQAuth
+from .auth.registry import register_backend, get_backend, default_backend
 
 
 logger = logging.getLogger(__name__)
 
 
+register_backend("mongodb", VMQAuth)
+register_backend("snapshot", SnapshotAuth)
+register_backend("token", TokenAuth)
+register_backend("hashed", HashedKeyAuth)
+register_backend("file", FileAuth)
+register_backend("mongodb-async", AsyncVMQAuth)
+
+
 class MQTTConnection:
 
+    __slots__ = ("_api", "_auth")
+
     def __init__(self, api, auth):
         self._api = api
         self._auth = auth
@@ -20,7 +32,7 @@ class MQTTConnection:
             int: enum corresponding to which connection version
         """
 
-        return self._api.version
+        return self._api.api_version
 
     @property
     def blacklisted(self):
@@ -54,6 +66,14 @@ class MQTTConnection:
 
         return self._auth.authenticated
 
+    async def authenticate(self):
+        """authenticated, for coroutines"""
+        return await self._auth.authenticate()
+
+    async def check_blacklisted(self):
+        """blacklisted, for coroutines"""
+        return await self._auth.check_blacklisted()
+
     def subscribe_authorized(self, topic):
         """Whether the user is allowed to subscribe to this topic
 
@@ -112,13 +132,43 @@ class MQTTConnection:
 
 
 def get_connection(username, password, client_id, api_type=None, auth_type=None):
-    if api_type is None:
-        api = parse_connection(username, password)
+    """Parse and authenticate a connection
+
+    Args:
+        username (str): username
+        password (str): password
+        client_id (str): client id
+        api_type (str): 'v1'/'v2' to only accept that api. Defaults to
+            whichever the username is for
+        auth_type (str): backend name, see auth/registry.py. Defaults to
+            'token' for v2 connections and AUTH_BACKEND otherwise
+
+    Returns:
+        MQTTConnection: connection
+
+    Raises:
+        ValueError: the username/password can't be parsed, or it's a v2
+            connection and AUTH_BACKEND doesn't use mongodb, where the
+            signing keys are
+    """
+
+    api = parse_connection(username, password, api_type)
 
     logger.debug("API = %s", api)
 
     if auth_type is None:
-        auth = VMQAuth(username, password, client_id)
+        auth_type = default_backend()
+
+        if api.api_version == API_V2:
+            # Tokens are checked the same way whatever AUTH_BACKEND is, but
+            # mongodb is only connected to if that backend needs it
+            if not get_backend(auth_type).requires_mongodb:
+                raise ValueError("v2 connections need an AUTH_BACKEND which uses mongodb, not '{}'".format(
+                    auth_type))
+
+            auth_type = "token"
+
+    auth = get_backend(auth_type)(api.credentials, client_id)
 
     logger.debug("Auth method = %s", auth)
 
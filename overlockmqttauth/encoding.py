@@ -0,0 +1,172 @@
+"""Encodings for status event payloads
+
+Selected with STATUS_ENCODING:
+
+- ``json`` (default): as before, with 'Time' as an ISO 8601 string
+- ``msgpack``: needs the msgpack package
+- ``cbor``: built in, no extra dependencies
+
+The binary encodings send 'Time' as seconds since the epoch (a CBOR tag 1
+date) rather than a string, and are published on ``<mon topic>/fmt/<name>``
+so consumers can tell what they're getting. json stays on the plain mon topic.
+
+Encoders are created once and reused for every event, so they have to be
+thread safe.
+"""
+
+import json
+import struct
+from datetime import datetime
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JSONStatusEncoder:
+
+    name = "json"
+    topic_suffix = ""
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder()
+
+    def encode(self, payload, timestamp):
+        payload["Time"] = datetime.utcfromtimestamp(timestamp).isoformat()
+        return self._encoder.encode(payload)
+
+
+class MsgpackStatusEncoder:
+
+    name = "msgpack"
+    topic_suffix = "/fmt/msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ValueError("STATUS_ENCODING=msgpack needs the msgpack package installed")
+
+    def encode(self, payload, timestamp):
+        payload["Time"] = timestamp
+        # Not a shared Packer - they aren't thread safe
+        return msgpack.packb(payload, use_bin_type=True)
+
+
+_FLOAT = struct.Struct(">Bd")
+
+_TRUE = b"\xf5"
+_FALSE = b"\xf4"
+_NULL = b"\xf6"
+_EPOCH_TAG = b"\xc1"
+
+
+def _head(major, length):
+    major <<= 5
+
+    if length < 24:
+        return bytes((major | length,))
+    elif length < 0x100:
+        return struct.pack(">BB", major | 24, length)
+    elif length < 0x10000:
+        return struct.pack(">BH", major | 25, length)
+    elif length < 0x100000000:
+        return struct.pack(">BI", major | 26, length)
+
+    return struct.pack(">BQ", major | 27, length)
+
+
+class CBORStatusEncoder:
+    """Just enough CBOR (RFC 8949) for status events
+
+    Supports dicts with string keys, lists, strings, bytes, ints, floats,
+    bools and None. Keys are the same for every event, so their encodings
+    are kept rather than redone each time.
+    """
+
+    name = "cbor"
+    topic_suffix = "/fmt/cbor"
+
+    def __init__(self):
+        self._keys = {}
+
+    def _key(self, key):
+        encoded = self._keys.get(key)
+
+        if encoded is None:
+            encoded = self._keys[key] = self._text(key)
+
+        return encoded
+
+    @staticmethod
+    def _text(value):
+        value = value.encode("utf8")
+        return _head(3, len(value)) + value
+
+    def _item(self, value, out):
+        # bool first, as it's an int
+        if value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif value is None:
+            out.append(_NULL)
+        elif isinstance(value, str):
+            out.append(self._text(value))
+        elif isinstance(value, int):
+            if value >= 0:
+                out.append(_head(0, value))
+            else:
+                out.append(_head(1, -1 - value))
+        elif isinstance(value, float):
+            out.append(_FLOAT.pack(0xfb, value))
+        elif isinstance(value, (bytes, bytearray)):
+            out.append(_head(2, len(value)))
+            out.append(bytes(value))
+        elif isinstance(value, dict):
+            out.append(_head(5, len(value)))
+            for (key, item) in value.items():
+                out.append(self._key(key))
+                self._item(item, out)
+        elif isinstance(value, (list, tuple)):
+            out.append(_head(4, len(value)))
+            for item in value:
+                self._item(item, out)
+        else:
+            raise TypeError("Can't encode {!r} as CBOR".format(value))
+
+    def encode(self, payload, timestamp):
+        out = [_head(5, len(payload) + (0 if "Time" in payload else 1))]
+
+        for (key, value) in payload.items():
+            if key != "Time":
+                out.append(self._key(key))
+                self._item(value, out)
+
+        out.append(self._key("Time"))
+        out.append(_EPOCH_TAG)
+        out.append(_FLOAT.pack(0xfb, timestamp))
+
+        return b"".join(out)
+
+
+ENCODERS = {
+    "json": JSONStatusEncoder,
+    "msgpack": MsgpackStatusEncoder,
+    "cbor": CBORStatusEncoder,
+}
+
+
+def get_encoder(name):
+    """Create the encoder for a STATUS_ENCODING
+
+    Raises:
+        ValueError: unknown encoding, or it needs a package which isn't
+            installed
+    """
+
+    try:
+        encoder = ENCODERS[name]
+    except KeyError:
+        raise ValueError("Unknown STATUS_ENCODING '{}'".format(name))
+
+    return encoder()
@@ -0,0 +1,234 @@
+"""Debouncing of devices that keep connecting and disconnecting
+
+Devices on bad links can cycle several times a second, and every cycle would
+otherwise be a Connect and a Disconnect on their mon topic. The first event
+for a device is passed straight on and opens a window. Any more events for it
+within the window are held back, and when it closes only the device's final
+state is passed on - if it's different to the one that was - with a 'Flaps'
+count of the events it stands for.
+
+Windows are kept on a timer wheel, so there is one thread ticking over all of
+them rather than a timer per device.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Hashed timer wheel
+
+    Not thread safe - callers have to lock around it.
+
+    Args:
+        tick (float): seconds per slot. Timers fire up to one tick late
+        slots (int): number of slots. Delays longer than slots * tick take
+            extra turns of the wheel
+        now (float): current time, from the same clock passed to advance()
+    """
+
+    def __init__(self, tick, slots, now):
+        self.tick = tick
+
+        # key -> remaining turns, per slot
+        self._slots = [{} for _ in range(slots)]
+        self._current = 0
+        self._last = now
+        # key -> slot
+        self._where = {}
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, delay):
+        """Fire key after delay seconds, replacing any existing timer for it"""
+
+        self.cancel(key)
+
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self._current + ticks) % len(self._slots)
+
+        self._slots[slot][key] = (ticks - 1) // len(self._slots)
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now):
+        """Move the wheel on to now
+
+        Returns:
+            list: keys whose timers have fired
+        """
+
+        fired = []
+
+        if not self._where:
+            # Nothing to fire, so skip straight there
+            self._last += math.floor((now - self._last) / self.tick) * self.tick
+            return fired
+
+        while self._last + self.tick <= now:
+            self._last += self.tick
+            self._current = (self._current + 1) % len(self._slots)
+
+            slot = self._slots[self._current]
+
+            for (key, turns) in list(slot.items()):
+                if turns:
+                    slot[key] = turns - 1
+                else:
+                    del slot[key]
+                    del self._where[key]
+                    fired.append(key)
+
+        return fired
+
+
+class _Window:
+
+    __slots__ = ("action", "pending", "flaps")
+
+    def __init__(self, action):
+        # Last action passed on
+        self.action = action
+        # (payload, timestamp) of the latest held back event
+        self.pending = None
+        self.flaps = 0
+
+
+class FlapDebouncer:
+    """Collapses rapid connect/disconnect cycles per topic
+
+    Args:
+        publish (callable): takes (topic, payload, timestamp) - eg.
+            StatusPublisher.put
+        window (float): seconds to hold back further events for a topic after
+            one is passed on. 0 passes everything straight on
+        tick (float): resolution of the timer wheel in seconds
+        timer (callable): returns the current time in seconds
+    """
+
+    def __init__(self, publish, window, tick=0.1, timer=time.monotonic):
+        self.publish = publish
+        self.window = window
+        self._timer = timer
+
+        # topic -> _Window
+        self._windows = {}
+        self._wheel = TimerWheel(tick, max(1, int(window / tick)) + 1, timer())
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        self.held = 0
+        self.collapsed = 0
+        self.suppressed = 0
+
+    def _ensure_thread(self):
+        # Threads don't survive a fork, so each worker starts its own
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="flap-debouncer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._wheel.tick)
+
+            try:
+                self.advance()
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Error passing on debounced status")
+
+    def put(self, topic, payload):
+        """Pass on an event, unless the topic is flapping
+
+        Args:
+            topic (str): mon topic of the device
+            payload (dict): status event, with an 'Action'
+        """
+
+        if self.window <= 0:
+            self.publish(topic, payload, time.time())
+            return
+
+        with self._lock:
+            self._ensure_thread()
+
+            window = self._windows.get(topic)
+
+            if window is not None:
+                window.pending = (payload, time.time())
+                window.flaps += 1
+                self.held += 1
+                return
+
+            self._windows[topic] = _Window(payload.get("Action"))
+            self._wheel.schedule(topic, self.window)
+
+        self.publish(topic, payload, time.time())
+
+    def advance(self, now=None):
+        """Close windows which have expired and pass on their final state
+
+        Publishing can block (eg. the 'block' queue policy), so it's done
+        without the lock held. A window stays open until its final state has
+        been passed on, so an event for the same topic arriving meanwhile is
+        held back rather than getting ahead of the older one - it's passed on
+        when the window closes again.
+        """
+
+        now = self._timer() if now is None else now
+        closed = []
+
+        with self._lock:
+            for topic in self._wheel.advance(now):
+                window = self._windows[topic]
+
+                if window.pending is None:
+                    del self._windows[topic]
+                    continue
+
+                (payload, timestamp) = window.pending
+                window.pending = None
+
+                if payload.get("Action") == window.action:
+                    # Ended up where it started
+                    del self._windows[topic]
+                    self.suppressed += 1
+                    continue
+
+                payload["Flaps"] = window.flaps
+                window.action = payload.get("Action")
+                window.flaps = 0
+                self.collapsed += 1
+                closed.append((topic, window, payload, timestamp))
+
+        for (topic, window, payload, timestamp) in closed:
+            try:
+                self.publish(topic, payload, timestamp)
+            finally:
+                with self._lock:
+                    if window.pending is None:
+                        del self._windows[topic]
+                    else:
+                        # Held back while it was being passed on
+                        self._wheel.schedule(topic, self.window)
+
+    def stats(self):
+        return {
+            "window": self.window,
+            "open_windows": len(self._windows),
+            "held": self.held,
+            "collapsed": self.collapsed,
+            "suppressed": self.suppressed,
+        }
@@ -0,0 +1,97 @@
+"""Cache invalidation broadcast to every hook replica over MQTT
+
+Every replica subscribes to INVALIDATION_TOPIC with the management client from
+client.py. Publishing a message there, eg. after revoking a project key or
+blacklisting a device, makes every replica evict what it has cached for it,
+so caches can have long TTLs without stale keys staying valid for long.
+
+Messages are JSON:
+
+.. code-block:: python
+
+    {
+        "kind": "project",
+        "key": "3b32154818bccbde03cfea45"
+    }
+
+Only the worker user can publish or subscribe to topics outside of iot-2/, so
+devices can't see or send these.
+"""
+
+import json
+import logging
+import os
+from collections import defaultdict
+
+
+logger = logging.getLogger(__name__)
+
+
+INVALIDATION_TOPIC = os.getenv("INVALIDATION_TOPIC", "overlock-internal/invalidate")
+
+# kind -> list of callables taking the key to invalidate
+_handlers = defaultdict(list)
+
+_received = defaultdict(int)
+
+
+def register(kind, handler):
+    """Call handler(key) whenever something of this kind is invalidated
+
+    Args:
+        kind (str): what is being invalidated - 'project', 'user', etc.
+        handler (callable): evicts key from a cache
+    """
+    _handlers[kind].append(handler)
+
+
+def invalidate(kind, key):
+    """Run the handlers for kind in this process only"""
+
+    _received[kind] += 1
+
+    for handler in _handlers.get(kind, ()):
+        try:
+            handler(key)
+        except Exception: # pylint: disable=broad-except
+            logger.exception("Error invalidating %s '%s'", kind, key)
+
+
+def publish_invalidation(client, kind, key):
+    """Invalidate key here and on every other replica
+
+    Args:
+        client (paho.mqtt.client.Client): connected client to publish with
+        kind (str): what is being invalidated
+        key (str): id of the thing to invalidate
+    """
+
+    invalidate(kind, key)
+
+    payload = json.dumps({"kind": kind, "key": key})
+    return client.publish(INVALIDATION_TOPIC, payload, qos=1)
+
+
+def on_invalidation_message(client, userdata, msg): # pylint: disable=unused-argument
+    try:
+        message = json.loads(msg.payload.decode("utf8"))
+        (kind, key) = (message["kind"], message["key"])
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Invalid invalidation message: %r", msg.payload)
+        return
+
+    logger.info("Invalidating %s '%s'", kind, key)
+    invalidate(kind, key)
+
+
+def subscribe(client):
+    """Start receiving invalidations on client
+
+    Must be called (again) each time the client connects
+    """
+    client.message_callback_add(INVALIDATION_TOPIC, on_invalidation_message)
+    client.subscribe(INVALIDATION_TOPIC, qos=1)
+
+
+def stats():
+    return dict(_received)
@@ -0,0 +1,126 @@
+"""Identities of connected clients
+
+auth_on_register is the only hook that gets the password, so it's the only
+place a connection is actually authenticated. What it found out (project,
+device, etc.) is kept here against the client id so the publish/subscribe
+hooks and the connect/disconnect handlers don't have to parse it again.
+
+With multiple hook workers, later hooks for a client can go to a different
+process than its auth_on_register did, so callers have to cope with there
+being no session.
+"""
+
+import threading
+from collections import OrderedDict
+
+from overlockmqttauth.acl import Identity
+
+
+class Session:
+    """What is known about a connected client
+
+    Attributes:
+        identity (Identity): username, client id and mountpoint
+        project_id (str): project the client authenticated against, if any
+        device (tuple): (org, device type, device id) parsed from the client
+            id, or None if it isn't a device client id
+    """
+
+    __slots__ = ("identity", "project_id", "device")
+
+    def __init__(self, identity, project_id=None, device=None):
+        self.identity = identity
+        self.project_id = project_id
+        self.device = device
+
+    @property
+    def username(self):
+        return self.identity.username
+
+    def __repr__(self):
+        return "Session({!r}, project_id={!r}, device={!r})".format(
+            self.identity, self.project_id, self.device)
+
+
+class SessionTable:
+    """Thread safe table of sessions keyed on (mountpoint, client id)
+
+    Sessions are removed when the client goes offline. In case that hook is
+    missed (eg. it went to another worker) the least recently used sessions
+    are dropped past maxsize.
+
+    Args:
+        maxsize (int): maximum number of sessions. 0 disables the table
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def add(self, username, client_id, mountpoint="", project_id=None, device=None):
+        """Store the session for a newly authenticated client
+
+        Returns:
+            Session: the new session
+        """
+
+        session = Session(Identity(username, client_id, mountpoint), project_id, device)
+
+        if self.maxsize <= 0:
+            return session
+
+        key = (mountpoint, client_id)
+
+        with self._lock:
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+        return session
+
+    def get(self, mountpoint, client_id):
+        """Get a client's session
+
+        Returns:
+            Session: session, or None if there isn't one in this process
+        """
+
+        with self._lock:
+            session = self._sessions.get((mountpoint, client_id))
+
+            if session is None:
+                self.misses += 1
+            else:
+                self._sessions.move_to_end((mountpoint, client_id))
+                self.hits += 1
+
+            return session
+
+    def pop(self, mountpoint, client_id):
+        """Remove and return a client's session, or None"""
+        with self._lock:
+            return self._sessions.pop((mountpoint, client_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
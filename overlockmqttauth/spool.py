@@ -0,0 +1,432 @@
+"""Spooling of status events to disk while the broker can't be reached
+
+While the management client is disconnected, status events are appended to
+segment files in a directory instead of piling up in paho's memory (or being
+lost on restart). Once it is connected again they are replayed in order, one
+record at a time from memory mapped segments, and segments are deleted once
+they have all been replayed. New events go to the end of the spool until it
+has been emptied, so ordering is kept.
+
+Each segment is a sequence of records:
+
+- header: payload length (u32), crc32 of the payload (u32)
+- payload: topic, NUL, message
+
+How far replay has got is kept in a small cursor file, replaced atomically, so
+a restart carries on from where it was. A process always starts a new segment
+when it opens a spool, so a record half written when a previous process died
+can only ever be at the end of a segment, where it is skipped.
+
+Writes are fsynced in batches - every fsync_every records or fsync_interval
+seconds, whichever comes first - so a crash can lose at most that many
+records.
+"""
+
+import errno
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+
+_RECORD = struct.Struct("<II")
+_CURSOR = struct.Struct("<QQ")
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+LOCK_FILE = "lock"
+
+
+def claim_spool_dir(base, max_dirs=256):
+    """Lock one of base/0, base/1, ... for this process
+
+    With multiple workers each needs its own spool, and a restarted worker
+    should pick up a spool left behind by an old one. The lock is held until
+    the process exits.
+
+    Returns:
+        str: directory claimed
+    """
+
+    for i in range(max_dirs):
+        directory = os.path.join(base, str(i))
+        os.makedirs(directory, exist_ok=True)
+
+        fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                continue
+            raise
+
+        # Deliberately leaked - closing it would release the lock
+        return directory
+
+    raise RuntimeError("All {} spool directories in {} are in use".format(max_dirs, base))
+
+
+class Spool:
+    """Append only spool of (topic, message) records
+
+    Not safe to share a directory between processes - see claim_spool_dir.
+
+    Args:
+        directory (str): where to keep segments
+        segment_size (int): start a new segment once the current one is this
+            big
+        max_bytes (int): drop the oldest segments once the spool is bigger
+            than this. 0 for no limit
+        fsync_every (int): fsync after this many records
+        fsync_interval (float): fsync unsynced records after this many seconds
+    """
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024, max_bytes=1024 * 1024 * 1024,
+                 fsync_every=100, fsync_interval=1.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments = sorted(self._segment_numbers())
+        (self._read_segment, self._read_offset) = self._load_cursor()
+
+        self._writer = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        # Never append after whatever an old process left
+        self._open_segment((self._segments[-1] + 1) if self._segments else 0)
+
+        if self._read_segment not in self._segments:
+            # Cursor left pointing at a segment which has since gone
+            (self._read_segment, self._read_offset) = (self._segments[0], 0)
+
+        self.appended = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.corrupt = 0
+
+    def _segment_numbers(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    yield int(name[:-len(SEGMENT_SUFFIX)])
+                except ValueError:
+                    pass
+
+    def _path(self, number):
+        return os.path.join(self.directory, "{:020d}{}".format(number, SEGMENT_SUFFIX))
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), "rb") as f:
+                return _CURSOR.unpack(f.read(_CURSOR.size))
+        except (OSError, struct.error):
+            return (self._segments[0] if self._segments else 0, 0)
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(_CURSOR.pack(self._read_segment, self._read_offset))
+
+        os.replace(tmp_path, path)
+
+    def _open_segment(self, number):
+        if self._writer is not None:
+            self._sync()
+            self._writer.close()
+
+        self._writer = open(self._path(number), "ab")
+        self._write_segment = number
+
+        if number not in self._segments:
+            self._segments.append(number)
+
+    def _sync(self):
+        if self._unsynced:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _size(self):
+        total = 0
+        for number in self._segments:
+            try:
+                total += os.path.getsize(self._path(number))
+            except OSError:
+                pass
+        return total - (self._read_offset if self._segments else 0)
+
+    def _delete_segment(self, number):
+        self._segments.remove(number)
+
+        try:
+            os.unlink(self._path(number))
+        except FileNotFoundError:
+            pass
+
+    def _trim(self):
+        # Drop the oldest segments (but never the one being written)
+        while self.max_bytes and len(self._segments) > 1 and self._size() > self.max_bytes:
+            oldest = self._segments[0]
+            logger.warning("Status spool over %d bytes, dropping %s", self.max_bytes, self._path(oldest))
+
+            offset = self._read_offset if oldest == self._read_segment else 0
+            self.dropped += sum(1 for _ in self._records(oldest, offset))
+            self._delete_segment(oldest)
+
+            self._read_segment = self._segments[0]
+            self._read_offset = 0
+            self._save_cursor()
+
+    def pending(self):
+        """Number of records waiting to be replayed - reads the whole spool"""
+        with self._lock:
+            self._sync()
+            return sum(1 for _ in self._iter_from(self._read_segment, self._read_offset))
+
+    @property
+    def empty(self):
+        with self._lock:
+            return (self._read_segment == self._write_segment
+                and self._read_offset >= self._writer.tell())
+
+    def append(self, topic, message):
+        """Add a record to the end of the spool
+
+        Args:
+            topic (str): topic to publish to
+            message (str or bytes): message to publish
+        """
+
+        if isinstance(message, str):
+            message = message.encode("utf8")
+
+        payload = topic.encode("utf8") + b"\0" + message
+        record = _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._lock:
+            if self._writer.tell() >= self.segment_size:
+                self._open_segment(self._write_segment + 1)
+                self._trim()
+
+            self._writer.write(record)
+            self._unsynced += 1
+            self.appended += 1
+
+            if self._unsynced >= self.fsync_every \
+            or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def sync(self):
+        """fsync anything not synced yet"""
+        with self._lock:
+            self._sync()
+
+    def _records(self, number, offset):
+        """(next offset, topic, message) for each intact record in a segment
+        from offset"""
+
+        try:
+            f = open(self._path(number), "rb")
+        except FileNotFoundError:
+            return
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                while offset + _RECORD.size <= size:
+                    (length, crc) = _RECORD.unpack_from(mapped, offset)
+                    end = offset + _RECORD.size + length
+
+                    if end > size:
+                        break
+
+                    payload = mapped[offset + _RECORD.size:end]
+
+                    if zlib.crc32(payload) != crc:
+                        break
+
+                    (topic, _, message) = payload.partition(b"\0")
+                    offset = end
+
+                    yield (offset, topic.decode("utf8"), message)
+
+    def _iter_from(self, number, offset):
+        for segment in list(self._segments):
+            if segment < number:
+                continue
+            for (_, topic, message) in self._records(segment, offset if segment == number else 0):
+                yield (topic, message)
+
+    def replay(self, publish, limit=1000):
+        """Publish records from the start of the spool, in order
+
+        The cursor is saved after each segment and at the end, so a crash
+        repeats at most one batch.
+
+        Args:
+            publish (callable): takes (topic, message bytes), returns False
+                (or raises) if it couldn't be published, which stops the
+                replay there
+            limit (int): maximum number of records to publish
+
+        Returns:
+            int: number of records published
+        """
+
+        published = 0
+
+        with self._lock:
+            self._sync()
+
+            try:
+                while published < limit:
+                    reached_end = True
+
+                    for (offset, topic, message) in self._records(self._read_segment, self._read_offset):
+                        if publish(topic, message) is False:
+                            return published
+
+                        self._read_offset = offset
+                        published += 1
+                        self.replayed += 1
+
+                        if published >= limit:
+                            reached_end = False
+                            break
+
+                    if not reached_end or self._read_segment == self._write_segment:
+                        break
+
+                    if self._read_offset < os.path.getsize(self._path(self._read_segment)):
+                        logger.warning("Skipping corrupt end of %s", self._path(self._read_segment))
+                        self.corrupt += 1
+
+                    # Finished with this segment
+                    self._delete_segment(self._read_segment)
+                    self._read_segment = self._segments[0]
+                    self._read_offset = 0
+                    self._save_cursor()
+            finally:
+                self._save_cursor()
+
+        return published
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._writer.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "segments": len(self._segments),
+                "bytes": self._size(),
+                "appended": self.appended,
+                "replayed": self.replayed,
+                "dropped": self.dropped,
+                "corrupt_segments": self.corrupt,
+            }
+
+
+class SpoolingPublisher:
+    """Publishes through the management client, spooling while it's down
+
+    Args:
+        get_client (callable): returns the paho client (or PublisherPool)
+        spool (Spool): where to keep events while disconnected
+        replay_interval (float): seconds between checking whether there is
+            anything to replay
+        replay_batch (int): records to replay at a time
+    """
+
+    def __init__(self, get_client, spool, replay_interval=1.0, replay_batch=1000):
+        self.get_client = get_client
+        self.spool = spool
+        self.replay_interval = replay_interval
+        self.replay_batch = replay_batch
+
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopped = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="status-spool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.spool.close()
+
+    def _publish(self, topic, message):
+        client = self.get_client()
+
+        if not client.is_connected():
+            return False
+
+        return client.publish(topic, message).rc == 0
+
+    def __call__(self, topic, message):
+        # Anything already spooled has to go first
+        if self.spool.empty and self._publish(topic, message):
+            return
+
+        self.spool.append(topic, message)
+        self._wake.set()
+
+    def replay(self):
+        """Replay until the spool is empty or publishing fails
+
+        Returns:
+            int: number of records published
+        """
+
+        total = 0
+
+        while not self.spool.empty:
+            published = self.spool.replay(self._publish, self.replay_batch)
+            total += published
+
+            if not published:
+                break
+
+        return total
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.replay_interval)
+            self._wake.clear()
+
+            try:
+                if not self.spool.empty:
+                    self.spool.sync()
+                    count = self.replay()
+                    if count:
+                        logger.info("Replayed %d spooled status events", count)
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Error replaying status spool")
@@ -0,0 +1,47 @@
+"""Process wide registry of counters for monitoring
+
+Anything that keeps useful counters (caches, queues, pools) registers a
+function returning a dict of them, and they are all served together from the
+/stats hook endpoint.
+"""
+
+import logging
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+_collectors = OrderedDict()
+
+
+def register(name, collector):
+    """Register a source of stats
+
+    Args:
+        name (str): name to report the stats under
+        collector (callable): takes no arguments and returns a dict of stats
+    """
+    _collectors[name] = collector
+
+
+def unregister(name):
+    _collectors.pop(name, None)
+
+
+def collect():
+    """Get the current stats from everything registered
+
+    Returns:
+        dict: name -> stats
+    """
+
+    collected = {}
+
+    for (name, collector) in _collectors.items():
+        try:
+            collected[name] = collector()
+        except Exception: # pylint: disable=broad-except
+            logger.exception("Error collecting stats for %s", name)
+
+    return collected
@@ -0,0 +1,184 @@
+"""Background publishing of device connect/disconnect status events
+
+The connect/disconnect hooks only put the event on a bounded in memory queue
+and return. A background thread takes events off it in batches, serialises
+them and publishes them, so a broker restart disconnecting tens of thousands
+of clients at once doesn't hold up the hooks behind the management client.
+
+Events are coalesced per topic: if a device's previous event hasn't been
+published yet, it is replaced by the new one, as only the latest status is
+interesting. When the queue is full one of the policies is applied:
+
+- ``block``: wait up to block_timeout seconds for space, then drop the new event
+- ``drop-oldest``: drop the oldest queued event to make space
+- ``drop-newest``: drop the new event
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from overlockmqttauth.encoding import JSONStatusEncoder
+
+
+logger = logging.getLogger(__name__)
+
+
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class StatusPublisher:
+    """Bounded, coalescing queue of status events with a publisher thread
+
+    Args:
+        publish (callable): takes (topic, payload) and publishes it. Called
+            from the publisher thread
+        maxsize (int): maximum number of queued events. 0 publishes every
+            event straight away on the calling thread instead
+        policy (str): what to do when the queue is full, one of POLICIES
+        block_timeout (float): seconds to wait for space with the 'block'
+            policy
+        batch_size (int): maximum number of events to take off the queue at
+            once
+        encoder (object): encoder from encoding.py to serialise events with.
+            Defaults to JSON
+    """
+
+    def __init__(self, publish, maxsize=10000, policy=DROP_OLDEST, block_timeout=1.0,
+                 batch_size=100, encoder=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown status queue policy '{}'".format(policy))
+
+        self.publish = publish
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.encoder = encoder or JSONStatusEncoder()
+
+        # topic -> (payload, timestamp)
+        self._queue = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        # Events taken off the queue but not published yet
+        self._in_flight = 0
+
+        self.enqueued = 0
+        self.coalesced = 0
+        self.published = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _ensure_thread(self):
+        # Threads don't survive a fork, so each worker starts its own
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="status-publisher", daemon=True)
+            self._thread.start()
+
+    def put(self, topic, payload, timestamp=None):
+        """Queue a status event
+
+        Args:
+            topic (str): topic to publish it on
+            payload (dict): event, serialised when it's published
+            timestamp (float): unix time it happened, for 'Time'. Defaults
+                to now
+
+        Returns:
+            bool: False if it was dropped
+        """
+
+        now = time.time() if timestamp is None else timestamp
+
+        if self.maxsize <= 0:
+            self._publish(topic, payload, now)
+            return True
+
+        with self._cond:
+            self._ensure_thread()
+            self.enqueued += 1
+
+            if topic in self._queue:
+                del self._queue[topic]
+                self.coalesced += 1
+            elif len(self._queue) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._queue.popitem(last=False)
+                    self.dropped_oldest += 1
+                elif self.policy == DROP_NEWEST or not self._cond.wait_for(
+                        lambda: len(self._queue) < self.maxsize, self.block_timeout):
+                    self.dropped_newest += 1
+                    return False
+
+            self._queue[topic] = (payload, now)
+            self._cond.notify_all()
+
+        return True
+
+    def _publish(self, topic, payload, timestamp):
+        try:
+            self.publish(topic, self.encoder.encode(payload, timestamp))
+        except Exception: # pylint: disable=broad-except
+            logger.exception("Error publishing status to %s", topic)
+            self.errors += 1
+        else:
+            self.published += 1
+
+    def _take(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue)
+
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popitem(last=False))
+
+            self._in_flight = len(batch)
+            # Space for anything blocked in put()
+            self._cond.notify_all()
+
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+
+            for (topic, (payload, timestamp)) in batch:
+                self._publish(topic, payload, timestamp)
+
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been published
+
+        Returns:
+            bool: False if it timed out
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+
+    def stats(self):
+        return {
+            "depth": len(self._queue),
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "published": self.published,
+            "dropped_oldest": self.dropped_oldest,
+            "dropped_newest": self.dropped_newest,
+            "errors": self.errors,
+        }
@@ -0,0 +1,270 @@
+import pytest
+
+from overlockmqttauth.acl import TopicTrie, ACLEngine, DecisionCache, Identity, PUBLISH, SUBSCRIBE
+
+
+IDENTITY = Identity("v1:pid123:aircon:0xbeef", "g:pid123:aircon:0xbeef", "")
+
+
+class TestTopicTrie:
+
+    @pytest.mark.parametrize("topic", [
+        "a/b/c",
+        "a/x/c",
+        "d",
+        "d/e/f/g",
+    ])
+    def test_matches(self, topic):
+        trie = TopicTrie(["a/b/c", "a/+/c", "d/#"])
+        assert trie.matches(topic)
+
+    @pytest.mark.parametrize("topic", [
+        "a/b",
+        "a/b/c/d",
+        "b/b/c",
+        "e",
+        "",
+    ])
+    def test_no_match(self, topic):
+        trie = TopicTrie(["a/b/c", "a/+/c", "d/#"])
+        assert not trie.matches(topic)
+
+    def test_empty_levels(self):
+        trie = TopicTrie(["/iot-2/+"])
+        assert trie.matches("/iot-2/abc")
+        assert not trie.matches("iot-2/abc")
+
+    @pytest.mark.parametrize("pattern", [
+        "a/#/b",
+        "a/b#",
+        "a/+b/c",
+    ])
+    def test_invalid(self, pattern):
+        with pytest.raises(ValueError):
+            TopicTrie([pattern])
+
+    def test_substitutions(self):
+        trie = TopicTrie(["users/%u/#", "clients/%c/+", "%m/x"])
+
+        assert trie.matches("users/v1:pid123:aircon:0xbeef/abc", IDENTITY)
+        assert trie.matches("clients/g:pid123:aircon:0xbeef/abc", IDENTITY)
+        assert trie.matches("/x", IDENTITY)
+
+        assert not trie.matches("users/someone-else/abc", IDENTITY)
+        assert not trie.matches("clients/g:pid123:aircon:0xbeef/abc")
+
+    def test_dollar_topics(self):
+        trie = TopicTrie(["#", "+/a", "$SYS/a"])
+
+        assert trie.matches("b/a")
+        assert not trie.matches("$SYS/b")
+        assert not trie.matches("$SYS/b/a")
+        assert trie.matches("$SYS/a")
+
+    def test_subscription_wildcards(self):
+        trie = TopicTrie(["a/+/c", "d/#", "users/%u/x"])
+
+        assert trie.matches("a/+/c")
+        assert trie.matches("d/+/#")
+        assert trie.matches("d/#")
+
+        # Broader than anything allowed
+        assert not trie.matches("a/#")
+        assert not trie.matches("+/b/c")
+        assert not trie.matches("users/+/x", IDENTITY)
+
+
+class FakeLoader:
+
+    def __init__(self, acls):
+        self.acls = acls
+        self.calls = []
+
+    def __call__(self, kind, key):
+        self.calls.append((kind, key))
+        return self.acls.get((kind, key))
+
+
+@pytest.fixture(name="loader")
+def fix_loader():
+    return FakeLoader({
+        ("project", "pid123"): {
+            "publish": ["projects/pid123/#"],
+            "subscribe": ["projects/pid123/cmd"],
+        },
+        ("user", "someone"): {
+            "publish": ["users/%u/+", "bad/#/acl"],
+            "subscribe": [],
+        },
+    })
+
+
+class TestACLEngine:
+
+    def test_defaults_dont_load(self, loader):
+        engine = ACLEngine(["iot-2/#"], [], loader=loader)
+
+        assert engine.allowed(PUBLISH, "iot-2/abc", IDENTITY, "pid123")
+        assert not loader.calls
+
+    @pytest.mark.parametrize("topic", [
+        "iot-2/type/+/id/+/cmd/+/fmt/+",
+        "iot-2/type/aircon/id/0xbeef/cmd/#",
+        "iot-2/type/aircon/id/+/cmd/boom/fmt/json",
+    ])
+    def test_defaults_literal_only(self, loader, topic):
+        engine = ACLEngine([], ["iot-2/type/+/id/+/cmd/+/fmt/+", "iot-2/#"], loader=loader)
+
+        assert engine.allowed(SUBSCRIBE, "iot-2/type/aircon/id/0xbeef/cmd/boom/fmt/json", IDENTITY)
+        assert not engine.allowed(SUBSCRIBE, topic, IDENTITY)
+        assert engine.allowed_many(SUBSCRIBE, [topic], IDENTITY) == [False]
+
+    def test_project_rules(self, loader):
+        engine = ACLEngine([], [], loader=loader)
+
+        assert engine.allowed(PUBLISH, "projects/pid123/abc", IDENTITY, "pid123")
+        assert engine.allowed(SUBSCRIBE, "projects/pid123/cmd", IDENTITY, "pid123")
+        assert not engine.allowed(SUBSCRIBE, "projects/pid123/abc", IDENTITY, "pid123")
+
+        # Other projects don't get them
+        assert not engine.allowed(PUBLISH, "projects/pid123/abc", IDENTITY, "pid456")
+
+    def test_user_rules(self, loader):
+        engine = ACLEngine([], [], loader=loader)
+        identity = Identity("someone", "c", "")
+
+        assert engine.allowed(PUBLISH, "users/someone/abc", identity)
+        assert not engine.allowed(PUBLISH, "users/someone-else/abc", identity)
+        # Invalid pattern ignored
+        assert not engine.allowed(PUBLISH, "bad/x/acl", identity)
+
+    def test_cached(self, loader):
+        engine = ACLEngine([], [], loader=loader)
+
+        for _ in range(3):
+            engine.allowed(PUBLISH, "projects/pid123/abc", IDENTITY, "pid123")
+            engine.allowed(PUBLISH, "nothing", IDENTITY, "pid456")
+
+        assert loader.calls.count(("project", "pid123")) == 1
+        assert loader.calls.count(("project", "pid456")) == 1
+
+    def test_invalidate(self, loader):
+        engine = ACLEngine([], [], loader=loader)
+
+        assert not engine.allowed(PUBLISH, "new/topic", IDENTITY, "pid123")
+
+        loader.acls[("project", "pid123")]["publish"].append("new/topic")
+        assert not engine.allowed(PUBLISH, "new/topic", IDENTITY, "pid123")
+
+        engine.invalidate("project", "pid123")
+        assert engine.allowed(PUBLISH, "new/topic", IDENTITY, "pid123")
+
+    def test_loader_error_not_cached(self):
+        calls = []
+
+        def loader(kind, key):
+            calls.append(key)
+            raise RuntimeError("database down")
+
+        engine = ACLEngine([], [], loader=loader)
+
+        assert not engine.allowed(PUBLISH, "abc", IDENTITY, "pid123")
+        assert not engine.allowed(PUBLISH, "abc", IDENTITY, "pid123")
+        assert calls.count("pid123") == 2
+
+    def test_allowed_many(self, loader):
+        engine = ACLEngine([], ["iot-2/#"], loader=loader)
+
+        topics = ["iot-2/abc", "projects/pid123/cmd", "projects/pid123/abc"]
+        assert engine.allowed_many(SUBSCRIBE, topics, IDENTITY, "pid123") == [True, True, False]
+        assert loader.calls == [("project", "pid123"), ("user", IDENTITY.username)]
+
+    def test_allowed_many_defaults_dont_load(self, loader):
+        engine = ACLEngine([], ["iot-2/#"], loader=loader)
+
+        assert engine.allowed_many(SUBSCRIBE, ["iot-2/a", "iot-2/b"], IDENTITY, "pid123") == [True, True]
+        assert not loader.calls
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDecisionCache:
+
+    def _get(self, cache, topic, identity=IDENTITY, action=PUBLISH):
+        return cache.get(action, topic, *identity)
+
+    def test_hit(self):
+        cache = DecisionCache(10, 60)
+
+        assert self._get(cache, "a/b") is None
+        cache.set(PUBLISH, "a/b", IDENTITY, "pid123", True)
+        cache.set(PUBLISH, "c/d", IDENTITY, "pid123", False)
+
+        assert self._get(cache, "a/b") is True
+        assert self._get(cache, "c/d") is False
+        # Separate per action
+        assert self._get(cache, "a/b", action=SUBSCRIBE) is None
+
+        assert cache.stats()["hits"] == 2
+        assert cache.stats()["misses"] == 2
+
+    def test_other_user_same_client_id(self):
+        cache = DecisionCache(10, 60)
+        cache.set(PUBLISH, "a/b", IDENTITY, "pid123", True)
+
+        other = IDENTITY._replace(username="v1:pid456:aircon:0xbeef")
+        assert self._get(cache, "a/b", other) is None
+
+    def test_evict(self):
+        cache = DecisionCache(10, 60)
+        cache.set(PUBLISH, "a/b", IDENTITY, "pid123", True)
+
+        cache.evict(IDENTITY.client_id)
+        assert self._get(cache, "a/b") is None
+
+    def test_invalidate(self):
+        cache = DecisionCache(10, 60)
+        other = Identity("someone", "c2", "")
+        cache.set(PUBLISH, "a/b", IDENTITY, "pid123", True)
+        cache.set(PUBLISH, "a/b", other, None, True)
+
+        cache.invalidate("project", "pid123")
+        assert self._get(cache, "a/b") is None
+        assert self._get(cache, "a/b", other) is True
+
+        cache.invalidate("user", "someone")
+        assert self._get(cache, "a/b", other) is None
+
+    def test_expires(self):
+        timer = FakeTimer()
+        cache = DecisionCache(10, 60, timer=timer)
+        cache.set(PUBLISH, "a/b", IDENTITY, "pid123", True)
+
+        timer.now = 61
+        assert self._get(cache, "a/b") is None
+
+    def test_lru(self):
+        cache = DecisionCache(2, 60)
+
+        for client_id in ("c1", "c2", "c3"):
+            cache.set(PUBLISH, "a/b", Identity("u", client_id, ""), None, True)
+
+        assert len(cache) == 2
+        assert self._get(cache, "a/b", Identity("u", "c1", "")) is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_max_topics(self):
+        cache = DecisionCache(10, 60, max_topics=2)
+
+        for topic in ("a", "b", "c"):
+            cache.set(PUBLISH, topic, IDENTITY, "pid123", True)
+
+        assert self._get(cache, "a") is None
+        assert self._get(cache, "c") is True
@@ -0,0 +1,49 @@
+import pytest
+
+from overlockmqttauth.api import parse_connection
+from overlockmqttauth.api.v1 import API_V1
+from overlockmqttauth.connection import get_connection
+
+
+class TestParseConnection:
+
+    def test_v1(self):
+        api = parse_connection("v1:pid123:aircon:0xbeef", "p:abc")
+
+        assert api.api_version == API_V1
+        assert api.project_id == "pid123"
+        assert api.device_id == "0xbeef"
+        assert api.secret_type == "p"
+
+        credentials = api.credentials
+        assert credentials.product_name == "aircon"
+        assert credentials.secret == "abc"
+        assert credentials.password == "p:abc"
+
+    def test_compact(self):
+        api = parse_connection("v1:pid123:aircon:0xbeef", "p:abc")
+
+        assert not hasattr(api, "__dict__")
+        assert not hasattr(api.credentials, "__dict__")
+
+    def test_interned(self):
+        first = parse_connection("v1:pid123:aircon:0xbeef", "p:abc")
+        second = parse_connection("v1:pid123:aircon:0xf00d", "p:abc")
+
+        assert first.credentials.project_id is second.credentials.project_id
+        assert first.credentials.product_name is second.credentials.product_name
+
+    @pytest.mark.parametrize("username, password", [
+        ("v1:pid123:aircon", "p:abc"),
+        ("v1:pid123:aircon:0xbeef", "abc"),
+        ("v12:pid123:aircon:0xbeef", "p:abc"),
+    ])
+    def test_invalid(self, username, password):
+        with pytest.raises(ValueError):
+            parse_connection(username, password)
+
+    def test_shared_with_auth(self):
+        conn = get_connection("v1:pid123:aircon:0xbeef", "p:abc", "2of3opf23")
+
+        # pylint: disable=protected-access
+        assert conn._auth._credentials is conn._api.credentials
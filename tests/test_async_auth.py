@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from overlockmqttauth.auth.mongodb import aio, devices, vmq
+from overlockmqttauth.auth.mongodb.devices import DeviceSecret, device_secrets_cache
+from overlockmqttauth.auth.mongodb.overlock import Project
+from overlockmqttauth.auth.mongodb.util import mongo_connect
+from overlockmqttauth.auth.mongodb.vmq import project_keys_cache
+from overlockmqttauth.brokers.vernemq import auth_on_register_async
+from overlockmqttauth.connection import get_connection
+
+
+PROJECTID = "3b32154818bccbde03cfea45"
+OTHER_PROJECTID = "3b32154818bccbde03cfea46"
+
+
+def _drivers():
+    drivers = ["threads"]
+    if aio.motor is not None:
+        drivers.append("motor")
+    return drivers
+
+
+@pytest.fixture(autouse=True, params=_drivers())
+def fix_db(request, monkeypatch):
+    monkeypatch.setenv("MONGO_ASYNC_DRIVER", request.param)
+
+    mongo_connect()
+    aio.reset_database()
+    device_secrets_cache.clear()
+    project_keys_cache.clear()
+
+    Project.objects().delete()
+    DeviceSecret.objects().delete()
+
+    Project(name="Project 123", id=PROJECTID, project_keys=["p:abc"]).save()
+    DeviceSecret(project_id=PROJECTID, device_id="0xbeef", secrets=["d:123"]).save()
+
+    yield
+
+    Project.objects().delete()
+    DeviceSecret.objects().delete()
+    aio.reset_database()
+
+
+def _run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def _outcome(fn):
+    try:
+        return fn()
+    except Exception: # pylint: disable=broad-except
+        # Invalid project ids are an error either way (but not the same one)
+        return "error"
+
+
+def _clear_caches():
+    device_secrets_cache.clear()
+    project_keys_cache.clear()
+
+
+@pytest.mark.parametrize("username, password", [
+    ("v1:{}:aircon:0xbeef".format(PROJECTID), "p:abc"),
+    ("v1:{}:aircon:0xbeef".format(PROJECTID), "p:wrong"),
+    ("v1:{}:aircon:0xbeef".format(OTHER_PROJECTID), "p:abc"),
+    ("v1:not-an-object-id:aircon:0xbeef", "p:abc"),
+    ("v1:{}:aircon:0xbeef".format(PROJECTID), "d:123"),
+    ("v1:{}:aircon:0xbeef".format(PROJECTID), "d:456"),
+    ("v1:{}:aircon:0xf00d".format(PROJECTID), "d:123"),
+    ("v1:{}:aircon:0xbeef".format(PROJECTID), "d:abc"),
+])
+def test_authenticate_parity(username, password):
+    """Same answer from the sync and async backends, cached or not"""
+
+    expected = _outcome(lambda: get_connection(username, password, "c1", auth_type="mongodb").authenticated)
+
+    _clear_caches()
+    connection = get_connection(username, password, "c1", auth_type="mongodb-async")
+    assert _outcome(lambda: _run(connection.authenticate())) == expected
+    # From the cache filled by the async lookup
+    assert _outcome(lambda: connection.authenticated) == expected
+
+    _clear_caches()
+    sync_connection = get_connection(username, password, "c1", auth_type="mongodb")
+    assert _outcome(lambda: _run(sync_connection.authenticate())) == expected
+
+
+def test_concurrent_lookups_shared(monkeypatch):
+    calls = []
+    load = aio.load_project_keys
+
+    async def counting(project_id):
+        calls.append(project_id)
+        return await load(project_id)
+
+    monkeypatch.setattr(aio, "load_project_keys", counting)
+
+    username = "v1:{}:aircon:0xbeef".format(PROJECTID)
+    connections = [get_connection(username, "p:abc", "c{}".format(i), auth_type="mongodb-async")
+        for i in range(20)]
+
+    results = _run(asyncio.gather(*[c.authenticate() for c in connections]))
+
+    assert all(results)
+    assert calls == [PROJECTID]
+
+
+class FakeL2:
+    """Just enough of RedisCache"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_many(self, keys):
+        return {k: self.data[k] for k in keys if k in self.data}
+
+    def set_many(self, items):
+        self.data.update(items)
+
+
+def test_l2_used(monkeypatch):
+    project_l2 = FakeL2({PROJECTID: frozenset(["p:fromredis"])})
+    device_l2 = FakeL2({})
+    monkeypatch.setattr(vmq, "project_keys_l2", project_l2)
+    monkeypatch.setattr(devices, "device_secrets_l2", device_l2)
+
+    connection = get_connection("v1:{}:aircon:0xbeef".format(PROJECTID), "p:fromredis", "c1",
+        auth_type="mongodb-async")
+    assert _run(connection.authenticate())
+
+    # Not in redis, so loaded from mongodb and stored there
+    connection = get_connection("v1:{}:aircon:0xbeef".format(PROJECTID), "d:123", "c1",
+        auth_type="mongodb-async")
+    assert _run(connection.authenticate())
+    assert device_l2.data == {"{}:0xbeef".format(PROJECTID): frozenset(["d:123"])}
+
+
+@pytest.mark.parametrize("password, result", [
+    ("p:abc", "ok"),
+    ("p:wrong", {"error": "Couldn't authenticate connection details"}),
+])
+def test_auth_on_register_async(password, result):
+    response = _run(auth_on_register_async({
+        "username": "v1:{}:aircon:0xbeef".format(PROJECTID),
+        "password": password,
+        "client_id": "c1",
+        "mountpoint": "",
+    }))
+
+    assert response == {"result": result}
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from overlockmqttauth.auth.batch import BatchLoader
+
+
+def _load_many(keys):
+    return {k: k.upper() for k in keys if k != "missing"}
+
+
+def _load_concurrently(loader, keys):
+    results = {}
+
+    def load(key):
+        results[key] = loader.load(key)
+
+    threads = [threading.Thread(target=load, args=(k,)) for k in keys]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+class TestBatchLoader:
+
+    def test_batched(self):
+        calls = []
+
+        def load_many(keys):
+            calls.append(keys)
+            return _load_many(keys)
+
+        loader = BatchLoader(load_many, window=0.5, max_batch=5)
+        results = _load_concurrently(loader, ["a", "b", "c", "d", "e"])
+
+        assert results == {"a": "A", "b": "B", "c": "C", "d": "D", "e": "E"}
+        # Closed as soon as it was full, not after the window
+        assert len(calls) == 1
+        assert sorted(calls[0]) == ["a", "b", "c", "d", "e"]
+        assert loader.stats()["largest_batch"] == 5
+
+    def test_missing_is_none(self):
+        loader = BatchLoader(_load_many, window=0.001)
+
+        assert loader.load("missing") is None
+        assert loader.load("abc") == "ABC"
+        assert loader.stats()["batches"] == 2
+
+    def test_error_raised_to_everyone(self):
+        def load_many(keys):
+            raise RuntimeError("db down")
+
+        loader = BatchLoader(load_many, window=0.05, max_batch=3)
+        errors = []
+
+        def load(key):
+            try:
+                loader.load(key)
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load, args=(k,)) for k in "abc"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(errors) == 3
+
+    @pytest.mark.parametrize("max_batch", (1, 2))
+    def test_max_batch(self, max_batch):
+        calls = []
+
+        def load_many(keys):
+            calls.append(keys)
+            return _load_many(keys)
+
+        loader = BatchLoader(load_many, window=0.05, max_batch=max_batch)
+        _load_concurrently(loader, ["a", "b", "c", "d"])
+
+        assert all(len(keys) <= max_batch for keys in calls)
+        assert sum(len(keys) for keys in calls) == 4
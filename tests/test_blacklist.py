@@ -0,0 +1,139 @@
+import pytest
+
+from overlockmqttauth.auth import bloom as bloom_module
+from overlockmqttauth.auth.bloom import BloomFilter
+from overlockmqttauth.auth.mongodb.blacklist import Blacklist, _Generation
+from overlockmqttauth.auth.mongodb.util import mongo_connect
+from overlockmqttauth.auth.mongodb.blacklist import BlacklistEntry, blacklist_entry
+from overlockmqttauth.auth.mongodb.refresh import RefreshingIndex
+
+
+PROJECTID = "3b32154818bccbde03cfea45"
+
+
+class TestBloomFilter:
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        items = ["item-{}".format(i) for i in range(1000)]
+
+        for item in items:
+            bloom.add(item)
+
+        assert all(item in bloom for item in items)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add("item-{}".format(i))
+
+        false_positives = sum("other-{}".format(i) in bloom for i in range(10000))
+
+        # Allow plenty of slack
+        assert false_positives < 300
+
+    def test_one_hash_per_check(self, monkeypatch):
+        hashed = []
+
+        def counting_hash(item):
+            hashed.append(item)
+            return hash(item)
+
+        bloom = BloomFilter(1000)
+        bloom.add("item")
+
+        monkeypatch.setattr(bloom_module, "hash", counting_hash, raising=False)
+        assert "item" in bloom
+        assert hashed == ["item"]
+
+
+class TestBlacklistLookup:
+
+    @pytest.fixture(name="bl")
+    def fix_blacklist(self):
+        bl = Blacklist()
+        bl._generation = _Generation([
+            ("secret", PROJECTID, "p:abc"),
+            ("project", "badproject", None),
+            ("device", PROJECTID, "0xbad"),
+        ])
+        return bl
+
+    def test_not_blacklisted(self, bl):
+        assert not bl.is_blacklisted("p:def", PROJECTID, "0xbeef")
+
+    def test_secret(self, bl):
+        assert bl.is_blacklisted("p:abc", PROJECTID, "0xbeef")
+        # Secrets are per project
+        assert not bl.is_blacklisted("p:abc", "otherproject", "0xbeef")
+
+    def test_project(self, bl):
+        assert bl.is_blacklisted("p:def", "badproject", "0xbeef")
+
+    def test_device(self, bl):
+        assert bl.is_blacklisted("p:def", PROJECTID, "0xbad")
+        assert not bl.is_blacklisted("p:def", "otherproject", "0xbad")
+
+    def test_stats(self, bl):
+        bl.is_blacklisted("p:def", PROJECTID, "0xbeef")
+        bl.is_blacklisted("p:abc", PROJECTID, "0xbeef")
+
+        stats = bl.stats()
+        assert stats["checks"] == 2
+        assert stats["hits"] == 1
+        assert stats["entries"] == {"secret": 1, "project": 1, "device": 1}
+
+
+class TestBlacklistLoad:
+
+    @pytest.fixture(autouse=True)
+    def fix_db(self):
+        mongo_connect()
+        BlacklistEntry.objects().delete()
+        yield
+        BlacklistEntry.objects().delete()
+
+    def test_load_and_load_new(self):
+        blacklist_entry("secret", PROJECTID, "p:abc")
+
+        bl = Blacklist()
+        bl.load()
+        assert bl.is_blacklisted("p:abc", PROJECTID, "0xbeef")
+        assert not bl.is_blacklisted("p:def", PROJECTID, "0xbad")
+
+        blacklist_entry("device", PROJECTID, "0xbad")
+        bl.load_new()
+        assert bl.is_blacklisted("p:abc", PROJECTID, "0xbeef")
+        assert bl.is_blacklisted("p:def", PROJECTID, "0xbad")
+
+    def test_removed_on_full_load(self):
+        blacklist_entry("project", PROJECTID)
+
+        bl = Blacklist()
+        bl.load()
+        assert bl.is_blacklisted("p:abc", PROJECTID, "0xbeef")
+
+        BlacklistEntry.objects().delete()
+        bl.load()
+        assert not bl.is_blacklisted("p:abc", PROJECTID, "0xbeef")
+
+    def test_empty_load_new_not_full(self, monkeypatch):
+        bl = Blacklist()
+        bl.load()
+
+        def full_load():
+            raise AssertionError("Full load")
+
+        monkeypatch.setattr(bl, "load", full_load)
+
+        bl.load_new()
+        assert not bl.is_blacklisted("p:abc", PROJECTID, "0xbeef")
+
+        blacklist_entry("secret", PROJECTID, "p:abc")
+        bl.load_new()
+        assert bl.is_blacklisted("p:abc", PROJECTID, "0xbeef")
+
+
+def test_refreshing_index_abstract():
+    with pytest.raises(TypeError):
+        RefreshingIndex() # pylint: disable=abstract-class-instantiated
@@ -5,12 +5,28 @@ from unittest.mock import patch
 import pytest
 
 from overlockmqttauth.brokers.vernemq import app
-from overlockmqttauth.brokers.util import WORKER_USERNAME
-from overlockmqttauth.auth.mongodb.vmq import MQTTUser
+from overlockmqttauth.brokers.util import (WORKER_USERNAME, acl_engine, decision_cache, sessions,
+    status_publisher)
+from overlockmqttauth.auth.mongodb.util import mongo_connect
+from overlockmqttauth.auth.mongodb.vmq import MQTTUser, project_keys_cache
 # FIXME
 from overlockmqttauth.auth.mongodb.overlock import Project
 
 
+@pytest.fixture(scope="module", autouse=True)
+def fix_mongo_connect():
+    mongo_connect()
+
+
+@pytest.fixture(autouse=True)
+def fix_clear_caches():
+    # Tests recreate the same project with different keys
+    project_keys_cache.clear()
+    acl_engine.clear()
+    decision_cache.clear()
+    sessions.clear()
+
+
 @pytest.fixture(name="test_client")
 def fix_test_client():
     yield app.test_client()
@@ -167,7 +183,7 @@ class TestAuthPublish:
             content_type="application/json",
         )
 
-        assert {'result': {'error': 'Topic did not match regex'}} == _getjson(response)
+        assert {'result': {'error': 'Topic not allowed by ACL'}} == _getjson(response)
         assert response._status_code == 200
 
 
@@ -208,9 +224,137 @@ class TestAuthSubscribe:
             content_type="application/json",
         )
 
-        assert {'result': {'error': 'Topic did not match regex'}} == _getjson(response)
+        assert {'result': {'error': 'Topic not allowed by ACL'}} == _getjson(response)
         assert response._status_code == 200
 
+    def test_checks_every_topic(self, test_client):
+        response = test_client.post(
+            "/auth_on_subscribe",
+            data=json.dumps({
+                "username": "v1:pid123:aircon:0xbeef",
+                "password": "p:abc",
+                "client_id": "2of3opf23",
+                "topics": [
+                    {
+                        "topic": "/iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/cmd/boom/fmt/json",
+                        "qos": 1,
+                    },
+                    {
+                        "topic": "/iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/evt/boom/fmt/json",
+                        "qos": 1,
+                    },
+                    {
+                        "topic": "iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/cmd/+/fmt/json",
+                        "qos": 0,
+                    },
+                ]
+            }),
+            content_type="application/json",
+        )
+
+        assert {
+            "result": "ok",
+            "topics": [
+                {
+                    "topic": "/iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/cmd/boom/fmt/json",
+                    "qos": 1,
+                },
+                {
+                    "topic": "/iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/evt/boom/fmt/json",
+                    "qos": 128,
+                },
+                {
+                    # Wildcards aren't allowed by the defaults
+                    "topic": "iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/cmd/+/fmt/json",
+                    "qos": 128,
+                },
+            ],
+        } == _getjson(response)
+        assert response._status_code == 200
+
+
+class TestSessions:
+
+    @pytest.fixture(name="registered")
+    def fix_registered(self, test_client):
+        Project.objects().delete()
+        p = Project(
+            name="Project 123",
+            id=PROJECTID,
+            project_keys=["p:{}".format(uuid.uuid4())],
+        )
+        p.save()
+
+        response = test_client.post(
+            "/auth_on_register",
+            data=json.dumps({
+                "username": "v1:{}:aircon:0xbeef".format(PROJECTID),
+                "password": p.project_keys[0],
+                "client_id": "g:{}:aircon:0xbeef".format(PROJECTID),
+                "mountpoint": "",
+            }),
+            content_type="application/json",
+        )
+        assert {"result": "ok"} == _getjson(response)
+
+        return sessions.get("", "g:{}:aircon:0xbeef".format(PROJECTID))
+
+    def test_session_stored(self, registered):
+        assert registered.project_id == PROJECTID
+        assert registered.device == (PROJECTID, "aircon", "0xbeef")
+
+    def _publish(self, test_client, topic):
+        return test_client.post(
+            "/auth_on_publish",
+            data=json.dumps({
+                "username": "v1:{}:aircon:0xbeef".format(PROJECTID),
+                "client_id": "g:{}:aircon:0xbeef".format(PROJECTID),
+                "mountpoint": "",
+                "topic": topic,
+            }),
+            content_type="application/json",
+        )
+
+    def test_own_project_only(self, test_client, registered):
+        response = self._publish(test_client,
+            "iot-2/type/aircon/id/v1:{}:aircon:0xbeef/evt/boom/fmt/json".format(PROJECTID))
+        assert {"result": "ok"} == _getjson(response)
+
+        response = self._publish(test_client,
+            "iot-2/type/aircon/id/v1:pid456:aircon:0xbeef/evt/boom/fmt/json")
+        assert {'result': {'error': 'Topic not allowed by ACL'}} == _getjson(response)
+
+    def test_removed_offline(self, test_client, registered):
+        with patch("overlockmqttauth.brokers.util.get_publishers") as client:
+            response = test_client.post(
+                "/on_client_offline",
+                data=json.dumps({
+                    "client_id": "g:{}:aircon:0xbeef".format(PROJECTID),
+                    "mountpoint": "",
+                }),
+                content_type="application/json",
+            )
+            assert status_publisher.flush(5)
+
+        assert {"result": "next"} == _getjson(response)
+        assert sessions.get("", "g:{}:aircon:0xbeef".format(PROJECTID)) is None
+        client.return_value.publish.assert_called_once()
+        assert client.return_value.publish.call_args[0][0] == "iot-2/type/aircon/id/0xbeef/mon"
+
+    def test_failed_register_removes_session(self, test_client, registered):
+        test_client.post(
+            "/auth_on_register",
+            data=json.dumps({
+                "username": "v1:{}:aircon:0xbeef".format(PROJECTID),
+                "password": "p:wrong",
+                "client_id": "g:{}:aircon:0xbeef".format(PROJECTID),
+                "mountpoint": "",
+            }),
+            content_type="application/json",
+        )
+
+        assert sessions.get("", "g:{}:aircon:0xbeef".format(PROJECTID)) is None
+
 
 class TestWorkerConnect:
 
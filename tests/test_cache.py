@@ -0,0 +1,98 @@
+from unittest.mock import patch
+
+import pytest
+
+from overlockmqttauth.auth.cache import TTLCache, MISSING
+from overlockmqttauth.auth.mongodb import vmq
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(name="timer")
+def fix_timer():
+    return FakeTimer()
+
+
+class TestTTLCache:
+
+    def test_miss_then_hit(self, timer):
+        cache = TTLCache(10, 5, timer=timer)
+
+        assert cache.get("a") is MISSING
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_expires(self, timer):
+        cache = TTLCache(10, 5, timer=timer)
+        cache.set("a", 1)
+
+        timer.now = 4.9
+        assert cache.get("a") == 1
+        timer.now = 5
+        assert cache.get("a") is MISSING
+        assert len(cache) == 0
+
+    def test_negative_ttl(self, timer):
+        cache = TTLCache(10, 5, negative_ttl=1, timer=timer)
+        cache.set("a", None)
+
+        assert cache.get("a") is None
+        assert cache.stats()["negative_hits"] == 1
+
+        timer.now = 1
+        assert cache.get("a") is MISSING
+
+    def test_lru_eviction(self, timer):
+        cache = TTLCache(2, 5, timer=timer)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # 'a' is now most recently used
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("b") is MISSING
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.stats()["evictions"] == 1
+
+    def test_disabled(self, timer):
+        cache = TTLCache(0, 5, timer=timer)
+        cache.set("a", 1)
+
+        assert cache.get("a") is MISSING
+
+
+class TestProjectKeysCache:
+
+    @pytest.fixture(autouse=True)
+    def fix_clear_cache(self):
+        vmq.project_keys_cache.clear()
+        yield
+        vmq.project_keys_cache.clear()
+
+    def test_loaded_once(self):
+        with patch("overlockmqttauth.auth.mongodb.vmq.load_project_keys",
+                return_value=frozenset(["p:abc"])) as mock_load:
+            for _ in range(5):
+                assert vmq.get_project_keys("pid123") == {"p:abc"}
+
+        assert mock_load.call_count == 1
+
+    def test_negative_cached(self):
+        with patch("overlockmqttauth.auth.mongodb.vmq.load_project_keys",
+                return_value=None) as mock_load:
+            for _ in range(5):
+                assert vmq.get_project_keys("pid123") is None
+
+        assert mock_load.call_count == 1
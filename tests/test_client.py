@@ -0,0 +1,94 @@
+import paho.mqtt.client as mqtt
+import pytest
+
+from overlockmqttauth.client import PublisherPool, get_client
+
+
+class Info:
+
+    def __init__(self, rc):
+        self.rc = rc
+
+
+class FakeClient:
+
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.published = []
+        self.on_publish = None
+        self.on_disconnect = None
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, payload, qos=0):
+        if not self.connected:
+            return Info(mqtt.MQTT_ERR_NO_CONN)
+
+        self.published.append(topic)
+        return Info(mqtt.MQTT_ERR_SUCCESS)
+
+
+class TestPublisherPool:
+
+    def test_sharded(self):
+        clients = [FakeClient() for _ in range(4)]
+        pool = PublisherPool(clients)
+
+        topics = ["iot-2/type/aircon/id/{}/mon".format(i) for i in range(100)]
+        for topic in topics * 2:
+            pool.publish(topic, "{}")
+
+        # Each topic always goes on the same connection
+        for client in clients:
+            assert client.published
+            for topic in set(client.published):
+                assert client.published.count(topic) == 2
+
+        assert sum(len(c.published) for c in clients) == 200
+
+    def test_key(self):
+        clients = [FakeClient() for _ in range(4)]
+        pool = PublisherPool(clients)
+
+        pool.publish("a", "{}", key="g:pid:aircon:0xbeef")
+        pool.publish("b", "{}", key="g:pid:aircon:0xbeef")
+
+        assert [c.published for c in clients if c.published] == [["a", "b"]]
+
+    def test_in_flight(self):
+        client = FakeClient()
+        pool = PublisherPool([client])
+
+        pool.publish("a", "{}")
+        pool.publish("b", "{}")
+        assert pool.stats()["in_flight"] == 2
+
+        client.on_publish(client, None, 1)
+        assert pool.stats()["in_flight"] == 1
+
+        client.on_disconnect(client, None, 1)
+        assert pool.stats()["in_flight"] == 0
+        assert pool.stats()["connections"][0]["disconnects"] == 1
+
+    def test_errors(self):
+        client = FakeClient(connected=False)
+        pool = PublisherPool([client])
+
+        assert pool.publish("a", "{}").rc == mqtt.MQTT_ERR_NO_CONN
+        assert not pool.is_connected()
+
+        [stats] = pool.stats()["connections"]
+        assert stats["errors"] == 1
+        assert stats["in_flight"] == 0
+
+
+class TestGetClient:
+
+    def test_transport(self, monkeypatch):
+        monkeypatch.setenv("MQTT_TRANSPORT", "tcp")
+        assert get_client()._transport == "tcp"
+
+    def test_invalid_transport(self):
+        with pytest.raises(ValueError):
+            get_client("udp")
@@ -0,0 +1,236 @@
+import json
+import os
+import time
+
+import pytest
+from pymongo.errors import ConnectionFailure
+
+from overlockmqttauth import auth_data
+from overlockmqttauth.auth import compiled
+from overlockmqttauth.auth.compiled import (CompiledSnapshot, FileAuth, InvalidSnapshot,
+    compile_snapshot, PROJECT, PROJECT_SECRET, DEVICE_SECRET, BLACKLISTED)
+from overlockmqttauth.auth.tokens import sign_token
+from overlockmqttauth.brokers import util
+from overlockmqttauth.brokers.vernemq import app
+from overlockmqttauth.connection import get_connection
+
+
+PROJECTS = [
+    {
+        "id": "pid123",
+        "blacklisted": False,
+        "secrets": [
+            {"val": "abc", "blacklisted": False},
+            {"val": "old", "blacklisted": True},
+        ],
+    },
+    {
+        "id": "pid456",
+        "blacklisted": True,
+        "secrets": [
+            {"val": "def", "blacklisted": False},
+        ],
+    },
+]
+
+DEVICES = [
+    {
+        "project": "pid123",
+        "device_id": "0xbeef",
+        "secret": {"val": "123", "blacklisted": False},
+    },
+]
+
+
+@pytest.fixture(name="path")
+def fix_path(tmpdir):
+    path = str(tmpdir.join("auth.snapshot"))
+    compile_snapshot(path, PROJECTS, DEVICES)
+    return path
+
+
+@pytest.fixture(name="snapshot")
+def fix_snapshot(path):
+    snapshot = CompiledSnapshot(path)
+    snapshot.load()
+    return snapshot
+
+
+class TestCompiledSnapshot:
+
+    def test_lookup(self, snapshot):
+        assert snapshot.flags(PROJECT, "pid123") == 0
+        assert snapshot.flags(PROJECT, "pid456") == BLACKLISTED
+        assert snapshot.flags(PROJECT_SECRET, "pid123", "abc") == 0
+        assert snapshot.flags(PROJECT_SECRET, "pid123", "old") == BLACKLISTED
+        assert snapshot.flags(DEVICE_SECRET, "pid123", "0xbeef", "123") == 0
+
+        assert snapshot.flags(PROJECT, "pid789") is None
+        assert snapshot.flags(PROJECT_SECRET, "pid123", "def") is None
+        # Separators can't be used to make up another key
+        assert snapshot.flags(PROJECT_SECRET, "pid123\0abc") is None
+
+    def test_auth_data(self, tmpdir):
+        path = str(tmpdir.join("auth.snapshot"))
+        compile_snapshot(path, auth_data.projects, auth_data.devices)
+
+        snapshot = CompiledSnapshot(path)
+        assert snapshot.flags(PROJECT_SECRET, "abc123", "sdkg40wkgk3pok32") == 0
+        assert snapshot.flags(DEVICE_SECRET, "abc123", "blapt", "2123122413423") == 0
+
+    def test_hash_collisions(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(compiled, "_hash", lambda key: 42)
+
+        path = str(tmpdir.join("auth.snapshot"))
+        compile_snapshot(path, PROJECTS, DEVICES)
+
+        snapshot = CompiledSnapshot(path)
+        assert snapshot.flags(PROJECT, "pid456") == BLACKLISTED
+        assert snapshot.flags(PROJECT_SECRET, "pid123", "abc") == 0
+        assert snapshot.flags(PROJECT, "pid789") is None
+
+    def test_without_memoryview(self, snapshot):
+        # What's used on big endian machines
+        mapped = snapshot._file # pylint: disable=protected-access
+        mapped.hashes = compiled._Hashes(mapped.map, compiled._HEADER.size, mapped.count) # pylint: disable=protected-access
+
+        assert snapshot.flags(PROJECT, "pid456") == BLACKLISTED
+        assert snapshot.flags(PROJECT, "pid789") is None
+
+    def test_empty(self, tmpdir):
+        path = str(tmpdir.join("auth.snapshot"))
+        compile_snapshot(path, [], [])
+
+        assert CompiledSnapshot(path).flags(PROJECT, "pid123") is None
+
+    def test_reloads_new_file(self, path, snapshot):
+        compile_snapshot(path, [{"id": "pid789", "secrets": []}], [])
+
+        # Not checked again until check_interval has passed
+        assert snapshot.flags(PROJECT, "pid789") is None
+
+        snapshot.check_interval = 0
+        snapshot._next_check = 0 # pylint: disable=protected-access
+        assert snapshot.flags(PROJECT, "pid789") == 0
+        assert snapshot.flags(PROJECT, "pid123") is None
+
+    def test_keeps_old_file_if_new_is_bad(self, path, snapshot):
+        with open(path + ".new", "wb") as f:
+            f.write(b"nonsense")
+        os.replace(path + ".new", path)
+
+        snapshot._next_check = 0 # pylint: disable=protected-access
+        assert snapshot.flags(PROJECT, "pid123") == 0
+
+    def test_invalid(self, tmpdir):
+        path = str(tmpdir.join("auth.snapshot"))
+        with open(path, "wb") as f:
+            f.write(b"not a snapshot file")
+
+        with pytest.raises(InvalidSnapshot):
+            CompiledSnapshot(path).load()
+
+    def test_main(self, tmpdir):
+        source = tmpdir.join("auth.json")
+        source.write('{"projects": [{"id": "pid123", "secrets": [{"val": "abc"}]}]}')
+        path = str(tmpdir.join("auth.snapshot"))
+
+        assert compiled.main([str(source), path]) == 0
+        assert CompiledSnapshot(path).flags(PROJECT_SECRET, "pid123", "abc") == 0
+
+
+@pytest.fixture(name="file_auth")
+def fix_file_auth(snapshot, monkeypatch):
+    monkeypatch.setattr(FileAuth, "snapshot", snapshot)
+
+
+def _connection(username, password):
+    return get_connection(username, password, "c1", auth_type="file")
+
+
+@pytest.mark.usefixtures("file_auth")
+class TestFileAuth:
+
+    def test_project_secret(self):
+        conn = _connection("v1:pid123:aircon:0xbeef", "p:abc")
+        assert conn.authenticated
+        assert not conn.blacklisted
+
+        assert not _connection("v1:pid123:aircon:0xbeef", "p:abcd").authenticated
+        assert not _connection("v1:pid789:aircon:0xbeef", "p:abc").authenticated
+
+    def test_device_secret(self):
+        assert _connection("v1:pid123:aircon:0xbeef", "d:123").authenticated
+        assert not _connection("v1:pid123:aircon:0xf00d", "d:123").authenticated
+        # Not a project secret
+        assert not _connection("v1:pid123:aircon:0xbeef", "p:123").authenticated
+
+    def test_blacklisted(self):
+        assert _connection("v1:pid123:aircon:0xbeef", "p:old").blacklisted
+        assert _connection("v1:pid456:aircon:0xbeef", "p:def").blacklisted
+
+    def test_doesnt_need_mongodb(self):
+        assert not FileAuth.requires_mongodb
+
+
+@pytest.mark.usefixtures("file_auth")
+class TestFileBackendHooks:
+
+    @pytest.fixture(autouse=True)
+    def fix_no_mongodb(self, monkeypatch):
+        def no_mongodb(kind, key):
+            raise ConnectionFailure("No mongodb")
+
+        monkeypatch.setenv("AUTH_BACKEND", "file")
+        monkeypatch.setattr(util, "load_acls", no_mongodb)
+        # As it would be if it were set up for mongodb
+        monkeypatch.setattr(util.acl_engine, "loader", no_mongodb)
+
+        util.init_acls(FileAuth)
+        util.sessions.clear()
+
+        yield
+
+        util.acl_engine.clear()
+        util.decision_cache.clear()
+        util.sessions.clear()
+
+    def _post(self, path, payload):
+        response = app.test_client().post(path, data=json.dumps(payload), content_type="application/json")
+        return json.loads(response.data.decode("utf8"))
+
+    def test_hooks(self, caplog):
+        client = {
+            "username": "v1:pid123:aircon:0xbeef",
+            "client_id": "c1",
+            "mountpoint": "",
+        }
+
+        assert self._post("/auth_on_register", dict(client, password="p:abc")) == {"result": "ok"}
+
+        assert self._post("/auth_on_publish", dict(client,
+            topic="iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/evt/boom/fmt/json",
+        )) == {"result": "ok"}
+        assert self._post("/auth_on_publish", dict(client,
+            topic="iot-2/type/gateway/id/v1:pid123:aircon:0xbeef/cmd/boom/fmt/json",
+        )) == {"result": {"error": "Topic not allowed by ACL"}}
+        assert self._post("/auth_on_subscribe", dict(client,
+            topics=[{"topic": "somewhere/else"}],
+        )) == {"result": {"error": "Topic not allowed by ACL"}}
+
+        assert "Error loading ACLs" not in caplog.text
+
+    def test_v2_rejected(self, caplog):
+        username = "v2:3b32154818bccbde03cfea45:aircon:0xbeef"
+        password = sign_token(b"secret1", "k1", username, time.time() + 60)
+
+        with pytest.raises(ValueError):
+            get_connection(username, password, "c1")
+
+        assert self._post("/auth_on_register", {
+            "username": username,
+            "password": password,
+            "client_id": "c1",
+            "mountpoint": "",
+        }) == {"result": {"error": "Unable to parse connection details"}}
+        assert "ConnectionFailure" not in caplog.text
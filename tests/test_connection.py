@@ -1,4 +1,9 @@
 from unittest.mock import patch
+
+import pytest
+
+from overlockmqttauth.auth.compiled import FileAuth
+from overlockmqttauth.auth.registry import set_default_backend
 from overlockmqttauth.connection import get_connection
 
 
@@ -22,3 +27,29 @@ class TestConnection:
 
         with patch("overlockmqttauth.auth.mongodb.vmq.VMQAuth.blacklisted", return_value=True):
             assert conn.blacklisted
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            get_connection("v1:pid123:aircon:0xbeef", "p:abc", "2of3opf23", auth_type="nope")
+
+    def test_import_backend(self):
+        conn = get_connection("v1:pid123:aircon:0xbeef", "p:abc", "2of3opf23",
+            auth_type="overlockmqttauth.auth.compiled:FileAuth")
+
+        assert isinstance(conn._auth, FileAuth) # pylint: disable=protected-access
+
+    def test_default_backend(self):
+        set_default_backend("file")
+        try:
+            conn = get_connection("v1:pid123:aircon:0xbeef", "p:abc", "2of3opf23")
+        finally:
+            set_default_backend(None)
+
+        assert isinstance(conn._auth, FileAuth) # pylint: disable=protected-access
+
+    def test_api_type(self):
+        conn = get_connection("v1:pid123:aircon:0xbeef", "p:abc", "2of3opf23", api_type="v1")
+        assert conn.api_version == 1
+
+        with pytest.raises(ValueError):
+            get_connection("v1:pid123:aircon:0xbeef", "p:abc", "2of3opf23", api_type="v2")
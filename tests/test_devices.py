@@ -0,0 +1,72 @@
+import pytest
+
+from overlockmqttauth.auth.mongodb.devices import (DeviceSecret, device_secrets_cache,
+    invalidate_device, load_device_secrets)
+from overlockmqttauth.auth.mongodb.overlock import Project
+from overlockmqttauth.auth.mongodb.util import mongo_connect
+from overlockmqttauth.auth.mongodb.vmq import project_keys_cache
+from overlockmqttauth.connection import get_connection
+
+
+PROJECTID = "3b32154818bccbde03cfea45"
+USERNAME = "v1:{}:aircon:0xbeef".format(PROJECTID)
+
+
+@pytest.fixture(autouse=True)
+def fix_db():
+    mongo_connect()
+    device_secrets_cache.clear()
+    project_keys_cache.clear()
+
+    Project.objects().delete()
+    DeviceSecret.objects().delete()
+
+    Project(name="Project 123", id=PROJECTID, project_keys=["p:abc", "d:legacy"]).save()
+    DeviceSecret(project_id=PROJECTID, device_id="0xbeef", secrets=["d:123", "d:456"]).save()
+
+    yield
+
+    Project.objects().delete()
+    DeviceSecret.objects().delete()
+
+
+def _authenticated(password, username=USERNAME, auth_type="mongodb"):
+    return get_connection(username, password, "c1", auth_type=auth_type).authenticated
+
+
+class TestDeviceSecrets:
+
+    def test_load(self):
+        assert load_device_secrets(PROJECTID, "0xbeef") == {"d:123", "d:456"}
+        assert load_device_secrets(PROJECTID, "0xf00d") is None
+
+    @pytest.mark.parametrize("auth_type", ["mongodb", "snapshot"])
+    def test_device_secret(self, auth_type):
+        assert _authenticated("d:456", auth_type=auth_type)
+        assert not _authenticated("d:789", auth_type=auth_type)
+
+    def test_not_other_devices(self):
+        assert not _authenticated("d:123", "v1:{}:aircon:0xf00d".format(PROJECTID))
+
+    def test_project_key_still_works(self):
+        assert _authenticated("p:abc")
+        # Project keys aren't device secrets
+        assert not _authenticated("d:abc")
+
+    @pytest.mark.parametrize("auth_type", ["mongodb", "snapshot"])
+    def test_no_document_uses_project_keys(self, auth_type):
+        """Devices which haven't been given a device_secret document still
+        connect with 'd:' keys in project_keys"""
+
+        assert _authenticated("d:legacy", "v1:{}:aircon:0xf00d".format(PROJECTID), auth_type)
+        # But not once the device has its own secrets
+        assert not _authenticated("d:legacy", auth_type=auth_type)
+
+    def test_invalidate(self):
+        assert _authenticated("d:123")
+
+        DeviceSecret.objects(project_id=PROJECTID, device_id="0xbeef").update(set__secrets=[])
+        assert _authenticated("d:123")
+
+        invalidate_device("{}:0xbeef".format(PROJECTID))
+        assert not _authenticated("d:123")
@@ -0,0 +1,116 @@
+import binascii
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from overlockmqttauth import encoding
+from overlockmqttauth.encoding import CBORStatusEncoder, JSONStatusEncoder, get_encoder
+
+
+def _cbor(value):
+    out = []
+    CBORStatusEncoder()._item(value, out)
+    return binascii.hexlify(b"".join(out)).decode()
+
+
+class TestCBOR:
+
+    # From RFC 8949 appendix A
+    @pytest.mark.parametrize("value, expected", [
+        (0, "00"),
+        (23, "17"),
+        (24, "1818"),
+        (100, "1864"),
+        (1000, "1903e8"),
+        (1000000, "1a000f4240"),
+        (1000000000000, "1b000000e8d4a51000"),
+        (-1, "20"),
+        (-1000, "3903e7"),
+        (1.1, "fb3ff199999999999a"),
+        (True, "f5"),
+        (False, "f4"),
+        (None, "f6"),
+        (b"\x01\x02\x03\x04", "4401020304"),
+        ("a", "6161"),
+        ("IETF", "6449455446"),
+        ("ü", "62c3bc"),
+        ([1, [2, 3], [4, 5]], "8301820203820405"),
+        ({"a": 1, "b": [2, 3]}, "a26161016162820203"),
+    ])
+    def test_items(self, value, expected):
+        assert _cbor(value) == expected
+
+    def test_unsupported(self):
+        with pytest.raises(TypeError):
+            _cbor(object())
+
+    def test_status(self):
+        encoder = CBORStatusEncoder()
+
+        for _ in range(2):
+            encoded = encoder.encode({"Action": "Connect", "Port": 1883}, 1.5)
+
+            assert binascii.hexlify(encoded).decode() == (
+                "a3"
+                "66416374696f6e" "67436f6e6e656374"
+                "64506f7274" "19075b"
+                "6454696d65" "c1" "fb3ff8000000000000"
+            )
+
+    def test_smaller_than_json(self):
+        payload = {
+            "ClientAddr": "172.20.0.1",
+            "Protocol": "mqtt-tcp",
+            "ClientID": "g:pid123:aircon:0xbeef",
+            "User": "v1:pid123:aircon:0xbeef",
+            "Port": 52294,
+            "Action": "Connect",
+        }
+
+        cbor = CBORStatusEncoder().encode(dict(payload), 1500000000.0)
+        as_json = JSONStatusEncoder().encode(dict(payload), 1500000000.0)
+
+        assert len(cbor) < len(as_json)
+
+
+class TestEncoders:
+
+    def test_json(self):
+        encoder = get_encoder("json")
+
+        assert encoder.topic_suffix == ""
+        assert json.loads(encoder.encode({"Action": "Connect"}, 0)) == \
+            {"Action": "Connect", "Time": "1970-01-01T00:00:00"}
+
+    def test_cbor_topic(self):
+        assert get_encoder("cbor").topic_suffix == "/fmt/cbor"
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            get_encoder("xml")
+
+    def test_msgpack_not_installed(self, monkeypatch):
+        monkeypatch.setattr(encoding, "msgpack", None)
+
+        with pytest.raises(ValueError):
+            get_encoder("msgpack")
+
+    def test_msgpack(self):
+        msgpack = pytest.importorskip("msgpack")
+
+        encoded = get_encoder("msgpack").encode({"Action": "Connect"}, 1.5)
+        assert msgpack.unpackb(encoded, raw=False) == {"Action": "Connect", "Time": 1.5}
+
+    def test_msgpack_threads(self):
+        msgpack = pytest.importorskip("msgpack")
+        encoder = get_encoder("msgpack")
+
+        def encode(i):
+            return encoder.encode({"ClientID": "c{}".format(i) * 100}, float(i))
+
+        with ThreadPoolExecutor(8) as pool:
+            encoded = list(pool.map(encode, range(1000)))
+
+        for (i, value) in enumerate(encoded):
+            assert msgpack.unpackb(value, raw=False) == {"ClientID": "c{}".format(i) * 100, "Time": float(i)}
@@ -0,0 +1,138 @@
+from overlockmqttauth.flap import TimerWheel, FlapDebouncer
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimerWheel:
+
+    def test_fires(self):
+        wheel = TimerWheel(1, 4, 0)
+        wheel.schedule("a", 2)
+        wheel.schedule("b", 3)
+
+        assert wheel.advance(1) == []
+        assert wheel.advance(2) == ["a"]
+        assert wheel.advance(3) == ["b"]
+        assert len(wheel) == 0
+
+    def test_longer_than_wheel(self):
+        wheel = TimerWheel(1, 4, 0)
+        wheel.schedule("a", 10)
+
+        assert wheel.advance(9) == []
+        assert wheel.advance(10) == ["a"]
+
+    def test_cancel_and_reschedule(self):
+        wheel = TimerWheel(1, 4, 0)
+        wheel.schedule("a", 1)
+        wheel.schedule("b", 1)
+        wheel.cancel("b")
+        wheel.schedule("a", 3)
+
+        assert wheel.advance(2) == []
+        assert wheel.advance(3) == ["a"]
+
+    def test_idle(self):
+        wheel = TimerWheel(1, 4, 0)
+        assert wheel.advance(1000000) == []
+
+        wheel.schedule("a", 1)
+        assert wheel.advance(1000001) == ["a"]
+
+
+class TestFlapDebouncer:
+
+    def _debouncer(self, window=5):
+        published = []
+        timer = FakeTimer()
+        debouncer = FlapDebouncer(lambda t, p, ts: published.append((t, p)), window, tick=1, timer=timer)
+        return (debouncer, published, timer)
+
+    def test_first_event_straight_through(self):
+        (debouncer, published, _) = self._debouncer()
+
+        debouncer.put("a/mon", {"Action": "Connect"})
+        debouncer.put("b/mon", {"Action": "Connect"})
+
+        assert published == [("a/mon", {"Action": "Connect"}), ("b/mon", {"Action": "Connect"})]
+
+    def test_collapsed(self):
+        (debouncer, published, timer) = self._debouncer()
+
+        for action in ("Connect", "Disconnect", "Connect", "Disconnect"):
+            debouncer.put("a/mon", {"Action": action})
+
+        assert len(published) == 1
+
+        timer.now = 5
+        debouncer.advance()
+
+        assert published[1] == ("a/mon", {"Action": "Disconnect", "Flaps": 3})
+        assert debouncer.stats()["collapsed"] == 1
+
+        # Window closed, so the next one goes straight through
+        debouncer.put("a/mon", {"Action": "Connect"})
+        assert published[2] == ("a/mon", {"Action": "Connect"})
+
+    def test_event_during_close_published_after(self):
+        """A new event racing the window closing can't be overtaken by the
+        older collapsed one"""
+
+        published = []
+        timer = FakeTimer()
+
+        def publish(topic, payload, timestamp):
+            # Not holding up other hooks while publishing
+            assert not debouncer._lock.locked() # pylint: disable=protected-access
+
+            if payload.get("Flaps") == 1 and payload["Action"] == "Disconnect":
+                # Device reconnects while the collapsed Disconnect is being passed on
+                debouncer.put("a/mon", {"Action": "Connect"})
+            published.append((topic, payload))
+
+        debouncer = FlapDebouncer(publish, 5, tick=1, timer=timer)
+
+        for action in ("Connect", "Disconnect"):
+            debouncer.put("a/mon", {"Action": action})
+
+        timer.now = 5
+        debouncer.advance()
+
+        assert published == [
+            ("a/mon", {"Action": "Connect"}),
+            ("a/mon", {"Action": "Disconnect", "Flaps": 1}),
+        ]
+
+        # Held back until the window closes again
+        timer.now = 10
+        debouncer.advance()
+
+        assert published[2] == ("a/mon", {"Action": "Connect", "Flaps": 1})
+        assert debouncer.stats()["open_windows"] == 0
+
+    def test_same_state_suppressed(self):
+        (debouncer, published, timer) = self._debouncer()
+
+        for action in ("Connect", "Disconnect", "Connect"):
+            debouncer.put("a/mon", {"Action": action})
+
+        timer.now = 5
+        debouncer.advance()
+
+        assert len(published) == 1
+        assert debouncer.stats()["suppressed"] == 1
+
+    def test_disabled(self):
+        (debouncer, published, _) = self._debouncer(window=0)
+
+        debouncer.put("a/mon", {"Action": "Connect"})
+        debouncer.put("a/mon", {"Action": "Disconnect"})
+
+        assert len(published) == 2
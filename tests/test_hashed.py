@@ -0,0 +1,81 @@
+import pytest
+
+from overlockmqttauth.auth.mongodb.hashed import (HashedKeyAuth, HashedProjectKey,
+    add_project_key, remove_project_key, hash_existing_project_keys, hashed_keys_cache)
+from overlockmqttauth.auth.mongodb.overlock import Project
+from overlockmqttauth.auth.mongodb.util import mongo_connect
+from overlockmqttauth.connection import get_connection
+
+
+PROJECTID = "3b32154818bccbde03cfea45"
+USERNAME = "v1:{}:aircon:0xbeef".format(PROJECTID)
+PEPPER = b"pepper"
+
+
+@pytest.fixture(autouse=True)
+def fix_db(monkeypatch):
+    mongo_connect()
+    hashed_keys_cache.clear()
+    HashedProjectKey.objects().delete()
+    Project.objects().delete()
+
+    monkeypatch.setattr(HashedKeyAuth, "pepper", PEPPER)
+
+    yield
+
+    HashedProjectKey.objects().delete()
+    Project.objects().delete()
+
+
+def _authenticated(password, username=USERNAME):
+    return get_connection(username, password, "c1", auth_type="hashed").authenticated
+
+
+class TestHashedKeyAuth:
+
+    def test_matches(self):
+        add_project_key(PROJECTID, "p:abc", PEPPER)
+
+        assert _authenticated("p:abc")
+        assert not _authenticated("p:abcd")
+        assert not _authenticated("p:abc", "v1:3b32154818bccbde03cfea46:aircon:0xbeef")
+
+    def test_plaintext_not_stored(self):
+        add_project_key(PROJECTID, "p:abc", PEPPER)
+        add_project_key(PROJECTID, "p:abc", PEPPER)
+
+        docs = list(HashedProjectKey.objects())
+        assert len(docs) == 1
+        assert "abc" not in docs[0].key_hash
+
+    def test_removed(self):
+        add_project_key(PROJECTID, "p:abc", PEPPER)
+        assert _authenticated("p:abc")
+
+        remove_project_key(PROJECTID, "p:abc", PEPPER)
+        # Cached until invalidated
+        assert _authenticated("p:abc")
+
+        hashed_keys_cache.clear()
+        assert not _authenticated("p:abc")
+
+    def test_cached(self):
+        add_project_key(PROJECTID, "p:abc", PEPPER)
+
+        _authenticated("p:abc")
+        hits = hashed_keys_cache.stats()["hits"]
+        _authenticated("p:abc")
+
+        assert hashed_keys_cache.stats()["hits"] == hits + 1
+
+    def test_copy_existing(self):
+        Project(name="Project 123", id=PROJECTID, project_keys=["p:abc", "p:def"]).save()
+
+        assert hash_existing_project_keys(PEPPER) == 2
+        assert _authenticated("p:def")
+
+    def test_no_pepper(self, monkeypatch):
+        add_project_key(PROJECTID, "p:abc", PEPPER)
+        monkeypatch.setattr(HashedKeyAuth, "pepper", None)
+
+        assert not _authenticated("p:abc")
@@ -0,0 +1,52 @@
+from unittest.mock import patch
+
+import bcrypt
+import pytest
+
+from overlockmqttauth.auth.hashing import BcryptVerifier
+
+
+@pytest.fixture(name="passhash")
+def fix_passhash():
+    return bcrypt.hashpw(b"abc123", bcrypt.gensalt(rounds=4)).decode("utf8")
+
+
+class TestBcryptVerifier:
+
+    def test_match(self, passhash):
+        verifier = BcryptVerifier(workers=2)
+
+        assert verifier.verify("user", "abc123", passhash)
+        assert not verifier.verify("user", "def456", passhash)
+
+        stats = verifier.stats()
+        assert stats["checks"] == 2
+        assert stats["queued"] == 0
+        assert stats["running"] == 0
+
+    def test_remembered(self, passhash):
+        verifier = BcryptVerifier(workers=2)
+
+        assert not verifier.is_verified("user", "abc123")
+        assert verifier.verify("user", "abc123", passhash)
+        assert verifier.is_verified("user", "abc123")
+
+        with patch("bcrypt.checkpw") as mock_checkpw:
+            assert verifier.verify("user", "abc123", passhash)
+
+        assert not mock_checkpw.called
+
+    def test_wrong_password_not_remembered(self, passhash):
+        verifier = BcryptVerifier(workers=2)
+
+        assert verifier.verify("user", "abc123", passhash)
+        assert not verifier.is_verified("user", "def456")
+        assert not verifier.is_verified("other", "abc123")
+
+    def test_forget(self, passhash):
+        verifier = BcryptVerifier(workers=2)
+
+        verifier.verify("user", "abc123", passhash)
+        verifier.forget("user")
+
+        assert not verifier.is_verified("user", "abc123")
@@ -0,0 +1,59 @@
+import json
+from unittest.mock import Mock
+
+from overlockmqttauth import invalidation
+from overlockmqttauth.auth.cache import MISSING
+from overlockmqttauth.auth.mongodb import vmq
+
+
+def _message(payload):
+    msg = Mock()
+    msg.payload = payload
+    return msg
+
+
+class TestInvalidation:
+
+    def test_message_evicts_project(self):
+        vmq.project_keys_cache.set("pid123", frozenset(["p:abc"]))
+
+        invalidation.on_invalidation_message(None, None, _message(
+            json.dumps({"kind": "project", "key": "pid123"}).encode("utf8")))
+
+        assert vmq.project_keys_cache.get("pid123") is MISSING
+
+    def test_message_forgets_user(self):
+        vmq.bcrypt_verifier._verified.set("user", b"digest")
+
+        invalidation.on_invalidation_message(None, None, _message(
+            json.dumps({"kind": "user", "key": "user"}).encode("utf8")))
+
+        assert vmq.bcrypt_verifier._verified.get("user") is MISSING
+
+    def test_invalid_message_ignored(self):
+        invalidation.on_invalidation_message(None, None, _message(b"{"))
+        invalidation.on_invalidation_message(None, None, _message(b"{}"))
+
+    def test_publish(self):
+        vmq.project_keys_cache.set("pid123", frozenset(["p:abc"]))
+        client = Mock()
+
+        invalidation.publish_invalidation(client, "project", "pid123")
+
+        # Evicted locally straight away, as well as being broadcast
+        assert vmq.project_keys_cache.get("pid123") is MISSING
+        client.publish.assert_called_once_with(
+            invalidation.INVALIDATION_TOPIC,
+            json.dumps({"kind": "project", "key": "pid123"}),
+            qos=1,
+        )
+
+    def test_subscribed_on_connect(self):
+        from overlockmqttauth.client import mqtt_connect
+
+        client = Mock()
+        mqtt_connect(client, None, None, 0)
+
+        client.subscribe.assert_any_call(invalidation.INVALIDATION_TOPIC, qos=1)
+        client.message_callback_add.assert_called_once_with(
+            invalidation.INVALIDATION_TOPIC, invalidation.on_invalidation_message)
@@ -0,0 +1,185 @@
+import contextlib
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import pytest
+import werkzeug.serving
+
+from overlockmqttauth.brokers.prefork import PreforkSupervisor
+from overlockmqttauth.brokers.server import HookServer
+
+
+# Set in the worker by post_fork
+_post_fork_pid = None
+
+
+def _post_fork():
+    global _post_fork_pid # pylint: disable=global-statement
+    _post_fork_pid = os.getpid()
+
+
+def _pid_app(environ, start_response):
+    if environ["PATH_INFO"] == "/slow":
+        time.sleep(1.5)
+
+    start_response("200 OK", [("Content-Type", "application/json")])
+    return [json.dumps({
+        "pid": os.getpid(),
+        "supervisor": os.getppid(),
+        "post_fork": _post_fork_pid == os.getpid(),
+    }).encode("utf8")]
+
+
+async def _async_pid(payload): # pylint: disable=unused-argument
+    return {"pid": os.getpid()}
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _get(port, path="/"):
+    for _ in range(50):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("POST", path, body=b"{}")
+            return json.loads(conn.getresponse().read().decode("utf8"))
+        except ConnectionError:
+            time.sleep(0.1)
+
+    raise AssertionError("server never came up")
+
+
+def _get_pid(port, path="/"):
+    return _get(port, path)["pid"]
+
+
+def _hook_server(app, sock):
+    return HookServer(app, sock=sock, threads=2)
+
+
+def _async_hook_server(app, sock):
+    return HookServer(app, sock=sock, threads=2, async_routes={"/async": _async_pid})
+
+
+def _slow_hook_server(app, sock):
+    time.sleep(1)
+    return _hook_server(app, sock)
+
+
+def _werkzeug_server(app, sock):
+    return werkzeug.serving.make_server("127.0.0.1", 0, app, threaded=True, fd=sock.fileno())
+
+
+@contextlib.contextmanager
+def _supervisor(workers=2, make_server=_hook_server, **kwargs):
+    port = _free_port()
+
+    supervisor = PreforkSupervisor(
+        make_server,
+        _pid_app,
+        workers,
+        "127.0.0.1",
+        port,
+        post_fork=_post_fork,
+        **kwargs
+    )
+
+    ctx = multiprocessing.get_context("fork")
+    process = ctx.Process(target=supervisor.run)
+    process.start()
+
+    try:
+        yield port
+    finally:
+        process.terminate()
+        process.join(10)
+
+    assert process.exitcode == 0
+
+
+@pytest.fixture(name="supervisor_port", params=[False, True], ids=["inherit", "reuseport"])
+def fix_supervisor(request):
+    with _supervisor(reuse_port=request.param) as port:
+        yield port
+
+
+class TestPrefork:
+
+    def test_served_by_workers(self, supervisor_port):
+        """Requests are served by forked workers, not the supervisor"""
+        pids = {_get_pid(supervisor_port) for _ in range(20)}
+
+        assert pids
+        assert os.getpid() not in pids
+
+    def test_post_fork_in_worker(self, supervisor_port):
+        assert all(_get(supervisor_port)["post_fork"] for _ in range(10))
+
+    def test_max_requests(self):
+        """A worker is replaced once it has served max_requests"""
+
+        with _supervisor(workers=1, max_requests=5) as port:
+            pids = [_get_pid(port) for _ in range(5)]
+            assert len(set(pids)) == 1
+
+            # Later requests are served by its replacement
+            replacement = _get_pid(port)
+            deadline = time.monotonic() + 10
+            while replacement == pids[0]:
+                assert time.monotonic() < deadline, "Worker never replaced"
+                time.sleep(0.1)
+                replacement = _get_pid(port)
+
+            assert _get(port)["post_fork"]
+
+    def test_max_requests_async_routes(self):
+        """Requests to async routes count towards max_requests"""
+
+        with _supervisor(workers=1, make_server=_async_hook_server, max_requests=5) as port:
+            pids = [_get_pid(port, "/async") for _ in range(5)]
+            assert len(set(pids)) == 1
+
+            replacement = _get_pid(port, "/async")
+            deadline = time.monotonic() + 10
+            while replacement == pids[0]:
+                assert time.monotonic() < deadline, "Worker never replaced"
+                time.sleep(0.1)
+                replacement = _get_pid(port, "/async")
+
+    @pytest.mark.parametrize("make_server", [_hook_server, _werkzeug_server], ids=["asyncio", "flask"])
+    def test_recycle_finishes_requests(self, make_server):
+        """Requests in flight when a worker is recycled are still answered"""
+
+        with _supervisor(workers=1, make_server=make_server, max_requests=2) as port:
+            pid = _get_pid(port)
+
+            # Hits the limit as soon as it starts, without retrying
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("POST", "/slow", body=b"{}")
+            assert json.loads(conn.getresponse().read().decode("utf8"))["pid"] == pid
+
+    def test_sighup_recycles_one_at_a_time(self):
+        """The old worker keeps serving until its replacement has started"""
+
+        with _supervisor(workers=1, make_server=_slow_hook_server) as port:
+            response = _get(port)
+            os.kill(response["supervisor"], signal.SIGHUP)
+
+            deadline = time.monotonic() + 0.5
+            while time.monotonic() < deadline:
+                assert _get_pid(port) == response["pid"]
+
+            deadline = time.monotonic() + 10
+            while _get_pid(port) == response["pid"]:
+                assert time.monotonic() < deadline, "Worker never replaced"
+                time.sleep(0.1)
@@ -0,0 +1,148 @@
+from unittest.mock import patch
+
+import bcrypt
+import pytest
+
+from overlockmqttauth.auth.hashing import BcryptVerifier
+from overlockmqttauth.auth.rediscache import RedisCache
+from overlockmqttauth.auth.mongodb import vmq
+
+
+class FakePipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def setex(self, key, ttl, value):
+        self.commands.append((key, ttl, value))
+
+    def execute(self):
+        self.redis.round_trips += 1
+        for (key, ttl, value) in self.commands:
+            self.redis.data[key] = value.encode("utf8")
+            self.redis.ttls[key] = ttl
+
+
+class FakeRedis:
+    """Just enough of redis.StrictRedis"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.round_trips = 0
+
+    def mget(self, keys):
+        self.round_trips += 1
+        return [self.data.get(k) for k in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def delete(self, key):
+        self.round_trips += 1
+        self.data.pop(key, None)
+
+
+class BrokenRedis:
+
+    def mget(self, keys):
+        raise ConnectionError("redis down")
+
+    def pipeline(self, transaction=True):
+        raise ConnectionError("redis down")
+
+
+@pytest.fixture(name="fake_redis")
+def fix_fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture(name="cache")
+def fix_cache(fake_redis):
+    return RedisCache(fake_redis, "test", 300, negative_ttl=10,
+        encode=sorted, decode=frozenset)
+
+
+class TestRedisCache:
+
+    def test_round_trip(self, cache, fake_redis):
+        cache.set_many({"a": frozenset(["x", "y"]), "b": None})
+
+        assert fake_redis.ttls == {"test:a": 300, "test:b": 10}
+        assert cache.get_many(["a", "b", "c"]) == {"a": {"x", "y"}, "b": None}
+        assert cache.stats() == {"hits": 2, "misses": 1, "errors": 0}
+
+    def test_get_or_load_batched(self, cache, fake_redis):
+        cache.set_many({"a": frozenset(["x"])})
+        fake_redis.round_trips = 0
+
+        loaded = []
+
+        def load_many(keys):
+            loaded.extend(keys)
+            return {k: frozenset([k]) for k in keys}
+
+        result = cache.get_or_load(["a", "b", "c"], load_many)
+
+        assert result == {"a": {"x"}, "b": {"b"}, "c": {"c"}}
+        assert loaded == ["b", "c"]
+        # One read, one pipelined write
+        assert fake_redis.round_trips == 2
+
+    def test_redis_down(self):
+        cache = RedisCache(BrokenRedis(), "test", 300)
+
+        assert cache.get_many(["a"]) == {}
+        cache.set_many({"a": 1})
+        assert cache.get_or_load(["a"], lambda keys: {"a": 2}) == {"a": 2}
+        assert cache.stats()["errors"] == 4
+
+
+class TestProjectKeysL2:
+
+    def test_cold_cache_uses_redis(self, cache):
+        vmq.project_keys_cache.clear()
+        cache.set_many({"pid123": frozenset(["p:abc"])})
+
+        with patch("overlockmqttauth.auth.mongodb.vmq.project_keys_l2", cache), \
+                patch("overlockmqttauth.auth.mongodb.vmq.load_project_keys") as mock_load:
+            assert vmq.get_project_keys("pid123") == {"p:abc"}
+
+        vmq.project_keys_cache.clear()
+
+        assert not mock_load.called
+
+    def test_loaded_into_redis(self, cache):
+        vmq.project_keys_cache.clear()
+
+        with patch("overlockmqttauth.auth.mongodb.vmq.project_keys_l2", cache), \
+                patch("overlockmqttauth.auth.mongodb.vmq.load_project_keys",
+                    return_value=frozenset(["p:abc"])):
+            assert vmq.get_project_keys("pid123") == {"p:abc"}
+
+        vmq.project_keys_cache.clear()
+
+        assert cache.get_many(["pid123"]) == {"pid123": {"p:abc"}}
+
+
+class TestSharedVerifications:
+
+    @pytest.fixture(name="shared")
+    def fix_shared(self, fake_redis):
+        return RedisCache(fake_redis, "verified", 60,
+            encode=lambda digest: digest.hex(), decode=bytes.fromhex)
+
+    def test_shared_between_replicas(self, shared):
+        passhash = bcrypt.hashpw(b"abc123", bcrypt.gensalt(rounds=4)).decode("utf8")
+
+        first = BcryptVerifier(workers=1, key=b"shared", shared=shared)
+        second = BcryptVerifier(workers=1, key=b"shared", shared=shared)
+
+        assert first.verify("user", "abc123", passhash)
+        assert second.is_verified("user", "abc123")
+        assert not second.is_verified("user", "def456")
+
+        first.forget("user")
+        third = BcryptVerifier(workers=1, key=b"shared", shared=shared)
+        assert not third.is_verified("user", "abc123")
@@ -0,0 +1,135 @@
+import asyncio
+import contextlib
+import http.client
+import json
+import threading
+
+import pytest
+from flask import Flask, request, jsonify
+
+from overlockmqttauth.brokers.server import HookServer
+
+
+@pytest.fixture(name="echo_app")
+def fix_echo_app():
+    app = Flask(__name__)
+
+    @app.route("/auth_on_register", methods=["POST"])
+    def auth_on_register():
+        return jsonify({
+            "result": "ok",
+            "client_id": request.json["client_id"],
+        })
+
+    return app
+
+
+@contextlib.contextmanager
+def _running(server):
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+        loop.run_until_complete(server.stop())
+        loop.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait(5)
+
+    yield server.sockets[0].getsockname()[1]
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+@pytest.fixture(name="server_port")
+def fix_server(echo_app):
+    server = HookServer(echo_app, "127.0.0.1", 0, threads=4, keepalive_timeout=5)
+
+    with _running(server) as port:
+        yield port
+
+
+def _post(conn, client_id):
+    conn.request(
+        "POST",
+        "/auth_on_register",
+        body=json.dumps({"client_id": client_id}),
+        headers={"Content-Type": "application/json"},
+    )
+    response = conn.getresponse()
+    return response, json.loads(response.read().decode("utf8"))
+
+
+class TestHookServer:
+
+    def test_keepalive(self, server_port):
+        """Multiple requests are served over the same connection"""
+        conn = http.client.HTTPConnection("127.0.0.1", server_port)
+
+        response, body = _post(conn, "abc")
+        assert response.status == 200
+        assert body == {"result": "ok", "client_id": "abc"}
+
+        sock = conn.sock
+
+        response, body = _post(conn, "def")
+        assert response.status == 200
+        assert body == {"result": "ok", "client_id": "def"}
+
+        # http.client reconnects if the server closed it
+        assert conn.sock is sock
+
+        conn.close()
+
+    def test_connection_close(self, server_port):
+        conn = http.client.HTTPConnection("127.0.0.1", server_port)
+        conn.request(
+            "POST",
+            "/auth_on_register",
+            body=json.dumps({"client_id": "abc"}),
+            headers={"Content-Type": "application/json", "Connection": "close"},
+        )
+        response = conn.getresponse()
+
+        assert response.status == 200
+        assert response.getheader("Connection") == "close"
+
+    def test_not_found(self, server_port):
+        conn = http.client.HTTPConnection("127.0.0.1", server_port)
+        conn.request("POST", "/on_nothing", body=b"{}")
+        response = conn.getresponse()
+        response.read()
+
+        assert response.status == 404
+
+    def test_async_routes(self, echo_app):
+        """Async routes are awaited instead of going to the WSGI app"""
+
+        async def auth_on_register(payload):
+            await asyncio.sleep(0)
+            return {"result": "ok", "async": payload["client_id"]}
+
+        server = HookServer(echo_app, "127.0.0.1", 0, threads=4, keepalive_timeout=5,
+            async_routes={"/auth_on_register": auth_on_register})
+
+        with _running(server) as port:
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+
+            response, body = _post(conn, "abc")
+            assert response.status == 200
+            assert body == {"result": "ok", "async": "abc"}
+
+            # Bad JSON
+            conn.request("POST", "/auth_on_register", body=b"{",
+                headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 400
+
+            conn.close()
@@ -0,0 +1,46 @@
+from overlockmqttauth.acl import Identity
+from overlockmqttauth.sessions import SessionTable
+
+
+class TestSessionTable:
+
+    def test_add_get(self):
+        table = SessionTable()
+        table.add("v1:pid123:aircon:0xbeef", "c1", "", project_id="pid123",
+            device=("pid123", "aircon", "0xbeef"))
+
+        session = table.get("", "c1")
+        assert session.identity == Identity("v1:pid123:aircon:0xbeef", "c1", "")
+        assert session.project_id == "pid123"
+        assert session.device == ("pid123", "aircon", "0xbeef")
+
+        # Keyed on mountpoint too
+        assert table.get("other", "c1") is None
+
+        assert table.stats()["hits"] == 1
+        assert table.stats()["misses"] == 1
+
+    def test_pop(self):
+        table = SessionTable()
+        table.add("u", "c1")
+
+        assert table.pop("", "c1").username == "u"
+        assert table.get("", "c1") is None
+        assert table.pop("", "c1") is None
+
+    def test_lru(self):
+        table = SessionTable(maxsize=2)
+        table.add("u", "c1")
+        table.add("u", "c2")
+        table.get("", "c1")
+        table.add("u", "c3")
+
+        assert table.get("", "c2") is None
+        assert table.get("", "c1") is not None
+        assert table.stats()["evictions"] == 1
+
+    def test_disabled(self):
+        table = SessionTable(maxsize=0)
+
+        assert table.add("u", "c1").username == "u"
+        assert table.get("", "c1") is None
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from overlockmqttauth.auth.singleflight import SingleFlight, AsyncSingleFlight
+from overlockmqttauth.auth.mongodb import vmq
+
+
+class TestSingleFlight:
+
+    def test_concurrent_calls_shared(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def lookup(key):
+            calls.append(key)
+            release.wait(5)
+            return key.upper()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(flight.do("abc", lookup, "abc")))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Wait for everyone to be waiting on the first call
+        deadline = time.monotonic() + 5
+        while flight.stats()["shared"] < 9:
+            assert time.monotonic() < deadline, "Calls never shared"
+            time.sleep(0.001)
+        release.set()
+
+        for thread in threads:
+            thread.join()
+
+        assert calls == ["abc"]
+        assert results == ["ABC"] * 10
+        assert flight.stats() == {"calls": 1, "shared": 9, "in_flight": 0}
+
+    def test_error_propagated(self):
+        flight = SingleFlight()
+
+        def lookup():
+            raise KeyError("abc")
+
+        with pytest.raises(KeyError):
+            flight.do("abc", lookup)
+
+        # Not remembered
+        assert flight.do("abc", lambda: 1) == 1
+
+    def test_different_keys(self):
+        flight = SingleFlight()
+
+        assert flight.do("a", lambda: 1) == 1
+        assert flight.do("b", lambda: 2) == 2
+        assert flight.stats()["calls"] == 2
+
+
+class TestAsyncSingleFlight:
+
+    def test_concurrent_calls_shared(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def lookup(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return key.upper()
+
+        async def run():
+            return await asyncio.gather(*[flight.do("abc", lookup, "abc") for _ in range(10)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        assert calls == ["abc"]
+        assert results == ["ABC"] * 10
+
+
+class TestProjectKeysFlight:
+
+    def test_one_query_for_concurrent_connects(self):
+        vmq.project_keys_cache.clear()
+        release = threading.Event()
+        shared = vmq.project_keys_flight.stats()["shared"]
+
+        def slow_load(project_id):
+            release.wait(5)
+            return frozenset(["p:abc"])
+
+        results = []
+
+        with patch("overlockmqttauth.auth.mongodb.vmq.load_project_keys",
+                side_effect=slow_load) as mock_load:
+            threads = [
+                threading.Thread(target=lambda: results.append(vmq.get_project_keys("pid123")))
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+
+            # Hold the load until the other four are waiting on it
+            deadline = time.monotonic() + 5
+            while vmq.project_keys_flight.stats()["shared"] - shared < 4:
+                assert time.monotonic() < deadline, "Lookups never shared"
+                time.sleep(0.001)
+            release.set()
+
+            for thread in threads:
+                thread.join()
+
+        vmq.project_keys_cache.clear()
+
+        assert mock_load.call_count == 1
+        assert results == [frozenset(["p:abc"])] * 5
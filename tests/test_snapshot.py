@@ -0,0 +1,64 @@
+import uuid
+
+import pytest
+
+from overlockmqttauth.auth.mongodb.util import mongo_connect
+from overlockmqttauth.auth.mongodb.overlock import Project
+from overlockmqttauth.auth.mongodb.snapshot import ProjectKeysSnapshot
+
+
+PROJECTID = "3b32154818bccbde03cfea45"
+OTHER_PROJECTID = "3b32154818bccbde03cfea46"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def fix_mongo_connect():
+    mongo_connect()
+
+
+@pytest.fixture(name="project")
+def fix_project():
+    Project.objects().delete()
+    p = Project(
+        name="Project 123",
+        id=PROJECTID,
+        project_keys=["p:{}".format(uuid.uuid4())],
+    )
+    p.save()
+
+    yield p
+
+    Project.objects().delete()
+
+
+class TestProjectKeysSnapshot:
+
+    def test_load(self, project):
+        snapshot = ProjectKeysSnapshot(batch_size=1)
+        snapshot.load()
+
+        assert snapshot.get(PROJECTID) == set(project.project_keys)
+        assert snapshot.get(OTHER_PROJECTID) is None
+
+    def test_load_new(self, project):
+        snapshot = ProjectKeysSnapshot()
+        snapshot.load()
+
+        Project(name="Project 456", id=OTHER_PROJECTID, project_keys=["p:abc"]).save()
+        snapshot.load_new()
+
+        assert snapshot.get(OTHER_PROJECTID) == {"p:abc"}
+        assert snapshot.get(PROJECTID) == set(project.project_keys)
+
+    def test_changed_keys_need_full_load(self, project):
+        snapshot = ProjectKeysSnapshot()
+        snapshot.load()
+
+        project.project_keys = ["p:def"]
+        project.save()
+
+        snapshot.load_new()
+        assert snapshot.get(PROJECTID) != {"p:def"}
+
+        snapshot.load()
+        assert snapshot.get(PROJECTID) == {"p:def"}
@@ -0,0 +1,158 @@
+import os
+
+from overlockmqttauth.spool import Spool, SpoolingPublisher, claim_spool_dir
+
+
+class Recorder:
+
+    def __init__(self, fail_after=None):
+        self.published = []
+        self.fail_after = fail_after
+
+    def __call__(self, topic, message):
+        if self.fail_after is not None and len(self.published) >= self.fail_after:
+            return False
+        self.published.append((topic, message))
+        return True
+
+
+def _fill(spool, count, start=0):
+    for i in range(start, start + count):
+        spool.append("a/{}/mon".format(i), '{{"n": {}}}'.format(i))
+
+
+class TestSpool:
+
+    def test_replay_in_order(self, tmpdir):
+        spool = Spool(str(tmpdir))
+        _fill(spool, 5)
+
+        recorder = Recorder()
+        assert spool.replay(recorder) == 5
+        assert recorder.published == [("a/{}/mon".format(i), '{{"n": {}}}'.format(i).encode())
+            for i in range(5)]
+        assert spool.empty
+
+    def test_segments(self, tmpdir):
+        spool = Spool(str(tmpdir), segment_size=100)
+        _fill(spool, 20)
+        assert spool.stats()["segments"] > 1
+
+        recorder = Recorder()
+        assert spool.replay(recorder) == 20
+        assert [t for (t, _) in recorder.published] == ["a/{}/mon".format(i) for i in range(20)]
+
+        # Replayed segments are deleted
+        assert spool.stats()["segments"] == 1
+
+    def test_stops_on_failure(self, tmpdir):
+        spool = Spool(str(tmpdir), segment_size=100)
+        _fill(spool, 10)
+
+        assert spool.replay(Recorder(fail_after=3)) == 3
+        assert not spool.empty
+
+        recorder = Recorder()
+        assert spool.replay(recorder) == 7
+        assert recorder.published[0][0] == "a/3/mon"
+
+    def test_limit(self, tmpdir):
+        spool = Spool(str(tmpdir))
+        _fill(spool, 10)
+
+        assert spool.replay(Recorder(), limit=4) == 4
+        assert spool.pending() == 6
+
+    def test_reopen(self, tmpdir):
+        spool = Spool(str(tmpdir), segment_size=100)
+        _fill(spool, 10)
+        spool.replay(Recorder(), limit=4)
+        spool.close()
+
+        spool = Spool(str(tmpdir), segment_size=100)
+        _fill(spool, 2, start=10)
+
+        recorder = Recorder()
+        assert spool.replay(recorder) == 8
+        assert [t for (t, _) in recorder.published] == ["a/{}/mon".format(i) for i in range(4, 12)]
+
+    def test_torn_write(self, tmpdir):
+        spool = Spool(str(tmpdir))
+        _fill(spool, 3)
+        spool.close()
+
+        # Process died half way through writing a record
+        [segment] = [n for n in os.listdir(str(tmpdir)) if n.endswith(".seg")]
+        with open(os.path.join(str(tmpdir), segment), "ab") as f:
+            f.write(b"\x40\x00\x00\x00\x00")
+
+        spool = Spool(str(tmpdir))
+        _fill(spool, 1, start=3)
+
+        recorder = Recorder()
+        assert spool.replay(recorder) == 4
+        assert spool.stats()["corrupt_segments"] == 1
+
+    def test_max_bytes(self, tmpdir):
+        spool = Spool(str(tmpdir), segment_size=100, max_bytes=250)
+        _fill(spool, 30)
+
+        stats = spool.stats()
+        assert stats["dropped"] > 0
+        assert stats["bytes"] <= 250 + 100
+
+        recorder = Recorder()
+        spool.replay(recorder)
+        # Oldest were dropped, the newest kept
+        assert recorder.published[-1][0] == "a/29/mon"
+        assert len(recorder.published) + stats["dropped"] == 30
+
+
+class TestClaim:
+
+    def test_separate_dirs(self, tmpdir):
+        # flock locks are per open file, so this works within one process
+        first = claim_spool_dir(str(tmpdir))
+        second = claim_spool_dir(str(tmpdir))
+
+        assert first != second
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.connected = False
+        self.published = []
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, message):
+        self.published.append((topic, message))
+
+        class Info:
+            rc = 0
+
+        return Info()
+
+
+class TestSpoolingPublisher:
+
+    def test_spools_while_disconnected(self, tmpdir):
+        client = FakeClient()
+        publisher = SpoolingPublisher(lambda: client, Spool(str(tmpdir)))
+
+        publisher("a/mon", "1")
+        publisher("b/mon", "2")
+        assert not client.published
+
+        client.connected = True
+        # Still goes after the spooled ones
+        publisher("c/mon", "3")
+        assert not client.published
+
+        assert publisher.replay() == 3
+        assert [t for (t, _) in client.published] == ["a/mon", "b/mon", "c/mon"]
+
+        publisher("d/mon", "4")
+        assert client.published[-1] == ("d/mon", "4")
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+
+import pytest
+
+from overlockmqttauth.status import StatusPublisher, BLOCK, DROP_OLDEST, DROP_NEWEST
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.published = []
+        # Hold up publishing until set
+        self.go = threading.Event()
+        self.go.set()
+
+    def __call__(self, topic, payload):
+        self.go.wait(5)
+        self.published.append((topic, json.loads(payload)))
+
+
+@pytest.fixture(name="client")
+def fix_client():
+    return FakeClient()
+
+
+class TestStatusPublisher:
+
+    def test_publishes(self, client):
+        publisher = StatusPublisher(client)
+
+        assert publisher.put("a/mon", {"Action": "Connect"})
+        assert publisher.flush(5)
+
+        [(topic, payload)] = client.published
+        assert topic == "a/mon"
+        assert payload["Action"] == "Connect"
+        assert "Time" in payload
+        assert publisher.stats()["published"] == 1
+
+    def test_inline(self, client):
+        publisher = StatusPublisher(client, maxsize=0)
+
+        publisher.put("a/mon", {"Action": "Connect"})
+        assert len(client.published) == 1
+
+    def _stalled(self, client, policy, maxsize=2, **kwargs):
+        """Publisher whose thread is stuck publishing 'stuck/mon'"""
+
+        client.go.clear()
+        publisher = StatusPublisher(client, maxsize=maxsize, policy=policy, **kwargs)
+
+        publisher.put("stuck/mon", {})
+        # Wait for the thread to take it off the queue
+        while len(publisher):
+            time.sleep(0.001)
+
+        return publisher
+
+    def test_coalesces(self, client):
+        publisher = self._stalled(client, DROP_NEWEST)
+
+        publisher.put("a/mon", {"Action": "Connect"})
+        publisher.put("b/mon", {"Action": "Connect"})
+        publisher.put("a/mon", {"Action": "Disconnect"})
+
+        client.go.set()
+        assert publisher.flush(5)
+
+        assert [(t, p["Action"]) for (t, p) in client.published[1:]] == \
+            [("b/mon", "Connect"), ("a/mon", "Disconnect")]
+        assert publisher.stats()["coalesced"] == 1
+
+    def test_drop_oldest(self, client):
+        publisher = self._stalled(client, DROP_OLDEST)
+
+        for topic in ("a/mon", "b/mon", "c/mon"):
+            assert publisher.put(topic, {})
+
+        client.go.set()
+        assert publisher.flush(5)
+
+        assert [t for (t, _) in client.published[1:]] == ["b/mon", "c/mon"]
+        assert publisher.stats()["dropped_oldest"] == 1
+
+    def test_drop_newest(self, client):
+        publisher = self._stalled(client, DROP_NEWEST)
+
+        assert publisher.put("a/mon", {})
+        assert publisher.put("b/mon", {})
+        assert not publisher.put("c/mon", {})
+
+        client.go.set()
+        assert publisher.flush(5)
+
+        assert [t for (t, _) in client.published[1:]] == ["a/mon", "b/mon"]
+        assert publisher.stats()["dropped_newest"] == 1
+
+    def test_block(self, client):
+        publisher = self._stalled(client, BLOCK, maxsize=1, block_timeout=0.01)
+
+        assert publisher.put("a/mon", {})
+        # Times out
+        assert not publisher.put("b/mon", {})
+
+        # Space is made while waiting
+        threading.Timer(0.05, client.go.set).start()
+        publisher.block_timeout = 5
+        assert publisher.put("c/mon", {})
+
+        assert publisher.flush(5)
+        assert [t for (t, _) in client.published[1:]] == ["a/mon", "c/mon"]
+
+    def test_errors_counted(self):
+        def publish(topic, payload):
+            raise RuntimeError("not connected")
+
+        publisher = StatusPublisher(publish)
+        publisher.put("a/mon", {})
+        assert publisher.flush(5)
+
+        assert publisher.stats()["errors"] == 1
+
+    def test_invalid_policy(self, client):
+        with pytest.raises(ValueError):
+            StatusPublisher(client, policy="drop-everything")
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from overlockmqttauth.api import parse_connection
+from overlockmqttauth.auth.mongodb.overlock import Project, SigningKey
+from overlockmqttauth.auth.mongodb.tokens import TokenAuth, signing_keys_cache, load_signing_keys
+from overlockmqttauth.auth.mongodb.util import mongo_connect
+from overlockmqttauth.auth.tokens import sign_token, verify_token
+from overlockmqttauth.connection import get_connection
+
+
+PROJECTID = "3b32154818bccbde03cfea45"
+USERNAME = "v2:{}:aircon:0xbeef".format(PROJECTID)
+KEYS = {"k1": b"secret1", "k2": b"secret2"}
+
+
+def _credentials(username, password):
+    return parse_connection(username, password).credentials
+
+
+class TestVerifyToken:
+
+    def test_valid(self):
+        password = sign_token(KEYS["k2"], "k2", USERNAME, time.time() + 60)
+        assert verify_token(_credentials(USERNAME, password), KEYS)
+
+    def test_expired(self):
+        password = sign_token(KEYS["k1"], "k1", USERNAME, 1000)
+        assert not verify_token(_credentials(USERNAME, password), KEYS, now=1000)
+        assert verify_token(_credentials(USERNAME, password), KEYS, now=999)
+
+    def test_wrong_key(self):
+        password = sign_token(b"other", "k1", USERNAME, time.time() + 60)
+        assert not verify_token(_credentials(USERNAME, password), KEYS)
+
+    def test_unknown_key(self):
+        password = sign_token(KEYS["k1"], "k3", USERNAME, time.time() + 60)
+        assert not verify_token(_credentials(USERNAME, password), KEYS)
+
+    def test_other_device(self):
+        password = sign_token(KEYS["k1"], "k1", USERNAME, time.time() + 60)
+        other = "v2:{}:aircon:0xf00d".format(PROJECTID)
+        assert not verify_token(_credentials(other, password), KEYS)
+
+    def test_extended_expiry(self):
+        password = sign_token(KEYS["k1"], "k1", USERNAME, 1000)
+        (key_id, _, signature) = password[2:].split(".")
+        forged = "t:{}.{}.{}".format(key_id, 2000, signature)
+        assert not verify_token(_credentials(USERNAME, forged), KEYS, now=1500)
+
+    @pytest.mark.parametrize("password", [
+        "t:abc",
+        "t:k1.soon.abc",
+        "p:abc",
+    ])
+    def test_malformed(self, password):
+        assert not verify_token(_credentials(USERNAME, password), KEYS)
+
+    def test_invalid_key_id(self):
+        with pytest.raises(ValueError):
+            sign_token(KEYS["k1"], "k.1", USERNAME, 1000)
+
+
+@pytest.fixture(name="project")
+def fix_project():
+    mongo_connect()
+    signing_keys_cache.clear()
+
+    Project.objects().delete()
+    p = Project(
+        name="Project 123",
+        id=PROJECTID,
+        signing_keys=[SigningKey(key_id="k1", key="secret1")],
+    )
+    p.save()
+
+    yield p
+
+    Project.objects().delete()
+
+
+class TestTokenAuth:
+
+    def test_load_keys(self, project):
+        assert load_signing_keys(PROJECTID) == {"k1": b"secret1"}
+        assert load_signing_keys("3b32154818bccbde03cfea46") is None
+        assert load_signing_keys("not an id") is None
+
+    def test_connection(self, project):
+        password = sign_token(b"secret1", "k1", USERNAME, time.time() + 60)
+        conn = get_connection(USERNAME, password, "c1")
+
+        # pylint: disable=protected-access
+        assert isinstance(conn._auth, TokenAuth)
+        assert conn.authenticated
+        assert not conn.blacklisted
+
+    def test_keys_cached(self, project):
+        password = sign_token(b"secret1", "k1", USERNAME, time.time() + 60)
+        assert get_connection(USERNAME, password, "c1").authenticated
+
+        # Cached, so still valid until the cache expires or is invalidated
+        Project.objects(id=PROJECTID).update(set__signing_keys=[])
+        assert get_connection(USERNAME, password, "c1").authenticated
+
+        signing_keys_cache.invalidate(PROJECTID)
+        assert not get_connection(USERNAME, password, "c1").authenticated
+
+    def test_no_project(self, project):
+        username = "v2:3b32154818bccbde03cfea46:aircon:0xbeef"
+        password = sign_token(b"secret1", "k1", username, time.time() + 60)
+        assert not get_connection(username, password, "c1").authenticated